@@ -0,0 +1,317 @@
+import os
+import re
+import time
+import errno
+import struct
+import ctypes
+import logging
+import threading
+import ctypes.util
+import configparser
+from collections import namedtuple
+import alarm_metrics
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+default_config_file = "alarm_clock.conf" #Read by main 1.6.py, main_display1.2.py and the web pages (index.php)
+config_file_environment_variable = "ALARM_CLOCK_CONFIG" #Path of another config file
+config_poll_interval = 5 #Seconds between checks of the config file if inotify is not available (not Linux)
+settle_time = 0.2 #Seconds to wait after a change of the file, editors often write it in several steps
+
+#GPIO.BOARD pins that can be used as input
+board_gpio_pins = {3, 5, 7, 8, 10, 11, 12, 13, 15, 16, 18, 19, 21, 22, 23, 24, 26, 29, 31, 32, 33, 35, 36, 37, 38, 40}
+
+#Linux constants for inotify
+in_close_write = 0x8
+in_moved_to = 0x80
+in_create = 0x100
+in_delete = 0x200
+in_cloexec = 0o2000000
+inotify_event_header = struct.Struct("iIII") #wd, mask, cookie, length of the name
+
+#Metrics (see alarm_metrics.py)
+config_reloads = alarm_metrics.registry.counter("alarm_config_reloads_total", "Changes of the config file, applied or rejected because they were invalid", ["result"])
+
+#--------------------------------------------------Values-------------------------------------------------#
+
+#Every parser returns the value of a setting or raises ValueError with a message for the user
+
+def whole_number(minimum=None, maximum=None):
+    def parse(text):
+        value = int(text)
+        if ((minimum is not None and value < minimum) or (maximum is not None and value > maximum)):
+            raise ValueError(f"has to be between {minimum} and {maximum}" if maximum is not None else f"has to be at least {minimum}")
+        return value
+    return parse
+
+def positive_number(text):
+    value = float(text)
+    if not value > 0:
+        raise ValueError("has to be greater than 0")
+    return value
+
+def boolean(text):
+    if text.lower() not in configparser.ConfigParser.BOOLEAN_STATES:
+        raise ValueError("has to be yes or no")
+    return configparser.ConfigParser.BOOLEAN_STATES[text.lower()]
+
+def pin(text):
+    value = int(text)
+    if value not in board_gpio_pins:
+        raise ValueError(f"{value} is not a GPIO pin (GPIO.BOARD numbering)")
+    return value
+
+port = whole_number(1, 65535)
+
+#Returns (hour, minute) of "HH:MM"
+def clock_time(text):
+    match = re.match(r"^([01]?\d|2[0-3]):([0-5]\d)$", text)
+    if not match:
+        raise ValueError("has to be a time like 06:00")
+    return int(match.group(1)), int(match.group(2))
+
+def file_name(text):
+    if (not text or "/" in text or text.startswith(".")):
+        raise ValueError("has to be a file name without directory")
+    return text
+
+def directory(text):
+    if not text:
+        raise ValueError("must not be empty")
+    return text
+
+#---------------------------------------------------Schema------------------------------------------------#
+
+#(section, name, parser, default) of every setting, the name is the same in the config file and in Config
+schema = [
+    ("api", "api_server_port", port, 8080), #Port of the HTTP API server (ignored when systemd passes the socket)
+    ("api", "long_poll_timeout", positive_number, 25), #Longest time GET /status?version=N waits for a change
+    ("api", "web_directory", directory, "var.www.html/"), #The web pages the API server serves on / (see web_ui.py)
+
+    ("alarms", "default_snooze_duration", whole_number(1), 10), #Seconds, used if the web form sends none and for alarms set on the main display
+    ("alarms", "default_ringtone", file_name, "main_audio.wav"), #Ringtone of alarms set on the main display, preselected on the web page
+    ("alarms", "prearm_seconds", whole_number(0, 3600), 60), #The ringtone, audio output, buttons and LCD are checked this long before an alarm rings (0 = off)
+
+    ("ringtones", "ringtone_directory", directory, "audios/"), #Every .wav file in here can be picked as ringtone
+    ("ringtones", "uploaded_ringtone", file_name, "custom_audio.wav"), #Ringtone name uploads are stored as
+    ("ringtones", "normalize_ringtones", boolean, True), #Play all ringtones at the same loudness (needs numpy)
+
+    ("buttons", "stop_button", pin, 8),
+    ("buttons", "snooze_button", pin, 10),
+    ("buttons", "ok_button", pin, 16),
+    ("buttons", "down_button", pin, 18),
+    ("buttons", "up_button", pin, 22),
+    ("buttons", "menu_button", pin, 24),
+    ("buttons", "button_debounce_ms", whole_number(0, 1000), 50), #Presses closer together than this are ignored (contact bounce)
+    ("buttons", "long_press_time", positive_number, 1), #Seconds UP/DOWN has to be held before the time changes in fast steps
+
+    ("display", "daylight_resistor_pin", pin, 11),
+    ("display", "dark_threshold", positive_number, 100), #Charge time of the light sensor (ms) above which the backlight is turned off
+    ("display", "backlight_check_interval", positive_number, 2), #Seconds between brightness readings
+    ("display", "default_alarm_time", clock_time, (6, 0)), #Time shown when the menu is opened the first time
+    ("display", "menu_time_increment", whole_number(1, 60), 1), #Minutes per UP/DOWN press
+    ("display", "menu_fast_increment", whole_number(1, 60), 5), #Steps per repeat while UP/DOWN is held down
+]
+
+#Labels of the ringtones on the web page (file name = label), files without one are shown with their file name
+ringtone_names_section = "ringtone_names"
+
+#Every setting that is a GPIO pin, no two may share a pin
+pin_settings = [name for section, name, parser, default in schema if parser is pin]
+
+#Settings of one moment, never changed: a new file gives a new Config that replaces the old one as a whole,
+#so code that reads several settings from one Config never sees half of an update
+Config = namedtuple("Config", [name for section, name, parser, default in schema] + ["ringtone_names"])
+
+defaults = Config(**{name: default for section, name, parser, default in schema}, ringtone_names={})
+
+class ConfigError(Exception):
+    pass
+
+#Returns the path of the config file, ALARM_CLOCK_CONFIG can point to another one
+def config_path():
+    return os.environ.get(config_file_environment_variable, default_config_file)
+
+#Reads and checks the config file, returns a Config
+#Settings missing in the file keep their default, a missing file gives the defaults
+#Raises ConfigError listing every problem (syntax, unknown settings, invalid values, pins used twice)
+def load_config(path):
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str #File names in [ringtone_names] keep their case
+    try:
+        with open(path, "r") as config_file:
+            parser.read_file(config_file)
+    except FileNotFoundError:
+        log.info("No config file '%s', using the defaults", path)
+        return defaults
+    except configparser.Error as error:
+        raise ConfigError(f"{path}: {error}")
+
+    values = defaults._asdict()
+    known = {(section, name): parser_function for section, name, parser_function, default in schema}
+    errors = []
+
+    for section in parser.sections():
+        if (section == ringtone_names_section):
+            values["ringtone_names"] = dict(parser.items(section))
+            continue
+        for name, text in parser.items(section):
+            parse = known.get((section, name))
+            if parse is None:
+                errors.append(f"[{section}] {name}: unknown setting")
+                continue
+            try:
+                values[name] = parse(text.strip())
+            except ValueError as error:
+                errors.append(f"[{section}] {name} = {text}: {error}")
+
+    used_pins = {}
+    for name in pin_settings:
+        if values[name] in used_pins:
+            errors.append(f"{name} and {used_pins[values[name]]} both use pin {values[name]}")
+        used_pins.setdefault(values[name], name)
+
+    if errors:
+        raise ConfigError(f"{path}: " + "; ".join(errors))
+    return Config(**values)
+
+#----------------------------------------------------Watcher----------------------------------------------#
+
+#Loads the config file again whenever it changes and calls on_change(config) with the new Config (in the watcher thread)
+#On Linux the directory of the file is watched with inotify, so the thread sleeps in read() until a file in it
+#is written, renamed or deleted (editors often save by renaming a temporary file over the old one)
+#Other systems compare the modification time every config_poll_interval seconds
+#An invalid file is logged and ignored, the last valid settings stay in use until the file is fixed
+class ConfigWatcher:
+
+    def __init__(self, path, on_change):
+        self.path = path
+        self.on_change = on_change
+        self.config = defaults
+        self.thread = None
+
+    #Loads the file once and starts watching it, returns the Config (the defaults if the file is invalid)
+    def start(self):
+        try:
+            self.config = load_config(self.path)
+        except ConfigError as error:
+            log.error("Invalid config, using the defaults: %s", error)
+        self.thread = threading.Thread(target=self._watch, name="config-watcher", daemon=True)
+        self.thread.start()
+        return self.config
+
+    #Loads the file and calls on_change() if a setting changed
+    def reload(self):
+        try:
+            config = load_config(self.path)
+        except ConfigError as error:
+            log.error("Invalid config, keeping the previous settings: %s", error)
+            config_reloads.inc(result="invalid")
+            return
+        except OSError as error:
+            log.error("Could not read the config file '%s': %s", self.path, error)
+            config_reloads.inc(result="invalid")
+            return
+
+        if (config == self.config):
+            return
+        changed = [name for name in Config._fields if getattr(config, name) != getattr(self.config, name)]
+        self.config = config
+        log.info("Config changed: %s", ", ".join(changed))
+        config_reloads.inc(result="applied")
+        self.on_change(config)
+
+    def _watch(self):
+        directory_path = os.path.dirname(os.path.abspath(self.path))
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            watch_descriptor = libc.inotify_init1(in_cloexec)
+            if (watch_descriptor < 0):
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            if (libc.inotify_add_watch(watch_descriptor, directory_path.encode(), in_close_write | in_moved_to | in_create | in_delete) < 0):
+                os.close(watch_descriptor)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+        except (OSError, AttributeError) as error:
+            log.info("inotify not available (%s), checking the config file every %s s", error, config_poll_interval)
+            self._poll()
+            return
+
+        file_name = os.path.basename(self.path).encode()
+        while True:
+            try:
+                data = os.read(watch_descriptor, 4096)
+            except OSError as error:
+                if (error.errno == errno.EINTR):
+                    continue
+                raise
+
+            if file_name in self._changed_names(data):
+                #Let the editor finish writing, the events of that are read and dropped
+                time.sleep(settle_time)
+                os.set_blocking(watch_descriptor, False)
+                try:
+                    while os.read(watch_descriptor, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                os.set_blocking(watch_descriptor, True)
+                self.reload()
+
+    #Returns the file names of the inotify events in data
+    def _changed_names(self, data):
+        names = set()
+        offset = 0
+        while offset < len(data):
+            watch, mask, cookie, length = inotify_event_header.unpack_from(data, offset)
+            offset += inotify_event_header.size
+            names.add(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+        return names
+
+    def _poll(self):
+        last_state = self._file_state()
+        while True:
+            time.sleep(config_poll_interval)
+            state = self._file_state()
+            if (state != last_state):
+                last_state = state
+                self.reload()
+
+    def _file_state(self):
+        try:
+            status = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return status.st_ino, status.st_mtime_ns, status.st_size
+
+#---------------------------------------------------Ringtones---------------------------------------------#
+
+#The ringtones that can be picked: every .wav file in the ringtone directory
+#The list is read again only when the directory changed (its modification time changes when a file is added,
+#removed or renamed), so asking for it on every request costs one stat()
+class RingtoneCatalog:
+
+    def __init__(self):
+        self.cache_key = None
+        self.names = []
+        self.lock = threading.Lock()
+
+    #Returns the sorted file names of the ringtones in directory_path
+    def ringtones(self, directory_path):
+        try:
+            key = directory_path, os.stat(directory_path).st_mtime_ns
+        except OSError:
+            key = directory_path, None
+
+        with self.lock:
+            if (key != self.cache_key):
+                try:
+                    names = sorted(entry.name for entry in os.scandir(directory_path) if entry.name.lower().endswith(".wav") and entry.is_file())
+                except OSError as error:
+                    log.error("Could not read the ringtone directory '%s': %s", directory_path, error)
+                    names = []
+                self.cache_key, self.names = key, names
+            return list(self.names)
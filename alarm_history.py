@@ -0,0 +1,245 @@
+import os
+import time
+import mmap
+import bisect
+import struct
+import statistics
+import threading
+import collections
+import logging
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+history_capacity = 8192 #Events kept, the oldest are overwritten (about 5 per wake: ring, snoozes, stop, so several years)
+default_stats_days = 30 #Days GET /history/stats covers if ?days= is not given
+max_stats_days = 3660
+default_query_limit = 100 #Events GET /history returns if ?limit= is not given
+query_chunk = 256 #Records a query unpacks at once, from the newest back until it has enough events
+
+#Buckets of the time to stop distribution, seconds from the first ring until the alarm was stopped
+time_to_stop_buckets = [60, 300, 600, 900, 1800, 3600]
+week_days = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+#Events (kind of a record)
+event_set = "set" #Alarm added
+event_removed = "removed" #Alarm removed over the API
+event_rang = "rang" #Alarm started ringing (also again after a snooze)
+event_snoozed = "snoozed"
+event_stopped = "stopped" #Stopped while ringing or snoozed, seconds is the time to stop
+event_skipped = "skipped" #Stopped before it rang
+event_kinds = [event_set, event_removed, event_rang, event_snoozed, event_stopped, event_skipped]
+
+#Where an event came from
+sources = ["", "button", "http", "display"]
+
+#Layout: header, then history_capacity records of record_size bytes
+#Header: magic, layout version, record size, capacity, sequence number of the next record
+#Record: sequence number, wall clock time, alarm id, kind, source, ring hour, ring minute, snoozes so far, seconds since the first ring
+#A slot is only valid while its sequence number is the one expected for it, so empty and overwritten slots are never read
+magic = b"ALRMHIST"
+layout_version = 1
+header_format = struct.Struct("<8sHHIQ")
+header_size = 32
+record_format = struct.Struct("<QdIBBBBHf2x")
+record_size = record_format.size
+no_ring_time = 255 #Ring hour and minute of events without an alarm
+
+#--------------------------------------------------History------------------------------------------------#
+
+#Bounded history of alarm events in a memory mapped ring buffer of fixed size records
+#The file has the same size forever, new events overwrite the oldest. A record is written before the header
+#points past it, so a crash at any moment leaves a consistent history (the kernel writes the mapped pages back, a
+#crash of the program loses nothing, a power loss at most the last seconds)
+#Records are in the order they happened, queries find the start of a time range by binary search and only unpack
+#the records inside it
+#All methods can be called from any thread
+class EventHistory:
+
+    def __init__(self, path, capacity=history_capacity):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stats_cache = (None, None)
+
+        descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(descriptor).st_size
+            if (size >= header_size):
+                found_magic, found_version, found_record_size, found_capacity, next_sequence = header_format.unpack(os.pread(descriptor, header_format.size, 0))
+                if (found_magic, found_version, found_record_size) != (magic, layout_version, record_size):
+                    raise ValueError(f"'{path}' is not an event history of this version")
+                if (found_capacity != capacity):
+                    log.info("Event history '%s' keeps %s events (history_capacity only applies to new files)", path, found_capacity)
+                capacity = found_capacity
+            else:
+                next_sequence = 1
+                os.ftruncate(descriptor, header_size + capacity * record_size)
+                os.pwrite(descriptor, header_format.pack(magic, layout_version, record_size, capacity, next_sequence), 0)
+            self.memory = mmap.mmap(descriptor, header_size + capacity * record_size)
+        finally:
+            os.close(descriptor)
+
+        self.capacity = capacity
+        self.next_sequence = next_sequence
+        #Records written just before a crash, before the header was updated
+        while self._read(self.next_sequence) is not None:
+            self.next_sequence += 1
+        log.info("Event history '%s' holds %s event(s)", path, self.next_sequence - self.first_sequence())
+
+    #Sequence number of the oldest record that is still kept
+    def first_sequence(self):
+        return max(1, self.next_sequence - self.capacity)
+
+    #Returns the record with the sequence number or None if the slot holds another one
+    def _read(self, sequence):
+        record = record_format.unpack_from(self.memory, header_size + (sequence % self.capacity) * record_size)
+        return record if record[0] == sequence else None
+
+    #Adds an event, alarm is the Alarm it belongs to (or None), seconds the time since the alarm first rang
+    def record(self, kind, alarm=None, source=None, snoozes=0, seconds=0, event_time=None):
+        hour, minute = (alarm.hour, alarm.minute) if alarm is not None else (no_ring_time, no_ring_time)
+        with self.lock:
+            sequence = self.next_sequence
+            record_format.pack_into(self.memory, header_size + (sequence % self.capacity) * record_size,
+                sequence, event_time if event_time is not None else time.time(), getattr(alarm, "alarm_id", None) or 0,
+                event_kinds.index(kind), sources.index(source or ""), hour, minute, min(snoozes, 0xFFFF), seconds)
+            self.next_sequence = sequence + 1
+            header_format.pack_into(self.memory, 0, magic, layout_version, record_size, self.capacity, self.next_sequence)
+
+    #Returns the sequence numbers (start, stop) of the records with since <= time < until
+    #Times are only searched, not sorted: events of a wall clock that was set back may land a few minutes off
+    def _range(self, since=None, until=None):
+        with self.lock:
+            first, end = self.first_sequence(), self.next_sequence
+            times = _TimeIndex(self, first)
+            start = first + bisect.bisect_left(times, since, 0, end - first) if since is not None else first
+            stop = first + bisect.bisect_left(times, until, 0, end - first) if until is not None else end
+            return start, stop
+
+    #Returns the records from sequence number start to stop (excluded), records overwritten meanwhile are left out
+    def _records(self, start, stop):
+        with self.lock:
+            #At most two slices: up to the end of the file and from its start again
+            records = []
+            position = start
+            while position < stop:
+                slot = position % self.capacity
+                count = min(stop - position, self.capacity - slot)
+                data = self.memory[header_size + slot * record_size:header_size + (slot + count) * record_size]
+                records.extend(record for offset, record in enumerate(record_format.iter_unpack(data)) if record[0] == position + offset)
+                position += count
+            return records
+
+    #Returns the events with since <= time < until (unix times) as dicts, newest first
+    #kind and alarm_id filter the events, limit is the number of events returned at most
+    def query(self, since=None, until=None, kind=None, alarm_id=None, limit=default_query_limit):
+        kind_index = event_kinds.index(kind) if kind is not None else None
+        start, stop = self._range(since, until)
+        newest = []
+        while (stop > start and len(newest) < limit):
+            chunk_start = max(start, stop - query_chunk)
+            for record in reversed(self._records(chunk_start, stop)):
+                if ((kind_index is None or record[3] == kind_index) and (alarm_id is None or record[2] == alarm_id)):
+                    newest.append(record)
+            stop = chunk_start
+        return [to_dict(record) for record in newest[:max(limit, 0)]]
+
+    #Returns aggregate statistics of the last days: wakes, snoozes per day and wake, the time to stop distribution,
+    #stops by source and the same per week day
+    #The result is cached until a new event is recorded or the next minute starts
+    def stats(self, days=default_stats_days, now=None):
+        now = now if now is not None else time.time()
+        key = days, self.next_sequence, int(now // 60)
+        cached_key, cached_stats = self.stats_cache
+        if (cached_key == key):
+            return cached_stats
+
+        records = self._records(*self._range(now - days * 86400))
+        with self.lock:
+            oldest = self._read(self.first_sequence())
+        #Averages per day only count the days the history covers
+        covered_days = max(min(days, (now - oldest[1]) / 86400 if oldest else 0), 1)
+
+        time_to_stop = []
+        snoozes = skipped = 0
+        stops_by_source = collections.Counter()
+        per_day = [{"wakes": 0, "snoozes": 0, "time_to_stop": []} for _ in week_days]
+        snoozed, stopped, skipped_kind = event_kinds.index(event_snoozed), event_kinds.index(event_stopped), event_kinds.index(event_skipped)
+        for sequence, event_time, alarm_id, kind, source, hour, minute, snooze_count, seconds in records:
+            if (kind == snoozed):
+                snoozes += 1
+                per_day[datetime.fromtimestamp(event_time).weekday()]["snoozes"] += 1
+            elif (kind == stopped):
+                time_to_stop.append(seconds)
+                stops_by_source[sources[source] or "other"] += 1
+                week_day = per_day[datetime.fromtimestamp(event_time).weekday()]
+                week_day["wakes"] += 1
+                week_day["time_to_stop"].append(seconds)
+            elif (kind == skipped_kind):
+                skipped += 1
+
+        wakes = len(time_to_stop)
+        result = {
+            "days": days,
+            "covered_days": round(covered_days, 2),
+            "events": len(records),
+            "wakes": wakes,
+            "skipped": skipped,
+            "snoozes": snoozes,
+            "snoozes_per_day": round(snoozes / covered_days, 2),
+            "snoozes_per_wake": round(snoozes / wakes, 2) if wakes else None,
+            "time_to_stop": summarize(time_to_stop),
+            "stops_by_source": dict(stops_by_source),
+            "week_days": [{"day": name, "wakes": day["wakes"], "snoozes": day["snoozes"], "median_time_to_stop": round(statistics.median(day["time_to_stop"]), 1) if day["time_to_stop"] else None}
+                for name, day in zip(week_days, per_day)],
+        }
+        self.stats_cache = key, result
+        return result
+
+    def close(self):
+        with self.lock:
+            self.memory.flush()
+            self.memory.close()
+
+#Times of the kept records for bisect, unpacks only the records the search looks at
+class _TimeIndex:
+
+    def __init__(self, history, first):
+        self.history = history
+        self.first = first
+
+    def __getitem__(self, index):
+        sequence = self.first + index
+        return record_format.unpack_from(self.history.memory, header_size + (sequence % self.history.capacity) * record_size)[1]
+
+#Median, 90th percentile, maximum and bucket counts of the times to stop
+def summarize(seconds):
+    if not seconds:
+        return {"median": None, "p90": None, "max": None, "buckets": []}
+    ordered = sorted(seconds)
+    counts = [0] * (len(time_to_stop_buckets) + 1)
+    for value in ordered:
+        counts[bisect.bisect_left(time_to_stop_buckets, value)] += 1
+    return {
+        "median": round(statistics.median(ordered), 1),
+        "p90": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))], 1),
+        "max": round(ordered[-1], 1),
+        "buckets": [{"up_to": limit, "count": count} for limit, count in zip(time_to_stop_buckets + [None], counts)],
+    }
+
+def to_dict(record):
+    sequence, event_time, alarm_id, kind, source, hour, minute, snoozes, seconds = record
+    return {
+        "sequence": sequence,
+        "time": datetime.fromtimestamp(event_time).isoformat(timespec="seconds"),
+        "timestamp": event_time,
+        "kind": event_kinds[kind],
+        "alarm": alarm_id or None,
+        "ring_time": f"{hour:02}:{minute:02}" if hour != no_ring_time else None,
+        "source": sources[source] or None,
+        "snoozes": snoozes,
+        "seconds": round(seconds, 1),
+    }
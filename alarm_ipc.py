@@ -0,0 +1,233 @@
+import socket
+import threading
+import json
+import time
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+ipc_socket_path = "status_files/alarm_ipc.sock" #Unix domain socket the main program publishes the alarm status on
+reconnect_delay = 1 #Seconds the main display waits before trying to reconnect to the main program
+
+#--------------------------------------------------Helpers------------------------------------------------#
+
+#Every message is one JSON object per line, e.g. {"type": "state", "ring_time": "06:00", ...}
+def encode_message(message):
+    return (json.dumps(message) + "\n").encode("utf-8")
+
+def decode_message(line):
+    try:
+        message = json.loads(line.decode("utf-8"))
+    except ValueError:
+        log.warning("Received malformed IPC message: %r", line)
+        return None
+
+    if not isinstance(message, dict):
+        return None
+    return message
+
+#-------------------------------------------------Publisher-----------------------------------------------#
+
+#Runs inside the main program
+#Pushes every status change to all connected main displays and forwards their messages to on_message
+#When a main display disconnects, on_message gets {"type": "disconnected"}
+class StatusPublisher:
+
+    #server_socket can be a listening socket opened by systemd (socket activation), socket_path is not used then
+    def __init__(self, socket_path=ipc_socket_path, on_message=None, server_socket=None):
+        self.socket_path = socket_path
+        self.on_message = on_message
+        self.clients = []
+        self.last_state = None
+        self.lock = threading.Lock()
+        self.server_socket = server_socket
+
+    #True while at least one main display is connected
+    def has_clients(self):
+        with self.lock:
+            return bool(self.clients)
+
+    def start(self):
+        if self.server_socket is None:
+            #Remove a socket file left over from a previous run
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+            self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server_socket.bind(self.socket_path)
+            self.server_socket.listen()
+        else:
+            self.socket_path = self.server_socket.getsockname() or self.socket_path
+
+        threading.Thread(target=self._accept_clients, name="ipc-accept", daemon=True).start()
+        log.info("Publishing alarm status on '%s'", self.socket_path)
+
+    #Sends the given state to every connected client, never blocks (called on the event loop of the main program)
+    def publish(self, state):
+        message = dict(state)
+        message["type"] = "state"
+        message["sent_at"] = time.time()
+        data = encode_message(message)
+
+        with self.lock:
+            self.last_state = message
+            for client in list(self.clients):
+                self._send(client, data)
+
+    def close(self):
+        with self.lock:
+            for client in list(self.clients):
+                self._drop_client(client)
+        if self.server_socket:
+            self.server_socket.close()
+            self.server_socket = None
+
+    #Sends without waiting (the socket stays blocking for the reading thread): a main display that stalls and lets
+    #its socket buffer fill up is dropped like a browser in status_stream.py, it reconnects and gets the current state
+    def _send(self, client, data):
+        try:
+            if (client.send(data, socket.MSG_DONTWAIT) == len(data)):
+                return True
+            log.warning("Dropped a main display that did not keep up with the status updates")
+        except BlockingIOError:
+            log.warning("Dropped a main display that did not keep up with the status updates")
+        except OSError:
+            pass
+        self._drop_client(client)
+        return False
+
+    def _drop_client(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+        try:
+            #Wakes the thread reading the socket, close() alone does not
+            client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            client.close()
+        except OSError:
+            pass
+
+    def _accept_clients(self):
+        while self.server_socket:
+            try:
+                client, _ = self.server_socket.accept()
+            except OSError:
+                return
+
+            with self.lock:
+                self.clients.append(client)
+
+                #New clients get the current state right away instead of waiting for the next change
+                if (self.last_state and not self._send(client, encode_message(self.last_state))):
+                    continue
+
+            threading.Thread(target=self._read_client, args=(client,), name="ipc-client", daemon=True).start()
+
+    #Blocks on the socket, so an idle client costs no CPU
+    def _read_client(self, client):
+        try:
+            with client.makefile("rb") as stream:
+                for line in stream:
+                    message = decode_message(line)
+                    if message and self.on_message:
+                        self.on_message(message)
+        except OSError:
+            pass
+
+        with self.lock:
+            self._drop_client(client)
+        if self.on_message:
+            self.on_message({"type": "disconnected"})
+
+#------------------------------------------------Subscriber-----------------------------------------------#
+
+#Runs inside the main display
+#Keeps the latest state received from the main program and wakes up waiting threads when it changes
+#on_update is called (from the receiving thread) after every change, including a lost connection
+class StatusSubscriber:
+
+    def __init__(self, socket_path=ipc_socket_path, on_update=None):
+        self.socket_path = socket_path
+        self.on_update = on_update
+        self.state = None
+        self.version = 0
+        self.connected = False
+        self.last_latency = None #Seconds between the main program sending a state and the display receiving it
+        self.max_latency = 0
+        self.condition = threading.Condition()
+        self.client_socket = None
+
+    def start(self):
+        threading.Thread(target=self._receive_loop, name="ipc-receive", daemon=True).start()
+
+    #Blocks until a state newer than known_version arrives or the timeout expires
+    #Returns the newest version number
+    def wait_for_update(self, known_version, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != known_version, timeout)
+            return self.version
+
+    #Sends a message to the main program, returns False if it is not reachable
+    def send(self, message):
+        client_socket = self.client_socket
+        if not self.connected or client_socket is None:
+            return False
+        try:
+            client_socket.sendall(encode_message(message))
+            return True
+        except OSError:
+            return False
+
+    def _receive_loop(self):
+        while True:
+            try:
+                client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                client_socket.connect(self.socket_path)
+            except OSError:
+                client_socket.close()
+                time.sleep(reconnect_delay)
+                continue
+
+            self.client_socket = client_socket
+            self.connected = True
+            log.info("Connected to main program on '%s'", self.socket_path)
+
+            try:
+                with client_socket.makefile("rb") as stream:
+                    for line in stream:
+                        message = decode_message(line)
+                        if message and message.get("type") == "state":
+                            self._store_state(message)
+            except OSError:
+                pass
+
+            self.connected = False
+            self.client_socket = None
+            client_socket.close()
+
+            #Wake up waiting threads so they can fall back to the status file
+            with self.condition:
+                self.state = None
+                self.version += 1
+                self.condition.notify_all()
+            if self.on_update:
+                self.on_update()
+
+            log.warning("Lost connection to main program. Reconnecting...")
+            time.sleep(reconnect_delay)
+
+    def _store_state(self, message):
+        with self.condition:
+            self.last_latency = time.time() - message.get("sent_at", time.time())
+            self.max_latency = max(self.max_latency, self.last_latency)
+            self.state = message
+            self.version += 1
+            self.condition.notify_all()
+        if self.on_update:
+            self.on_update()
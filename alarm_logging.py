@@ -0,0 +1,47 @@
+import os
+import sys
+import logging
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+log_level_environment_variable = "ALARM_CLOCK_LOG_LEVEL" #DEBUG shows the hot path messages (every request, every LCD write, ...)
+default_log_level = "INFO"
+
+#Same colors as the old print() messages
+level_colors = {
+    logging.DEBUG: "\033[90m",
+    logging.WARNING: "\033[33m",
+    logging.ERROR: "\033[91m",
+    logging.CRITICAL: "\033[91m",
+}
+
+#-------------------------------------------------Logging-------------------------------------------------#
+
+#Colors warnings and errors when the output is a terminal, plain text otherwise (e.g. in the systemd journal)
+class ColorFormatter(logging.Formatter):
+
+    def __init__(self, colored):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s", "%H:%M:%S")
+        self.colored = colored
+
+    def format(self, record):
+        message = super().format(record)
+        color = level_colors.get(record.levelno)
+        if (self.colored and color):
+            return f"{color}{message}\033[0m"
+        return message
+
+#Sends all log messages to stdout, level is a name like "DEBUG" or "WARNING" (default: ALARM_CLOCK_LOG_LEVEL or INFO)
+#Messages below the level are dropped before they are formatted, so debug messages cost next to nothing when switched off
+def setup_logging(level=None):
+    level = (level or os.environ.get(log_level_environment_variable) or default_log_level).upper()
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(ColorFormatter(sys.stdout.isatty()))
+
+    root_logger = logging.getLogger()
+    for old_handler in list(root_logger.handlers):
+        root_logger.removeHandler(old_handler)
+    root_logger.addHandler(handler)
+    root_logger.setLevel(level)
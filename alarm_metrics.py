@@ -0,0 +1,162 @@
+import bisect
+import threading
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) #Histogram buckets in seconds
+metrics_content_type = "text/plain; version=0.0.4; charset=utf-8" #Prometheus text format
+
+#-------------------------------------------------Metrics-------------------------------------------------#
+
+#Counters, gauges and histograms that are cheap enough to stay on all the time: updating one is a dict lookup
+#and an addition under a lock, nothing is formatted until the metrics are rendered (GET /metrics)
+#Labels are passed as keyword arguments, e.g. stops.inc(source="button")
+
+#A value that only goes up
+class Counter:
+
+    kind = "counter"
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.buckets = ()
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+    #Plain data (JSON compatible), so metrics of another process can be sent over IPC and rendered here
+    def snapshot(self):
+        with self.lock:
+            values = [[list(key), self._copy(value)] for key, value in self.values.items()]
+        return {"name": self.name, "kind": self.kind, "description": self.description, "labels": list(self.label_names), "buckets": list(self.buckets), "values": values}
+
+    def _copy(self, value):
+        return value
+
+#A value that can go up and down, e.g. the last brightness reading
+class Gauge(Counter):
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+#Counts observations (e.g. latencies) in buckets, plus their sum and count
+class Histogram(Counter):
+
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=default_buckets):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(key)
+            if data is None:
+                data = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+#---------------------------------------------------Render------------------------------------------------#
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+#Lines of one metric snapshot, extra_labels (e.g. the process) are added to every sample
+def render_samples(snapshot, extra_labels):
+    lines = []
+    name = snapshot["name"]
+    for key, value in sorted(snapshot["values"]):
+        pairs = list(extra_labels) + list(zip(snapshot["labels"], key))
+        if (snapshot["kind"] != Histogram.kind):
+            lines.append(f"{name}{format_labels(pairs)} {value}")
+            continue
+
+        bucket_counts, total, count = value
+        cumulative = 0
+        for bound, bucket_count in zip(snapshot["buckets"] + ["+Inf"], bucket_counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{format_labels(pairs + [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(pairs)} {total}")
+        lines.append(f"{name}_count{format_labels(pairs)} {count}")
+    return lines
+
+#Holds all metrics of one process
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    #Returns the metric with this name, creating it on first use
+    def _get(self, metric_class, name, *arguments):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(name, *arguments)
+            return metric
+
+    def counter(self, name, description, labels=()):
+        return self._get(Counter, name, description, labels)
+
+    def gauge(self, name, description, labels=()):
+        return self._get(Gauge, name, description, labels)
+
+    def histogram(self, name, description, labels=(), buckets=default_buckets):
+        return self._get(Histogram, name, description, labels, buckets)
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return [metric.snapshot() for metric in metrics]
+
+    #All metrics in the Prometheus text format, every sample is labeled with the process it comes from
+    #remote maps a process name to a snapshot() received from that process
+    def render(self, process, remote={}):
+        sources = [(process, self.snapshot())] + list(remote.items())
+
+        #Samples of the same metric have to be grouped under one HELP/TYPE header
+        grouped = {}
+        for source, snapshots in sources:
+            for snapshot in snapshots:
+                grouped.setdefault(snapshot["name"], []).append((source, snapshot))
+
+        lines = []
+        for name, entries in grouped.items():
+            first = entries[0][1]
+            lines.append(f"# HELP {name} {first['description']}")
+            lines.append(f"# TYPE {name} {first['kind']}")
+            for source, snapshot in entries:
+                lines.extend(render_samples(snapshot, [("process", source)]))
+        return "\n".join(lines) + "\n"
+
+#The metrics of this process
+registry = MetricsRegistry()
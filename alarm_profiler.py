@@ -0,0 +1,243 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import threading
+import collections
+import logging
+from datetime import datetime
+import alarm_metrics
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+sample_interval = 0.02 #Seconds between two samples of all threads
+max_profile_seconds = 600 #A profile that is not stopped ends on its own after this many seconds
+max_stack_depth = 64 #Deeper stacks lose their outermost frames
+max_stacks = 20000 #Different stacks kept per profile, further ones are counted as "[other]"
+profile_directory = "status_files" #Finished profiles are written here as <process>_<time>.folded
+toggle_signal = getattr(signal, "SIGUSR1", None) #kill -USR1 <pid> starts a profile, the next one stops it and writes the file
+
+#What a sample counts
+mode_cpu = "cpu" #Only threads that used CPU since the last sample, weighted by the CPU time (microseconds) they used
+mode_wall = "wall" #Every thread in every sample, also while it waits (shows where threads block)
+modes = [mode_cpu, mode_wall]
+
+#Metrics (see alarm_metrics.py)
+thread_cpu = alarm_metrics.registry.gauge("alarm_thread_cpu_seconds", "CPU time used by every thread since it started, threads with the same name are added up", ["thread"])
+
+#---------------------------------------------------CPU time----------------------------------------------#
+
+#Returns the CPU seconds of a running thread, None if the system can't tell (not Linux or the thread just ended)
+def thread_cpu_time(thread_id):
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+    except (AttributeError, OSError):
+        return None
+
+#Returns thread name -> CPU seconds since the thread started for every running thread
+#Threads with the same name (e.g. one per IPC client) are added up
+def thread_cpu_times():
+    times = collections.Counter()
+    for thread in threading.enumerate():
+        cpu_time = thread_cpu_time(thread.ident)
+        if cpu_time is not None:
+            times[thread.name] += cpu_time
+    return dict(times)
+
+#Sets alarm_thread_cpu_seconds to the current CPU times, called before the metrics are rendered or sent
+def update_thread_cpu_metrics():
+    for name, cpu_time in thread_cpu_times().items():
+        thread_cpu.set(round(cpu_time, 3), thread=name)
+
+#-------------------------------------------------Profiler------------------------------------------------#
+
+#Samples the stacks of all threads of the process from a background thread while a profile runs
+#Costs nothing while stopped. While running, each sample takes the current frame of every thread, the profiler
+#thread itself is left out and its CPU time is reported as overhead
+#Stacks are counted in the collapsed format flame graph tools read ("thread;outer;...;inner count" per line,
+#e.g. flamegraph.pl or speedscope). Samples of the event loop thread name the asyncio task that was running
+#start(), stop() and toggle() can be called from any thread and from a signal handler
+class SamplingProfiler:
+
+    #loop is the event loop of the thread that creates the profiler, its running task is added to that thread's stacks
+    def __init__(self, process, loop=None):
+        self.process = process
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident() if loop is not None else None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_requested = threading.Event()
+        self.stacks = collections.Counter()
+        self.task_samples = collections.Counter()
+        self.thread_samples = collections.Counter()
+        self.samples = 0
+        self.mode = mode_cpu
+        self.interval = sample_interval
+        self.started_at = None
+        self.ended_at = None
+        self.start_cpu = {}
+        self.end_cpu = {}
+        self.profiler_start_cpu = 0
+        self.profiler_cpu = 0
+        self.last_file = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    #Starts a profile, returns False if one is already running
+    def start(self, interval=sample_interval, seconds=max_profile_seconds, mode=mode_cpu):
+        if mode not in modes:
+            raise ValueError(f"mode has to be one of {', '.join(modes)}")
+        if not interval > 0 or not seconds > 0:
+            raise ValueError("interval and seconds have to be greater than 0")
+
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks = collections.Counter()
+            self.task_samples = collections.Counter()
+            self.thread_samples = collections.Counter()
+            self.samples = 0
+            self.mode, self.interval = mode, interval
+            self.started_at, self.ended_at = time.time(), None
+            self.start_cpu, self.end_cpu = thread_cpu_times(), {}
+            self.stop_requested.clear()
+            self.thread = threading.Thread(target=self._run, args=(seconds,), name="profiler", daemon=True)
+            self.thread.start()
+        log.info("Profiling %s (%s, every %.0f ms, for at most %g s)", self.process, mode, interval * 1000, seconds)
+        return True
+
+    #Stops the profile and waits until its file is written, returns the path of the file (None if nothing ran)
+    def stop(self):
+        with self.lock:
+            thread = self.thread
+        if (thread is None or not thread.is_alive()):
+            return None
+        self.stop_requested.set()
+        thread.join()
+        return self.last_file
+
+    #Starts a profile or stops the running one (used by the signal handler)
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    #kill -USR1 <pid> toggles the profiler, for programs without an event loop (signal.signal() runs it in the main thread)
+    #Signal handlers can only be set from the main thread, elsewhere (e.g. in the benchmarks) nothing is installed
+    def install_signal_handler(self):
+        if (toggle_signal is not None and threading.current_thread() is threading.main_thread()):
+            signal.signal(toggle_signal, lambda signal_number, frame: self.toggle())
+
+    def _run(self, seconds):
+        own_id = threading.get_ident()
+        self.profiler_start_cpu = thread_cpu_time(own_id) or 0
+        last_cpu = {}
+        deadline = time.monotonic() + seconds
+
+        while not self.stop_requested.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if (thread_id == own_id):
+                    continue
+
+                weight = 1
+                if (self.mode == mode_cpu):
+                    cpu_time = thread_cpu_time(thread_id)
+                    previous = last_cpu.get(thread_id, cpu_time)
+                    last_cpu[thread_id] = cpu_time
+                    if (cpu_time is None or previous is None or cpu_time <= previous):
+                        continue
+                    weight = max(int((cpu_time - previous) * 1000000), 1)
+
+                name = names.get(thread_id, f"thread-{thread_id}")
+                frames = [name]
+                if (thread_id == self.loop_thread_id):
+                    task = asyncio.current_task(self.loop)
+                    if task is not None:
+                        frames.append(f"task:{task.get_coro().__qualname__}")
+                        self.task_samples[task.get_coro().__qualname__] += weight
+                frames.extend(collapse_frames(frame))
+
+                stack = ";".join(frames)
+                if (stack not in self.stacks and len(self.stacks) >= max_stacks):
+                    stack = f"{name};[other]"
+                self.stacks[stack] += weight
+                self.thread_samples[name] += weight
+            self.samples += 1
+            if (time.monotonic() >= deadline):
+                log.info("Profile of %s reached its %s s limit", self.process, seconds)
+                break
+
+        self.ended_at = time.time()
+        self.end_cpu = thread_cpu_times()
+        self.profiler_cpu = (thread_cpu_time(own_id) or 0) - self.profiler_start_cpu
+        self.last_file = self._write()
+
+    #Writes the collapsed stacks into profile_directory, returns the path
+    def _write(self):
+        path = os.path.join(profile_directory, f"{self.process}_{datetime.fromtimestamp(self.started_at):%Y%m%d_%H%M%S}.folded")
+        try:
+            with open(path, "w") as profile_file:
+                profile_file.write(self.collapsed())
+        except OSError as error:
+            log.error("Could not write the profile '%s': %s", path, error)
+            return None
+        log.info("Profile of %s written to '%s' (%s samples)", self.process, path, self.samples)
+        return path
+
+    #The stacks of the running or last profile in the collapsed format, most frequent first
+    def collapsed(self):
+        stacks = self.stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    #State of the profiler and the CPU time of every thread, the window is the running or last profile
+    def report(self):
+        now = time.time()
+        current_cpu = thread_cpu_times()
+        if self.running:
+            self.profiler_cpu = current_cpu.get("profiler", self.profiler_start_cpu) - self.profiler_start_cpu
+        window_end_cpu = self.end_cpu if (self.ended_at and not self.running) else current_cpu
+        window_seconds = ((self.ended_at if not self.running and self.ended_at else now) - self.started_at) if self.started_at else 0
+
+        threads = []
+        for name, cpu_time in current_cpu.items():
+            window_cpu = window_end_cpu.get(name, cpu_time) - self.start_cpu.get(name, 0) if self.started_at else None
+            threads.append({
+                "thread": name,
+                "cpu_seconds": round(cpu_time, 3),
+                "window_cpu_seconds": round(window_cpu, 3) if window_cpu is not None else None,
+                "window_cpu_percent": round(window_cpu / window_seconds * 100, 1) if window_cpu is not None and window_seconds > 0 else None,
+                "samples": self.thread_samples.get(name, 0),
+            })
+        threads.sort(key=lambda thread: (thread["window_cpu_seconds"] or 0, thread["cpu_seconds"]), reverse=True)
+
+        return {
+            "process": self.process,
+            "running": self.running,
+            "mode": self.mode,
+            "interval": self.interval,
+            "started": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds") if self.started_at else None,
+            "seconds": round(window_seconds, 1),
+            "samples": self.samples,
+            "profiler_cpu_seconds": round(self.profiler_cpu, 3),
+            "threads": threads,
+            "tasks": dict(self.task_samples.most_common()),
+            "file": self.last_file,
+        }
+
+#Returns the frames of a stack from the outermost to the innermost as "function (file)"
+def collapse_frames(frame):
+    frames = []
+    while (frame is not None and len(frames) < max_stack_depth):
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    frames.reverse()
+    return frames
@@ -0,0 +1,402 @@
+import heapq
+import asyncio
+import itertools
+import threading
+import logging
+from datetime import datetime, timedelta
+import clock_source
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Recurrence rules an alarm can have
+recurrence_once = "once" #Rings one time and is removed afterwards
+recurrence_daily = "daily" #Rings every day
+recurrence_weekdays = "weekdays" #Rings monday to friday
+recurrence_every_n_days = "every_n_days" #Rings every interval_days days
+allowed_recurrences = [recurrence_once, recurrence_daily, recurrence_weekdays, recurrence_every_n_days]
+
+#Edit if needed
+missed_alarm_grace = 3600 #Alarms that were due while the program was not running still ring after a restart if they are at most this many seconds late
+
+#---------------------------------------------------Alarm-------------------------------------------------#
+
+#A single alarm with its own ringtone, snooze duration and recurrence rule
+class Alarm:
+
+    def __init__(self, ring_time, ringtone="main_audio.wav", snooze_duration=10, recurrence=recurrence_once, interval_days=1, alarm_id=None, fade_in_seconds=0):
+        #Raises ValueError if ring_time is not HH:MM
+        parsed_time = datetime.strptime(ring_time, "%H:%M")
+
+        if recurrence not in allowed_recurrences:
+            raise ValueError(f"Unknown recurrence '{recurrence}'")
+        if int(interval_days) < 1:
+            raise ValueError("interval_days has to be at least 1")
+        #A snooze of 0 seconds would ring the alarm again right away, over and over
+        if int(snooze_duration) < 1:
+            raise ValueError("snooze_duration has to be at least 1 second")
+        if int(fade_in_seconds) < 0:
+            raise ValueError("fade_in_seconds can't be negative")
+
+        self.alarm_id = alarm_id
+        self.hour = parsed_time.hour
+        self.minute = parsed_time.minute
+        self.ringtone = ringtone
+        self.snooze_duration = int(snooze_duration)
+        self.recurrence = recurrence
+        self.interval_days = int(interval_days)
+        self.fade_in_seconds = int(fade_in_seconds) #Gentle wake: the ringtone fades in over this many seconds
+
+    @property
+    def ring_time(self):
+        return f"{self.hour:02}:{self.minute:02}"
+
+    @property
+    def recurring(self):
+        return self.recurrence != recurrence_once
+
+    #Returns the first ring time strictly after the given moment
+    #previous_ring is the last regular ring time, every_n_days alarms count their interval from it
+    def next_ring_after(self, moment, previous_ring=None):
+        if (self.recurrence == recurrence_every_n_days and previous_ring is not None):
+            candidate = previous_ring
+            while candidate <= moment:
+                candidate += timedelta(days=self.interval_days)
+            return candidate
+
+        candidate = moment.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        if (candidate <= moment):
+            candidate += timedelta(days=1)
+
+        if (self.recurrence == recurrence_weekdays):
+            #Skip saturday (5) and sunday (6)
+            while candidate.weekday() >= 5:
+                candidate += timedelta(days=1)
+
+        return candidate
+
+    #Inverse of to_dict()
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["ring_time"], data["ring_tone"], data["snooze_time"], data["recurrence"], data["interval_days"], alarm_id=data["id"], fade_in_seconds=data["fade_in"])
+
+    def to_dict(self):
+        return {
+            "id": self.alarm_id,
+            "ring_time": self.ring_time,
+            "ring_tone": self.ringtone,
+            "snooze_time": self.snooze_duration,
+            "recurrence": self.recurrence,
+            "interval_days": self.interval_days,
+            "fade_in": self.fade_in_seconds,
+        }
+
+#-------------------------------------------------Scheduler-----------------------------------------------#
+
+#Holds any number of alarms in a heap ordered by their next due time
+#Removed or rescheduled alarms leave stale heap entries behind which are skipped when they reach the top,
+#so adding and removing both stay O(log n)
+#Due times are local wall clock times, the time until one is due is taken from the timestamps so daylight
+#saving time changes are accounted for. The waits themselves run on the monotonic clock of the event loop without
+#periodic wakeups, when the wall clock is set the clock calls clock_stepped() and every timeout is recalculated
+#Snoozes are durations: they keep their monotonic deadline when the wall clock is set
+#With a store (see alarm_store.py and restore()) every alarm is saved with its next regular due time and snooze,
+#so the alarms survive a crash or reboot
+#The waits are coroutines, all other methods can be called from any thread
+class AlarmScheduler:
+
+    def __init__(self, clock=None):
+        self.clock = clock or clock_source.SystemClock()
+        self.store = None #Set by restore()
+        self.heap = [] #Entries: [due, sequence, alarm_id]
+        self.entries = {} #alarm_id -> valid heap entry
+        self.alarms = {} #alarm_id -> Alarm
+        self.regular_due = {} #alarm_id -> last regular due time (snoozing does not change it)
+        self.snooze_deadlines = {} #alarm_id -> monotonic time a snoozed alarm rings again
+        self.last_due = None #Due time of the alarm wait_for_next_alarm() returned last
+        self.ids = itertools.count(1)
+        self.sequence = itertools.count()
+        self.lock = threading.RLock()
+        self.waiters = [] #(event loop, asyncio.Event) of every running wait, set whenever the alarms change
+        self.clock.watch_steps(self.clock_stepped)
+
+    def now(self):
+        return self.clock.now()
+
+    #Seconds until a wall clock time, correct across daylight saving time changes
+    #A time that does not exist (skipped by the change to summer time) counts as one hour later
+    def seconds_until(self, moment):
+        return moment.timestamp() - self.clock.time()
+
+    #Loads the alarms saved in store and saves every change from now on, has to be called before alarms are added
+    #Alarms that were due while the program was not running (a pending ring, a ringing or snoozed alarm) ring right
+    #away if they are at most missed_alarm_grace seconds late. Later ones are missed: recurring alarms continue with
+    #their next ring time, one-time alarms are removed. Returns the number of restored alarms
+    def restore(self, store):
+        with self.lock:
+            self.store = store
+            now = self.now()
+            for alarm_id, record in sorted(store.load().items()):
+                try:
+                    alarm = Alarm.from_dict(record["alarm"])
+                except ValueError as error:
+                    log.warning("Alarm %s has invalid settings, removing it: %s", alarm_id, error)
+                    store.delete(alarm_id)
+                    continue
+                due = datetime.fromtimestamp(record["due"])
+                ring_at = due if record["snoozed_until"] is None else datetime.fromtimestamp(record["snoozed_until"])
+                late = self.clock.time() - ring_at.timestamp()
+
+                if (late > missed_alarm_grace):
+                    if not alarm.recurring:
+                        log.warning("Alarm %s at %s was missed by %.0f s, removing it", alarm_id, ring_at, late)
+                        store.delete(alarm_id)
+                        continue
+                    log.warning("Alarm %s at %s was missed by %.0f s, continuing with its next ring time", alarm_id, ring_at, late)
+                    due = alarm.next_ring_after(now, due)
+                    ring_at = due
+                    record["snoozed_until"] = None
+
+                self.alarms[alarm_id] = alarm
+                self.regular_due[alarm_id] = due
+                self._push(alarm_id, ring_at)
+                if record["snoozed_until"] is not None:
+                    self.snooze_deadlines[alarm_id] = self.clock.monotonic() + max(ring_at.timestamp() - self.clock.time(), 0)
+                if (late > missed_alarm_grace):
+                    self._save(alarm_id)
+
+            self.ids = itertools.count(max(self.alarms, default=0) + 1)
+            self._changed()
+            return len(self.alarms)
+
+    #Adds an alarm and returns its id
+    def add(self, alarm):
+        with self.lock:
+            if alarm.alarm_id is None:
+                alarm.alarm_id = next(self.ids)
+            self.alarms[alarm.alarm_id] = alarm
+            due = alarm.next_ring_after(self.now())
+            self.regular_due[alarm.alarm_id] = due
+            self._push(alarm.alarm_id, due)
+            self._save(alarm.alarm_id)
+            self._changed()
+            return alarm.alarm_id
+
+    #Removes an alarm, returns False if the id is unknown
+    def remove(self, alarm_id):
+        with self.lock:
+            if alarm_id not in self.alarms:
+                return False
+            del self.alarms[alarm_id]
+            del self.regular_due[alarm_id]
+            self._invalidate(alarm_id)
+            self._save(alarm_id)
+            self._changed()
+            return True
+
+    def has_alarms(self):
+        with self.lock:
+            return bool(self.alarms)
+
+    #Waits until at least one alarm is in the scheduler
+    async def wait_until_armed(self):
+        changed = self._add_waiter()
+        try:
+            while True:
+                changed.clear()
+                if self.has_alarms():
+                    return
+                await changed.wait()
+        finally:
+            self._remove_waiter(changed)
+
+    #Returns the alarm with the id or None
+    def get(self, alarm_id):
+        with self.lock:
+            return self.alarms.get(alarm_id)
+
+    #Returns (due, alarm) of the next alarm or None
+    def peek(self):
+        with self.lock:
+            entry = self._top()
+            if entry is None:
+                return None
+            return entry[0], self.alarms[entry[2]]
+
+    #Returns all alarms ordered by their next due time
+    def list_alarms(self):
+        with self.lock:
+            pending = [entry for entry in self.entries.values()]
+            pending.sort()
+            return [(entry[0], self.alarms[entry[2]]) for entry in pending]
+
+    #Waits until the next alarm is due and returns it, returns None as soon as no alarm is left
+    #The alarm stays out of the heap until snooze(), finish() or skip_next() is called for it
+    #Cancelling the waiting task leaves the scheduler untouched
+    async def next_alarm(self):
+        changed = self._add_waiter()
+        try:
+            while True:
+                changed.clear()
+                with self.lock:
+                    entry = self._top()
+                    if entry is None:
+                        return None
+                    timeout = self.seconds_until(entry[0])
+                    if (timeout <= 0):
+                        heapq.heappop(self.heap)
+                        del self.entries[entry[2]]
+                        self.snooze_deadlines.pop(entry[2], None)
+                        self.last_due = entry[0]
+                        return self.alarms[entry[2]]
+
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._remove_waiter(changed)
+
+    #Waits until the next alarm is due in lead_time seconds or less and returns (due, alarm) without taking it
+    #Returns as soon as that differs from known (the last result): another alarm, a new due time (snoozed, moved by a
+    #wall clock step) or None once no alarm is due within lead_time anymore (rung, stopped or removed)
+    async def upcoming_alarm(self, lead_time, known=None):
+        changed = self._add_waiter()
+        try:
+            while True:
+                changed.clear()
+                with self.lock:
+                    entry = self._top()
+                    timeout = None
+                    upcoming = None
+                    if entry is not None:
+                        timeout = self.seconds_until(entry[0]) - lead_time
+                        if (timeout <= 0):
+                            upcoming = entry[0], self.alarms[entry[2]]
+                            timeout = None
+
+                #Alarms are compared by id and due time, the Alarm objects stay the same when they are rescheduled
+                upcoming_key = upcoming and (upcoming[0], upcoming[1].alarm_id)
+                known_key = known and (known[0], known[1].alarm_id)
+                if (upcoming_key != known_key):
+                    return upcoming
+
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._remove_waiter(changed)
+
+    #Called when the wall clock was set: snoozed alarms are moved so they still ring after their snooze
+    #duration, the waiting task is woken up to recalculate its timeout
+    def clock_stepped(self):
+        with self.lock:
+            for alarm_id, deadline in list(self.snooze_deadlines.items()):
+                self._invalidate(alarm_id)
+                self._push(alarm_id, self.now() + timedelta(seconds=max(deadline - self.clock.monotonic(), 0)))
+                self.snooze_deadlines[alarm_id] = deadline
+                self._save(alarm_id)
+            self._changed()
+
+    #Rings the alarm again after its snooze duration
+    def snooze(self, alarm, seconds=None):
+        with self.lock:
+            if alarm.alarm_id not in self.alarms:
+                return
+            if seconds is None:
+                seconds = alarm.snooze_duration
+            self._invalidate(alarm.alarm_id)
+            self._push(alarm.alarm_id, self.now() + timedelta(seconds=seconds))
+            self.snooze_deadlines[alarm.alarm_id] = self.clock.monotonic() + seconds
+            self._save(alarm.alarm_id)
+            self._changed()
+
+    #Called after an alarm was stopped: recurring alarms get their next ring time, one-time alarms are removed
+    def finish(self, alarm):
+        with self.lock:
+            if alarm.alarm_id not in self.alarms:
+                return
+            if not alarm.recurring:
+                self.remove(alarm.alarm_id)
+                return
+
+            due = alarm.next_ring_after(max(self.now(), self.regular_due[alarm.alarm_id]), self.regular_due[alarm.alarm_id])
+            self.regular_due[alarm.alarm_id] = due
+            self._invalidate(alarm.alarm_id)
+            self._push(alarm.alarm_id, due)
+            self._save(alarm.alarm_id)
+            self._changed()
+
+    #Stops every snoozed alarm like finish(), returns the stopped alarms
+    def stop_snoozed(self):
+        with self.lock:
+            snoozed_alarms = [self.alarms[alarm_id] for alarm_id in self.snooze_deadlines]
+            for alarm in snoozed_alarms:
+                self.finish(alarm)
+            return snoozed_alarms
+
+    #Skips the next pending ring (or pending snooze) without ringing, returns the skipped alarm
+    def skip_next(self):
+        with self.lock:
+            entry = self._top()
+            if entry is None:
+                return None
+            alarm = self.alarms[entry[2]]
+            self.finish(alarm)
+            return alarm
+
+    #Returns an asyncio.Event that is set whenever the alarms change, for a wait running on the current event loop
+    def _add_waiter(self):
+        changed = asyncio.Event()
+        with self.lock:
+            self.waiters.append((asyncio.get_running_loop(), changed))
+        return changed
+
+    def _remove_waiter(self, changed):
+        with self.lock:
+            self.waiters = [waiter for waiter in self.waiters if waiter[1] is not changed]
+
+    #Wakes up every wait, changes can come from other threads (e.g. the wall clock watcher)
+    def _changed(self):
+        for loop, changed in self.waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(changed.set)
+
+    #Saves the alarm as it is now (or that it was removed) in the store
+    #A ringing alarm keeps its regular due time in the store until it is stopped or snoozed, so it rings again after a crash
+    def _save(self, alarm_id):
+        if self.store is None:
+            return
+        if alarm_id not in self.alarms:
+            self.store.delete(alarm_id)
+            return
+
+        entry = self.entries.get(alarm_id)
+        snoozed_until = entry[0].timestamp() if (entry is not None and alarm_id in self.snooze_deadlines) else None
+        self.store.put(alarm_id, {"alarm": self.alarms[alarm_id].to_dict(), "due": self.regular_due[alarm_id].timestamp(), "snoozed_until": snoozed_until})
+
+    def _push(self, alarm_id, due):
+        entry = [due, next(self.sequence), alarm_id]
+        self.entries[alarm_id] = entry
+        heapq.heappush(self.heap, entry)
+
+    def _invalidate(self, alarm_id):
+        self.snooze_deadlines.pop(alarm_id, None)
+        entry = self.entries.pop(alarm_id, None)
+        if entry is not None:
+            entry[2] = None
+
+        #Rebuild the heap once most of it is stale so it can't grow without bounds
+        if (len(self.heap) > 2 * len(self.entries) + 16):
+            self.heap = [entry for entry in self.heap if entry[2] is not None]
+            heapq.heapify(self.heap)
+
+    #Returns the first valid heap entry, dropping stale ones on the way
+    def _top(self):
+        while self.heap and self.heap[0][2] is None:
+            heapq.heappop(self.heap)
+        if self.heap:
+            return self.heap[0]
+        return None
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import zlib
+import atexit
+import threading
+import logging
+import alarm_metrics
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+flush_delay = 0.5 #Seconds changes are collected before they are written, changes of the last flush_delay seconds are lost on a crash
+compact_min_lines = 64 #The journal is not compacted while it is shorter than this
+compact_ratio = 4 #The journal is compacted once it has this many lines per stored value
+
+#Metrics (see alarm_metrics.py), every sync is one write to the SD card
+journal_syncs = alarm_metrics.registry.counter("alarm_journal_syncs_total", "Writes of the alarm journal that were synced to disk, appended changes or compactions", ["kind"])
+journal_dropped_lines = alarm_metrics.registry.counter("alarm_journal_dropped_lines_total", "Damaged journal lines skipped while loading (torn write after a crash)")
+
+#-------------------------------------------------Journal-------------------------------------------------#
+
+#Every line is "<crc32 of the JSON> <JSON>", so a line that was only written half before a crash or power loss
+#is noticed when the journal is loaded
+def encode_line(record):
+    data = json.dumps(record, separators=(",", ":"))
+    return f"{zlib.crc32(data.encode('utf-8')):08x} {data}\n".encode("utf-8")
+
+#Returns the record of a line, or None if the line is damaged
+def decode_line(line):
+    checksum, _, data = line.rstrip(b"\n").partition(b" ")
+    try:
+        if (int(checksum, 16) != zlib.crc32(data)):
+            return None
+        return json.loads(data)
+    except ValueError:
+        return None
+
+#-------------------------------------------------Store---------------------------------------------------#
+
+#Crash safe key -> value store for the alarms, kept in memory and in an append-only journal
+#put() and delete() only change the memory and queue a journal line, a background thread writes everything that
+#came in during flush_delay seconds with a single write and fdatasync, so a burst of changes costs one write on
+#the SD card. Once the journal has compact_ratio lines per value it is rewritten with only the current values into a
+#temporary file that replaces the journal atomically (rename), a crash at any moment leaves either the old or the
+#new journal behind
+#load() reads the journal once at start up, damaged lines at the end (torn write) are skipped and removed by the
+#next compaction
+#Values have to be JSON serializable, all methods can be called from any thread
+class AlarmStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.values = {}
+        self.pending = [] #Encoded lines that are not written yet
+        self.journal_lines = 0 #Lines in the journal file
+        self.needs_compaction = False
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock() #Only one flush writes to the file at a time
+        self.flush_requested = threading.Event()
+        self.thread = None
+
+    #Reads the journal, returns the stored values as dict key -> value
+    def load(self):
+        values = {}
+        lines = 0
+        dropped = 0
+        try:
+            with open(self.path, "rb") as journal:
+                for line in journal:
+                    record = decode_line(line)
+                    if record is None:
+                        dropped += 1
+                        continue
+                    lines += 1
+                    if (record.get("op") == "put"):
+                        values[record["key"]] = record["value"]
+                    elif (record.get("op") == "delete"):
+                        values.pop(record["key"], None)
+        except FileNotFoundError:
+            pass
+
+        if dropped:
+            log.warning("Skipped %s damaged line(s) in '%s'", dropped, self.path)
+            journal_dropped_lines.inc(dropped)
+
+        with self.lock:
+            self.values = dict(values)
+            self.journal_lines = lines
+            self.needs_compaction = dropped > 0
+        if dropped:
+            self._request_flush()
+        return values
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.values.get(key, default)
+
+    def put(self, key, value):
+        line = encode_line({"op": "put", "key": key, "value": value})
+        with self.lock:
+            self.values[key] = value
+            self.pending.append(line)
+        self._request_flush()
+
+    def delete(self, key):
+        with self.lock:
+            if key not in self.values:
+                return
+            del self.values[key]
+            self.pending.append(encode_line({"op": "delete", "key": key}))
+        self._request_flush()
+
+    #Writes everything that is queued right away (also called at exit)
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                lines, self.pending = self.pending, []
+                compact = self.needs_compaction or not os.path.exists(self.path) or (
+                    self.journal_lines + len(lines) >= compact_min_lines and self.journal_lines + len(lines) > compact_ratio * len(self.values))
+                snapshot = dict(self.values) if compact else None
+
+            if compact:
+                self._compact(snapshot)
+            elif lines:
+                self._write_lines(lines)
+
+    def _request_flush(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._flush_loop, name="journal-flush", daemon=True)
+                self.thread.start()
+                atexit.register(self._try_flush)
+        self.flush_requested.set()
+
+    #Writes the queued lines at most every flush_delay seconds
+    def _flush_loop(self):
+        while True:
+            self.flush_requested.wait()
+            time.sleep(flush_delay)
+            self.flush_requested.clear()
+            self._try_flush()
+
+    def _try_flush(self):
+        try:
+            self.flush()
+        except OSError as error:
+            log.error("Could not write the alarm journal '%s': %s", self.path, error)
+
+    def _write_lines(self, lines):
+        descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(descriptor, b"".join(lines))
+            #Only the data has to reach the disk, not the access times (fsync where fdatasync does not exist)
+            getattr(os, "fdatasync", os.fsync)(descriptor)
+        finally:
+            os.close(descriptor)
+        with self.lock:
+            self.journal_lines += len(lines)
+        journal_syncs.inc(kind="append")
+
+    #Rewrites the journal with one line per value, the rename makes the switch atomic
+    def _compact(self, snapshot):
+        temporary_path = self.path + ".tmp"
+        data = b"".join(encode_line({"op": "put", "key": key, "value": value}) for key, value in snapshot.items())
+
+        descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(descriptor, data)
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+        os.replace(temporary_path, self.path)
+
+        #The rename itself is only durable once the directory is synced
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+        with self.lock:
+            self.journal_lines = len(snapshot)
+            self.needs_compaction = False
+        journal_syncs.inc(kind="compact")
+        log.debug("Compacted '%s' to %s line(s)", self.path, len(snapshot))
@@ -0,0 +1,179 @@
+import io
+import http
+import asyncio
+import http.client
+import concurrent.futures
+import logging
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+max_header_bytes = 64 * 1024 #Requests with a longer request line and headers are rejected
+max_buffered_body = 1024 * 1024 #Bodies up to this size are read before the handler runs, bigger ones (uploads) are streamed
+keep_alive_timeout = 60 #Seconds an idle keep-alive connection stays open
+body_read_timeout = 30 #Seconds StreamBody.read() waits for data, a client that stalls mid upload then raises TimeoutError
+
+#-------------------------------------------------Requests------------------------------------------------#
+
+#File-like view of a request body that is still in the asyncio stream, so big uploads never sit in memory
+#read() blocks until the data arrived, so it may only be called from a worker thread (see run_in_executor)
+#It raises TimeoutError if no data arrives within body_read_timeout seconds, so a stalled client can't hold the thread
+class StreamBody:
+
+    def __init__(self, reader, length, loop):
+        self.reader = reader
+        self.remaining = length
+        self.loop = loop
+
+    def read(self, size=-1):
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if (running_loop is self.loop):
+            raise RuntimeError("Streamed request bodies have to be read from a worker thread")
+
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        if (size <= 0):
+            return b""
+        future = asyncio.run_coroutine_threadsafe(self.reader.read(size), self.loop)
+        try:
+            data = future.result(body_read_timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"no data received for {body_read_timeout} seconds")
+        self.remaining -= len(data)
+        return data
+
+#One HTTP request, with the attributes of BaseHTTPRequestHandler the route functions use
+#(command, path, headers, rfile, close_connection)
+class HTTPRequest:
+
+    def __init__(self, command, path, version, headers, reader, writer):
+        self.command = command
+        self.path = path
+        self.headers = headers
+        self.reader = reader
+        self.writer = writer
+        self.rfile = io.BytesIO()
+        self.detached = False
+
+        connection = headers.get("Connection", "").lower()
+        self.close_connection = (connection == "close") if version == "HTTP/1.1" else (connection != "keep-alive")
+
+    #Reads the body, small bodies into memory, big ones are left in the stream (see StreamBody)
+    async def read_body(self):
+        content_length = int(self.headers.get("Content-Length", 0) or 0)
+        if (content_length < 0):
+            raise ValueError("Negative Content-Length")
+        if (content_length > 0 and self.headers.get("Expect", "").lower() == "100-continue"):
+            self.writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        if (content_length <= max_buffered_body):
+            self.rfile = io.BytesIO(await self.reader.readexactly(content_length))
+        else:
+            self.rfile = StreamBody(self.reader, content_length, asyncio.get_running_loop())
+
+    @property
+    def body_consumed(self):
+        return not isinstance(self.rfile, StreamBody) or self.rfile.remaining == 0
+
+    async def send(self, status, headers, body=b""):
+        lines = [f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}"]
+        for name, value in headers:
+            lines.append(f"{name}: {value}")
+        if not self.detached:
+            lines.append(f"Content-Length: {len(body)}")
+        if self.close_connection:
+            lines.append("Connection: close")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+
+    #Sends the status line and headers and hands the socket over (e.g. to the status broadcaster)
+    #The server forgets the connection afterwards, the returned socket is open until its new owner closes it
+    async def detach(self, status, headers):
+        self.detached = True
+        self.close_connection = True
+        await self.send(status, headers)
+        connection = self.writer.get_extra_info("socket").dup()
+        self.writer.close()
+        return connection
+
+#---------------------------------------------------Server------------------------------------------------#
+
+#HTTP/1.1 server running as task on the event loop, no thread per connection
+#handler is a coroutine function called with every HTTPRequest, it returns (status, headers, body) with headers as
+#list of (name, value) tuples, or None after it detached the connection
+#Bodies are limited to Content-Length (no chunked transfer encoding, like http.server)
+class AsyncHTTPServer:
+
+    #sock can be a listening socket opened by systemd (socket activation), port and host are not used then
+    def __init__(self, handler, port, host=None, sock=None):
+        self.handler = handler
+        self.port = port
+        self.host = host
+        self.sock = sock
+        self.server = None
+
+    async def start(self):
+        if self.sock is not None:
+            self.server = await asyncio.start_server(self._serve_connection, sock=self.sock, limit=max_header_bytes)
+        else:
+            self.server = await asyncio.start_server(self._serve_connection, self.host, self.port, limit=max_header_bytes)
+
+    def close(self):
+        if self.server:
+            self.server.close()
+            self.server = None
+
+    #Reads the request line and headers, returns None when the client closed the connection or stayed idle too long
+    async def _read_request(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), keep_alive_timeout)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            return None
+
+        request_line, _, header_block = head.partition(b"\r\n")
+        parts = request_line.decode("latin-1").split()
+        if (len(parts) != 3 or not parts[2].startswith("HTTP/")):
+            raise ValueError(f"Malformed request line {request_line!r}")
+        headers = http.client.parse_headers(io.BytesIO(header_block))
+        return HTTPRequest(parts[0], parts[1], parts[2], headers, reader, writer)
+
+    async def _serve_connection(self, reader, writer):
+        request = None
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader, writer)
+                    if request is None:
+                        return
+                    await request.read_body()
+                except (ValueError, asyncio.LimitOverrunError) as error:
+                    log.debug("Rejected malformed request: %s", error)
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    return
+
+                try:
+                    response = await self.handler(request)
+                except Exception:
+                    log.exception("Error while handling %s %s", request.command, request.path)
+                    request.close_connection = True
+                    response = 500, [("Content-type", "text/plain")], b"Internal server error"
+
+                if request.detached:
+                    return
+
+                #A body the handler did not read completely would be taken as the next request
+                if not request.body_consumed:
+                    request.close_connection = True
+                await request.send(*response)
+                if request.close_connection:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if not (request and request.detached):
+                writer.close()
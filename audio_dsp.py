@@ -0,0 +1,110 @@
+#NumPy is optional: without it ringtones are played unprocessed (sudo apt install python3-numpy)
+#It is imported on first use (see load_numpy()), importing it takes seconds on a Pi Zero and would delay the start
+numpy = None
+numpy_missing = False
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+target_loudness_dbfs = -20 #RMS level every ringtone is normalized to
+max_normalization_gain = 8 #Quiet ringtones are amplified at most this much (~18 dB)
+fade_in_curve_exponent = 2 #1 = linear fade in, 2 = slower start which sounds more even to the ear
+analysis_block_frames = 65536 #Frames measured at once by loudness_gain(), keeps memory use bounded for long ringtones
+
+#Sample formats the DSP stage can process (sample width in bytes -> numpy type)
+supported_sample_widths = {2: "<i2", 4: "<i4"}
+
+#-------------------------------------------------Helpers-------------------------------------------------#
+
+#Imports numpy once, returns False if it is not installed
+#Called by the main program after start up, so the first alarm does not wait for the import
+def load_numpy():
+    global numpy, numpy_missing
+    if (numpy is None and not numpy_missing):
+        try:
+            import numpy as numpy_module
+            numpy = numpy_module
+        except ImportError:
+            numpy_missing = True
+    return numpy is not None
+
+def dsp_available():
+    return load_numpy()
+
+def can_process(sound):
+    return dsp_available() and sound.sample_width in supported_sample_widths
+
+#Returns the samples of a sound as a float array scaled to -1..1
+def to_float_samples(data, sample_width):
+    samples = numpy.frombuffer(data, dtype=supported_sample_widths[sample_width])
+    return samples.astype(numpy.float32) / float(2 ** (8 * sample_width - 1))
+
+#Returns the gain that brings the sound to target_loudness_dbfs without clipping its peaks
+#The sound is measured in blocks of analysis_block_frames (a 600 s upload as one float array would need hundreds of MB),
+#the squares are summed and the peak is tracked per block
+#The result is stored on the sound, so every ringtone is only analysed once
+def loudness_gain(sound):
+    cached_gain = getattr(sound, "loudness_gain", None)
+    if cached_gain is not None:
+        return cached_gain
+
+    data = memoryview(sound.data)
+    block_size = analysis_block_frames * sound.frame_size
+    square_sum = 0.0
+    peak = 0.0
+    for offset in range(0, len(data), block_size):
+        samples = to_float_samples(data[offset:offset + block_size], sound.sample_width)
+        square_sum += float(numpy.dot(samples, samples))
+        peak = max(peak, float(numpy.max(numpy.abs(samples))))
+    samples_total = len(data) // sound.sample_width
+    rms = (square_sum / samples_total) ** 0.5 if samples_total else 0.0
+
+    if (rms == 0 or peak == 0):
+        gain = 1.0
+    else:
+        gain = (10 ** (target_loudness_dbfs / 20)) / rms
+        gain = min(gain, max_normalization_gain, 1.0 / peak)
+
+    sound.loudness_gain = gain
+    return gain
+
+#------------------------------------------------DSP chain------------------------------------------------#
+
+#Applies a constant gain (loudness normalization) and a fade in to streamed PCM chunks
+#Everything is done on whole chunks with numpy, nothing loops over single samples in python
+#The fade in keeps counting across chunks and loops of the ringtone
+class RingtoneProcessor:
+
+    def __init__(self, sound, fade_in_seconds=0, normalize=False):
+        self.sample_width = sound.sample_width
+        self.channels = sound.channels
+        self.dtype = supported_sample_widths[sound.sample_width]
+        self.full_scale = float(2 ** (8 * sound.sample_width - 1))
+        self.gain = loudness_gain(sound) if normalize else 1.0
+        self.fade_frames = int(fade_in_seconds * sound.sample_rate)
+        self.frames_done = 0
+
+    @property
+    def fading(self):
+        return self.frames_done < self.fade_frames
+
+    #Takes raw PCM bytes and returns the processed PCM bytes in the same format
+    def __call__(self, chunk):
+        if (self.gain == 1.0 and not self.fading):
+            return chunk
+
+        samples = numpy.frombuffer(chunk, dtype=self.dtype).reshape(-1, self.channels).astype(numpy.float32)
+        frame_count = samples.shape[0]
+
+        if self.fading:
+            #Gain per frame from 0 to 1 over fade_frames, broadcast over all channels
+            progress = numpy.arange(self.frames_done, self.frames_done + frame_count, dtype=numpy.float32) / self.fade_frames
+            envelope = numpy.minimum(progress, 1.0) ** fade_in_curve_exponent
+            samples *= (envelope * self.gain)[:, None]
+        else:
+            samples *= self.gain
+
+        self.frames_done += frame_count
+
+        numpy.clip(samples, -self.full_scale, self.full_scale - 1, out=samples)
+        return samples.astype(self.dtype).tobytes()
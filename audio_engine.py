@@ -0,0 +1,357 @@
+import os
+import math
+import time
+import array
+import wave
+import threading
+import subprocess
+import collections
+import logging
+import alarm_metrics
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+audio_sink_environment_variable = "ALARM_CLOCK_AUDIO_SINK" #alsa, aplay, null or file:<path>, default: alsa if pyalsaaudio is installed, else aplay
+alsa_device = "default" #ALSA device the ringtone is played on
+period_frames = 1024 #Frames written per chunk, stop takes effect within one period (~23 ms at 44.1 kHz)
+underrun_threshold = 0.1 #Seconds playback may fall behind the audio written so far before it counts as underrun
+max_cache_bytes = 128 * 1024 * 1024 #Least recently played ringtones are dropped from memory once the decoded ones are bigger than this
+
+#Built-in ringtone, played when the ringtone of an alarm is missing or can't be decoded (see builtin_ringtone())
+builtin_tone_frequency = 880 #Hz
+builtin_beep_seconds = 0.15
+builtin_beeps = 4 #Beeps per repeat, each followed by a pause of builtin_beep_seconds
+builtin_pause_seconds = 0.6 #Silence after the beeps before the ringtone repeats
+builtin_sample_rate = 44100
+
+#Metrics (see alarm_metrics.py)
+audio_underruns = alarm_metrics.registry.counter("alarm_audio_underruns_total", "Times the audio output ran out of data")
+audio_playbacks = alarm_metrics.registry.counter("alarm_audio_playbacks_total", "Ringtones started")
+
+#Decoded ringtones, path -> (modification time, PCMSound), least recently used first
+sound_cache = collections.OrderedDict()
+sound_cache_lock = threading.Lock()
+builtin_sound = None #Created by builtin_ringtone() on first use
+
+#---------------------------------------------------Sounds------------------------------------------------#
+
+#Decoded PCM data of a WAV file, kept in memory so playing it never touches the SD card
+class PCMSound:
+
+    def __init__(self, data, channels, sample_width, sample_rate):
+        self.data = data
+        self.channels = channels
+        self.sample_width = sample_width
+        self.sample_rate = sample_rate
+
+    @property
+    def frame_size(self):
+        return self.channels * self.sample_width
+
+    @property
+    def duration(self):
+        return len(self.data) / (self.frame_size * self.sample_rate)
+
+#Decodes a WAV file, raises wave.Error / OSError if it is missing or not a PCM WAV
+def load_wav(path):
+    with wave.open(path, "rb") as wav_file:
+        channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+        sample_rate = wav_file.getframerate()
+        data = wav_file.readframes(wav_file.getnframes())
+
+    if not data:
+        raise wave.Error(f"'{path}' contains no audio")
+
+    return PCMSound(data, channels, sample_width, sample_rate)
+
+#Returns the decoded ringtone, files are only decoded again if they changed on disk
+#Once the decoded ringtones are bigger than max_cache_bytes the least recently used ones are dropped, the ringtone
+#that was just loaded is always kept (an upload alone can be about 100 MB)
+def load_ringtone(path):
+    modification_time = os.path.getmtime(path)
+
+    with sound_cache_lock:
+        cached = sound_cache.get(path)
+        if cached and cached[0] == modification_time:
+            sound_cache.move_to_end(path)
+            return cached[1]
+
+    sound = load_wav(path)
+    with sound_cache_lock:
+        sound_cache[path] = (modification_time, sound)
+        sound_cache.move_to_end(path)
+        total = sum(len(cached_sound.data) for _, cached_sound in sound_cache.values())
+        while (total > max_cache_bytes and len(sound_cache) > 1):
+            evicted_path, (_, evicted_sound) = sound_cache.popitem(last=False)
+            total -= len(evicted_sound.data)
+            log.info("Dropped decoded ringtone '%s' from memory", evicted_path)
+    return sound
+
+#Drops the decoded ringtone of path from memory, e.g. when the file was replaced or removed from disk
+def evict(path):
+    with sound_cache_lock:
+        sound_cache.pop(path, None)
+
+#Returns the built-in ringtone (beeps, 44.1 kHz 16 bit stereo), it is generated in memory so it always plays
+def builtin_ringtone():
+    global builtin_sound
+
+    if builtin_sound is None:
+        beep_frames = int(builtin_beep_seconds * builtin_sample_rate)
+        beep = array.array("h")
+        for frame in range(beep_frames):
+            #Short fade at both ends, so the beeps do not click
+            envelope = min(1.0, frame / 200, (beep_frames - frame) / 200)
+            sample = int(16000 * envelope * math.sin(2 * math.pi * builtin_tone_frequency * frame / builtin_sample_rate))
+            beep.extend((sample, sample))
+        silence = bytes(beep_frames * 4)
+        data = (beep.tobytes() + silence) * builtin_beeps + bytes(int(builtin_pause_seconds * builtin_sample_rate) * 4)
+        builtin_sound = PCMSound(data, 2, 2, builtin_sample_rate)
+    return builtin_sound
+
+#----------------------------------------------------Sinks------------------------------------------------#
+
+#A sink gets opened with the format of the sound, then receives chunks of PCM data
+#write() blocks until the device accepted the chunk, that is what paces playback
+
+#Plays on ALSA directly (needs pyalsaaudio: sudo apt install python3-alsaaudio)
+class AlsaSink:
+
+    def __init__(self, device=alsa_device):
+        import alsaaudio
+        self.alsaaudio = alsaaudio
+        self.device = device
+        self.pcm = None
+
+    def open(self, sound):
+        formats = {1: self.alsaaudio.PCM_FORMAT_U8, 2: self.alsaaudio.PCM_FORMAT_S16_LE, 3: self.alsaaudio.PCM_FORMAT_S24_3LE, 4: self.alsaaudio.PCM_FORMAT_S32_LE}
+        self.pcm = self.alsaaudio.PCM(self.alsaaudio.PCM_PLAYBACK, device=self.device, channels=sound.channels, rate=sound.sample_rate, format=formats[sound.sample_width], periodsize=period_frames)
+
+    def write(self, chunk):
+        self.pcm.write(bytes(chunk))
+
+    #Drops what is still buffered so the sound ends right away
+    def close(self):
+        if self.pcm:
+            self.pcm.drop()
+            self.pcm.close()
+            self.pcm = None
+
+#Feeds one long running aplay process through a pipe, used if pyalsaaudio is not installed
+#Unlike starting aplay per repeat there is no gap between loops
+class AplaySink:
+
+    def __init__(self, device=alsa_device):
+        self.device = device
+        self.process = None
+
+    def open(self, sound):
+        formats = {1: "U8", 2: "S16_LE", 3: "S24_3LE", 4: "S32_LE"}
+        period_time_us = int(period_frames * 1000000 / sound.sample_rate)
+        self.process = subprocess.Popen(
+            ["aplay", "-q", "-D", self.device, "-t", "raw", "-f", formats[sound.sample_width], "-c", str(sound.channels), "-r", str(sound.sample_rate),
+             f"--period-time={period_time_us}", f"--buffer-time={period_time_us * 4}"],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def write(self, chunk):
+        self.process.stdin.write(chunk)
+
+    #Killing aplay drops its buffer, so the sound stops within the buffer time
+    def close(self):
+        if self.process:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+#Discards the audio, realtime=True sleeps like a real device would so latencies can be measured without hardware
+class NullSink:
+
+    def __init__(self, realtime=True):
+        self.realtime = realtime
+        self.frames_written = 0
+        self.first_write_time = None
+        self.sound = None
+
+    def open(self, sound):
+        self.sound = sound
+        self.first_write_time = None
+
+    def write(self, chunk):
+        if self.first_write_time is None:
+            self.first_write_time = time.monotonic()
+        frames = len(chunk) // self.sound.frame_size
+        self.frames_written += frames
+        if self.realtime:
+            time.sleep(frames / self.sound.sample_rate)
+
+    def close(self):
+        pass
+
+#Writes the audio into a WAV file, e.g. to check what the alarm would have played
+class WavFileSink(NullSink):
+
+    def __init__(self, path, realtime=False):
+        super().__init__(realtime)
+        self.path = path
+        self.wav_file = None
+
+    def open(self, sound):
+        super().open(sound)
+        self.wav_file = wave.open(self.path, "wb")
+        self.wav_file.setnchannels(sound.channels)
+        self.wav_file.setsampwidth(sound.sample_width)
+        self.wav_file.setframerate(sound.sample_rate)
+
+    def write(self, chunk):
+        self.wav_file.writeframes(chunk)
+        super().write(chunk)
+
+    def close(self):
+        if self.wav_file:
+            self.wav_file.close()
+            self.wav_file = None
+
+#Returns the sink selected by ALARM_CLOCK_AUDIO_SINK
+def default_sink():
+    selected_sink = os.environ.get(audio_sink_environment_variable, "")
+
+    if (selected_sink == "null"):
+        return NullSink()
+    if selected_sink.startswith("file:"):
+        return WavFileSink(selected_sink[len("file:"):])
+    if (selected_sink == "aplay"):
+        return AplaySink()
+
+    try:
+        return AlsaSink()
+    except ImportError:
+        if (selected_sink == "alsa"):
+            raise
+        return AplaySink()
+
+#---------------------------------------------------Engine------------------------------------------------#
+
+#Plays a PCMSound in a background thread, looping without gaps until stop() is called
+#prepare() opens the output ahead of time (e.g. starts aplay) and holds it, play() then writes to it right away
+class AudioEngine:
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.play_requested_time = None #time.monotonic() of the last play() call
+        self.first_chunk_time = None #time.monotonic() when the first chunk was handed to the sink
+        self.sink_lock = threading.Lock()
+        self.open_format = None #(channels, sample width, sample rate) the sink is open with, None while closed
+        self.prepared_time = None #time.monotonic() when prepare() opened the sink
+
+    @property
+    def playing(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    #Opens the output for the format of sound and keeps it open until the next playback ends or release() is called
+    #Does nothing while a sound plays, raises the error of the sink if the output can't be opened (e.g. device busy)
+    def prepare(self, sound):
+        if self.playing:
+            return
+        self._open_sink(sound)
+        self.prepared_time = time.monotonic()
+
+    #Closes an output prepare() opened before prepared_before (time.monotonic()) unless it plays by now
+    def release(self, prepared_before=None):
+        with self.sink_lock:
+            if (self.playing or self.open_format is None or self.prepared_time is None):
+                return
+            if (prepared_before is not None and self.prepared_time >= prepared_before):
+                return
+            self.sink.close()
+            self.open_format = None
+            self.prepared_time = None
+
+    #processor is called with every chunk and returns the chunk that is played (e.g. audio_dsp.RingtoneProcessor)
+    #Returns right away (it is called on the event loop): a sound that still plays is stopped, and the new playback
+    #thread waits for it to close the sink before it starts
+    def play(self, sound, loop=True, processor=None):
+        previous = self.thread
+        self.stop_event.set()
+        self.stop_event = threading.Event()
+        self.play_requested_time = time.monotonic()
+        self.first_chunk_time = None
+        self.thread = threading.Thread(target=self._play, args=(sound, loop, processor, self.stop_event, previous), name="audio-playback", daemon=True)
+        self.thread.start()
+
+    #Stops playback, returns after the sink was closed
+    #With wait=False it returns right away (e.g. on the event loop), the sound still ends within one period
+    def stop(self, wait=True):
+        self.stop_event.set()
+        thread = self.thread
+        if (wait and thread):
+            thread.join()
+            if self.thread is thread:
+                self.thread = None
+
+    #stop_event belongs to this playback, previous is the thread of the playback before (None if there was none)
+    def _play(self, sound, loop, processor, stop_event, previous):
+        chunk_size = period_frames * sound.frame_size
+        data = memoryview(sound.data)
+
+        if previous is not None:
+            previous.join()
+        if stop_event.is_set():
+            return
+
+        try:
+            self._open_sink(sound)
+        except Exception as error:
+            log.error("Could not open audio output: %s", error)
+            return
+
+        audio_playbacks.inc()
+        #Underruns: the device plays in real time, so if more time passed since playback started than audio was
+        #written, it ran out of data at some point
+        playback_start = None
+        frames_written = 0
+
+        try:
+            while not stop_event.is_set():
+                #The stop event is checked before every period
+                for offset in range(0, len(data), chunk_size):
+                    if stop_event.is_set():
+                        return
+                    chunk = data[offset:offset + chunk_size]
+                    if processor:
+                        chunk = processor(chunk)
+                    self.sink.write(chunk)
+
+                    now = time.monotonic()
+                    if playback_start is None:
+                        self.first_chunk_time = playback_start = now
+                    elif (now - playback_start - frames_written / sound.sample_rate > underrun_threshold):
+                        audio_underruns.inc()
+                        playback_start, frames_written = now, 0
+                    frames_written += len(chunk) // sound.frame_size
+                if not loop:
+                    return
+        except (OSError, ValueError) as error:
+            log.error("Audio playback failed: %s", error)
+        finally:
+            with self.sink_lock:
+                self.sink.close()
+                self.open_format = None
+                self.prepared_time = None
+
+    #Opens the sink, an output that is already open with the format of sound is used as it is
+    def _open_sink(self, sound):
+        audio_format = (sound.channels, sound.sample_width, sound.sample_rate)
+        with self.sink_lock:
+            if (self.open_format == audio_format):
+                return
+            if self.open_format is not None:
+                self.sink.close()
+                self.open_format = None
+            self.sink.open(sound)
+            self.open_format = audio_format
@@ -0,0 +1,54 @@
+import os
+import sys
+import math
+import time
+import struct
+import statistics
+
+#Allow running the benchmark from any directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import audio_engine
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+runs = 50 #Number of play/stop cycles that are measured
+play_time = 0.1 #Seconds the sound plays before stop() is called
+
+#------------------------------------------------Benchmark------------------------------------------------#
+
+#One second of a 440 Hz tone, 44.1 kHz, 16 bit stereo
+def make_test_sound():
+    sample_rate = 44100
+    frames = b"".join(struct.pack("<hh", sample, sample) for sample in (int(8000 * math.sin(2 * math.pi * 440 * n / sample_rate)) for n in range(sample_rate)))
+    return audio_engine.PCMSound(frames, 2, 2, sample_rate)
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+def report(name, values):
+    values_ms = [value * 1000 for value in values]
+    print(f"{name:<16} p50 {percentile(values_ms, 50):7.2f} ms   p95 {percentile(values_ms, 95):7.2f} ms   max {max(values_ms):7.2f} ms   mean {statistics.mean(values_ms):7.2f} ms")
+
+def main():
+    sound = make_test_sound()
+    sink = audio_engine.NullSink(realtime=True)
+    engine = audio_engine.AudioEngine(sink)
+
+    start_latencies = []
+    stop_latencies = []
+
+    for run in range(runs):
+        engine.play(sound)
+        time.sleep(play_time)
+        stop_time = time.monotonic()
+        engine.stop()
+        stop_latencies.append(time.monotonic() - stop_time)
+        start_latencies.append(sink.first_write_time - engine.play_requested_time)
+
+    print(f"Audio engine, {runs} runs, period {audio_engine.period_frames} frames ({audio_engine.period_frames / sound.sample_rate * 1000:.1f} ms)")
+    report("play -> sound", start_latencies)
+    report("stop -> silence", stop_latencies)
+
+if __name__ == "__main__":
+    main()
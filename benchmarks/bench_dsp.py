@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+
+#Allow running the benchmark from any directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import audio_engine
+import audio_dsp
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+sound_seconds = 30 #Length of the test ringtone
+sample_rate = 44100
+channels = 2
+
+#------------------------------------------------Benchmark------------------------------------------------#
+
+#Runs the sound through the processor in period sized chunks like the audio engine does
+#Returns processed samples per second
+def measure(processor, data, chunk_size):
+    start_time = time.perf_counter()
+    for offset in range(0, len(data), chunk_size):
+        processor(data[offset:offset + chunk_size])
+    elapsed = time.perf_counter() - start_time
+    return (len(data) // 2) / elapsed
+
+def main():
+    if not audio_dsp.dsp_available():
+        print("numpy is not installed, nothing to benchmark")
+        return
+
+    numpy = audio_dsp.numpy
+    samples = (numpy.random.default_rng(1).standard_normal(sound_seconds * sample_rate * channels) * 3000).astype("<i2")
+    sound = audio_engine.PCMSound(samples.tobytes(), channels, 2, sample_rate)
+    data = memoryview(sound.data)
+    chunk_size = audio_engine.period_frames * sound.frame_size
+    realtime_rate = sample_rate * channels
+
+    cases = [
+        ("normalize", dict(fade_in_seconds=0, normalize=True)),
+        ("fade in", dict(fade_in_seconds=sound_seconds, normalize=False)),
+        ("fade in + normalize", dict(fade_in_seconds=sound_seconds, normalize=True)),
+    ]
+
+    print(f"DSP stage, {sound_seconds} s of {sample_rate} Hz {channels} channel audio, chunks of {audio_engine.period_frames} frames")
+    for name, options in cases:
+        rate = measure(audio_dsp.RingtoneProcessor(sound, **options), data, chunk_size)
+        print(f"{name:<22} {rate / 1e6:8.2f} M samples/s   {rate / realtime_rate:8.1f}x realtime")
+
+if __name__ == "__main__":
+    main()
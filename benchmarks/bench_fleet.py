@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import threading
+import statistics
+
+#Allow running the benchmark from any directory
+repository = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(repository, "tools"))
+import fleet_stub
+import fleet_controller
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+clocks = 300 #Simulated clocks (tools/fleet_stub.py)
+base_port = 9400
+rounds = 10 #GET /status to every clock this often per configuration
+stub_latency = 0.002 #Seconds a simulated clock needs per request at most
+fault_error_rate = 0.05 #Share of requests answered with 503 in the fault run
+fault_drop_rate = 0.02 #Share of requests dropped without an answer in the fault run
+
+#------------------------------------------------Benchmark------------------------------------------------#
+
+#Runs the simulated clocks on their own event loop in a background thread, like separate devices
+def start_stub(count, port, error_rate=0, drop_rate=0):
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(fleet_stub.start_stub_fleet(count, port, max_latency=stub_latency, error_rate=error_rate, drop_rate=drop_rate, seed=1))
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return loop
+
+#Sends rounds x GET /status to every clock, returns (requests per second, latencies, connections opened, ok share)
+async def measure(devices, pool_size, concurrency, measured_rounds):
+    controller = fleet_controller.FleetController(devices, pool_size=pool_size, concurrency=concurrency)
+    latencies = []
+    ok = 0
+    start_time = time.perf_counter()
+    try:
+        for _ in range(measured_rounds):
+            results = await controller.status()
+            latencies.extend(result.latency for result in results if result.ok)
+            ok += sum(result.ok for result in results)
+    finally:
+        controller.close()
+    elapsed = time.perf_counter() - start_time
+    return len(devices) * measured_rounds / elapsed, latencies, controller.connections_opened, ok / (len(devices) * measured_rounds)
+
+def report(name, measurement):
+    throughput, latencies, connections_opened, ok_share = measurement
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{name:<34} {throughput:7.0f} requests/s   p50 {statistics.median(latencies) * 1000:6.2f} ms   p95 {p95 * 1000:6.2f} ms   {connections_opened:5} connections   {ok_share * 100:6.2f} % ok")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures tools/fleet_controller.py against hundreds of simulated clocks")
+    parser.add_argument("--clocks", type=int, default=clocks)
+    parser.add_argument("--rounds", type=int, default=rounds)
+    arguments = parser.parse_args()
+
+    fleet_stub.raise_file_limit()
+    devices = [("127.0.0.1", base_port + index) for index in range(arguments.clocks)]
+    fault_devices = [("127.0.0.1", base_port + arguments.clocks + index) for index in range(arguments.clocks)]
+    start_stub(arguments.clocks, base_port)
+    start_stub(arguments.clocks, base_port + arguments.clocks, fault_error_rate, fault_drop_rate)
+
+    print(f"Fleet controller, {arguments.clocks} simulated clocks, {arguments.rounds} rounds of GET /status")
+    report("pooled keep-alive connections", asyncio.run(measure(devices, fleet_controller.default_pool_size, fleet_controller.default_concurrency, arguments.rounds)))
+    report("new connection per request", asyncio.run(measure(devices, 0, fleet_controller.default_concurrency, arguments.rounds)))
+    report("pooled, one request at a time", asyncio.run(measure(devices, fleet_controller.default_pool_size, 1, arguments.rounds)))
+    report(f"pooled, {fault_error_rate:.0%} 503 + {fault_drop_rate:.0%} drops", asyncio.run(measure(fault_devices, fleet_controller.default_pool_size, fleet_controller.default_concurrency, arguments.rounds)))
+
+if __name__ == "__main__":
+    main()
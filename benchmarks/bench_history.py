@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import random
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+#Allow running the benchmark from any directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import alarm_history
+import alarm_scheduler
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+simulated_days = 730 #Two years of events, the ring buffer wraps around
+alarms_per_day = 3
+runs = 50 #Every query is measured this often
+
+#------------------------------------------------Benchmark------------------------------------------------#
+
+#Records the events of simulated_days days: every alarm rings, is snoozed 0 to 3 times and stopped
+def fill_history(history, start):
+    randomness = random.Random(1)
+    alarms = [alarm_scheduler.Alarm(f"{6 + index}:30", alarm_id=index + 1) for index in range(alarms_per_day)]
+    for day in range(simulated_days):
+        for alarm in alarms:
+            first_ring = (start + timedelta(days=day, hours=alarm.hour, minutes=alarm.minute)).timestamp()
+            event_time = first_ring
+            snoozes = randomness.randint(0, 3)
+            for snooze in range(snoozes):
+                history.record(alarm_history.event_rang, alarm, snoozes=snooze, seconds=event_time - first_ring, event_time=event_time)
+                event_time += randomness.uniform(5, 120)
+                history.record(alarm_history.event_snoozed, alarm, "button", snooze + 1, event_time - first_ring, event_time)
+                event_time += 300
+            history.record(alarm_history.event_rang, alarm, snoozes=snoozes, seconds=event_time - first_ring, event_time=event_time)
+            event_time += randomness.uniform(5, 300)
+            history.record(alarm_history.event_stopped, alarm, randomness.choice(["button", "http"]), snoozes, event_time - first_ring, event_time)
+
+#Returns the median and 95th percentile in ms of function()
+def measure(function):
+    timings = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start_time) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95)]
+
+def report(name, timings):
+    print(f"{name:<40} p50 {timings[0]:7.3f} ms   p95 {timings[1]:7.3f} ms")
+
+def main():
+    start = datetime(2025, 1, 1)
+    now = (start + timedelta(days=simulated_days)).timestamp()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        history = alarm_history.EventHistory(os.path.join(temp_directory, "alarm_history.bin"))
+        start_time = time.perf_counter()
+        fill_history(history, start)
+        recorded = history.next_sequence - 1
+        print(f"Event history, {recorded} events recorded in {(time.perf_counter() - start_time) * 1000:.0f} ms ({history.capacity} kept, {os.path.getsize(history.path) // 1024} KiB file)")
+
+        report("record one event", measure(lambda: history.record(alarm_history.event_set, event_time=now)))
+        report("newest 100 events", measure(lambda: history.query()))
+        report("events of the last 7 days", measure(lambda: history.query(since=now - 7 * 86400, limit=history.capacity)))
+        report("stops of the last 365 days", measure(lambda: history.query(since=now - 365 * 86400, kind=alarm_history.event_stopped, limit=history.capacity)))
+
+        #Every run gets a new minute, so the stats are computed and not taken from the cache
+        minutes = iter(range(runs * 10))
+        report("stats of 30 days", measure(lambda: history.stats(30, now + 60 * next(minutes))))
+        report("stats of 365 days", measure(lambda: history.stats(365, now + 60 * next(minutes))))
+        report("stats of 365 days (cached)", measure(lambda: history.stats(365, now)))
+        history.close()
+
+if __name__ == "__main__":
+    main()
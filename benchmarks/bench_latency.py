@@ -0,0 +1,360 @@
+import os
+import sys
+import json
+import math
+import time
+import wave
+import asyncio
+import socket
+import struct
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import urllib.request
+import importlib.util
+from datetime import datetime, timedelta
+
+#Run without the real hardware, must be set before the scripts are loaded
+os.environ.setdefault("ALARM_CLOCK_FAKE_GPIO", "1")
+os.environ.setdefault("ALARM_CLOCK_FAKE_LCD", "1")
+os.environ.setdefault("ALARM_CLOCK_AUDIO_SINK", "null")
+
+#Allow running the benchmark from any directory, the scripts load their pages relative to the repository
+repository = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repository)
+os.chdir(repository)
+import alarm_ipc
+import audio_engine
+import clock_source
+import alarm_logging
+import shared_state
+import status_stream
+import alarm_scheduler as alarm_scheduler_module
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+alarm_runs = 20 #Alarms that are rung and stopped (half by button, half over HTTP)
+menu_runs = 20 #Menu open/close cycles on the main display
+tick_runs = 10 #Minute changes the main display has to show
+idle_seconds = 5 #Length of each idle CPU measurement
+cold_alarm_runs = 5 #Alarms rung with the pre-arm stage turned off (wake_to_sound_without_prearm)
+ring_lead_time = 0.3 #Seconds between setting an alarm and its ring time
+sink_open_time = 0.05 #Seconds the fake audio output needs to open, like starting aplay on a Raspberry Pi
+poll_interval = 0.0005 #How often the benchmark checks the fake backends
+tap_duration = 0.1 #Seconds a button is held down, releases shorter than the debounce time would be ignored
+baseline_directory = os.path.join(repository, "benchmarks", "baselines")
+regression_factor = 1.5 #A p95 this much above the baseline (plus regression_margin) counts as regression
+regression_margin = 0.002 #Seconds (or CPU share for idle CPU) that are always tolerated
+
+#------------------------------------------------Helpers--------------------------------------------------#
+
+def load_script(module_name, file_name):
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(repository, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+#Waits until condition() is True, returns time.monotonic() of that moment
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("The alarm clock did not react in time")
+        time.sleep(poll_interval)
+    return time.monotonic()
+
+#Presses a button in the background, the press starts right away
+def tap(gpio, pin):
+    threading.Thread(target=gpio.press, args=(pin, tap_duration), daemon=True).start()
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+#One second of a 440 Hz tone as ringtone, 44.1 kHz 16 bit stereo
+def write_test_ringtone(path):
+    sample_rate = 44100
+    with wave.open(path, "wb") as wav_file:
+        wav_file.setnchannels(2)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(b"".join(struct.pack("<hh", sample, sample) for sample in (int(8000 * math.sin(2 * math.pi * 440 * n / sample_rate)) for n in range(sample_rate))))
+
+#The real time moved by offset, so an alarm can be due a few milliseconds after a minute boundary
+#Changing the offset with set_offset() works like setting the wall clock
+class OffsetClock(clock_source.SystemClock):
+
+    def __init__(self):
+        self.offset = timedelta()
+        self.step_listeners = []
+
+    def now(self):
+        return datetime.now() + self.offset
+
+    def time(self):
+        return time.time() + self.offset.total_seconds()
+
+    def watch_steps(self, callback):
+        self.step_listeners.append(callback)
+
+    def set_offset(self, offset):
+        self.offset = offset
+        for listener in list(self.step_listeners):
+            listener()
+
+    #Moves the clock forward so its next minute starts lead_time seconds from now, returns (next minute, time.monotonic() when it starts)
+    def next_minute_in(self, lead_time):
+        real_now = datetime.now()
+        next_minute = (real_now + self.offset + timedelta(minutes=1)).replace(second=0, microsecond=0)
+        self.set_offset(next_minute - real_now - timedelta(seconds=lead_time))
+        return next_minute, time.monotonic() + lead_time
+
+#Audio output that discards the sound and needs sink_open_time seconds to open
+class SlowOpenSink(audio_engine.NullSink):
+
+    def open(self, sound):
+        time.sleep(sink_open_time)
+        super().open(sound)
+
+#------------------------------------------------Benchmark------------------------------------------------#
+
+#Runs the main program and the main display in this process, wired together like on the Raspberry Pi
+class LatencyBenchmark:
+
+    def __init__(self, temp_directory):
+        self.results = {}
+        self.status_times = {} #Status event -> time.monotonic() of the last time it was published
+        self.clock = OffsetClock()
+
+        main = load_script("alarm_clock_main", "main 1.6.py")
+        main.clock = self.clock
+        main.alarm_scheduler = alarm_scheduler_module.AlarmScheduler(self.clock)
+        main.config = main.config._replace(ringtone_directory=temp_directory, api_server_port=free_port())
+        main.webserver_status_file = os.path.join(temp_directory, "alarm_webserver_status.status")
+        main.from_main_display_status_file = os.path.join(temp_directory, "status_from_main_display_to_main.status")
+        main.alarm_journal_file = os.path.join(temp_directory, "alarm_journal.log")
+        main.event_history_file = os.path.join(temp_directory, "alarm_history.bin")
+        main.main_display_shared_state = shared_state.SharedAlarmState(os.path.join(temp_directory, "alarm_clock_state"), create=True)
+        main.status_publisher = alarm_ipc.StatusPublisher(os.path.join(temp_directory, "alarm_ipc.sock"), on_message=main.handle_main_display_message)
+        main.status_broadcaster.add_listener(self.on_status)
+        main.audio = audio_engine.AudioEngine(SlowOpenSink())
+        main.init_hardware()
+        write_test_ringtone(os.path.join(temp_directory, "main_audio.wav"))
+        self.main = main
+
+        display = load_script("alarm_clock_display", "main_display1.2.py")
+        display.clock = self.clock
+        display.status_to_main = main.from_main_display_status_file
+        display.shared_alarm_state = shared_state.SharedAlarmState(os.path.join(temp_directory, "alarm_clock_state"))
+        display.status_subscriber = alarm_ipc.StatusSubscriber(os.path.join(temp_directory, "alarm_ipc.sock"), on_update=lambda: display.display_events.put(display.status_update))
+        display.init_display()
+        display.init_hardware()
+        self.display = display
+
+    def on_status(self, event, state):
+        self.status_times[event] = time.monotonic()
+
+    def start_thread(self, target):
+        threading.Thread(target=target, daemon=True).start()
+
+    #Runs the main program (API server, buttons, main display input and alarms) on its event loop in a background thread
+    def start_main(self):
+        loop = self.clock.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.main.serve())
+
+        self.start_thread(run)
+        wait_for(lambda: self.main.status_broadcaster.version > 0)
+
+    #CPU time used by the whole process while nothing happens, as share of one core
+    def measure_idle_cpu(self):
+        cpu_before = time.process_time()
+        time.sleep(idle_seconds)
+        return (time.process_time() - cpu_before) / idle_seconds
+
+    def run_idle(self):
+        self.main.status_publisher.start()
+        baseline = self.measure_idle_cpu()
+
+        self.start_main()
+        with_main = self.measure_idle_cpu()
+
+        self.start_thread(self.display.run_display_loop)
+        wait_for(lambda: "Keine Wecker" in self.display.lcd.lines()[1])
+        with_display = self.measure_idle_cpu()
+
+        self.results["idle_cpu_main_event_loop"] = [max(with_main - baseline, 0)]
+        self.results["idle_cpu_display_loop"] = [max(with_display - with_main, 0)]
+
+    #Menu button press -> menu drawn on the LCD, and back to the clock screen
+    def run_menu(self):
+        display = self.display
+        open_latencies = []
+        close_latencies = []
+
+        for _ in range(menu_runs):
+            press_time = time.monotonic()
+            tap(display.GPIO, display.config.menu_button)
+            open_latencies.append(wait_for(lambda: "<Weckzeit>" in display.lcd.lines()[0]) - press_time)
+            time.sleep(2 * tap_duration)
+
+            press_time = time.monotonic()
+            tap(display.GPIO, display.config.menu_button)
+            close_latencies.append(wait_for(lambda: "Keine Wecker" in display.lcd.lines()[1]) - press_time)
+            time.sleep(2 * tap_duration)
+
+        self.results["button_to_display"] = open_latencies
+        self.results["menu_close_to_display"] = close_latencies
+
+    #Start of a minute -> new time on the LCD, the main display sleeps until then
+    def run_ticks(self):
+        tick_latencies = []
+
+        for _ in range(tick_runs):
+            next_minute, due_time = self.clock.next_minute_in(ring_lead_time)
+            tick_latencies.append(wait_for(lambda: f"{next_minute:%H:%M}" in self.display.lcd.lines()[0]) - due_time)
+
+        self.results["minute_to_display"] = tick_latencies
+
+    def post(self, path, data):
+        request = urllib.request.Request(f"http://127.0.0.1:{self.main.config.api_server_port}{path}", data=data.encode("utf-8"), method="POST")
+        with urllib.request.urlopen(request) as response:
+            response.read()
+
+    #Set alarm -> ringing -> sound -> stop (button or HTTP) -> silence
+    def run_alarms(self):
+        main = self.main
+        ring_lateness = []
+        sound_lateness = []
+        display_latencies = []
+        button_stop_latencies = []
+        http_stop_latencies = []
+
+        time.sleep(0.2)
+
+        for run in range(alarm_runs):
+            wait_for(lambda: not main.main_display_status["active"])
+
+            #Move the clock so the next minute starts ring_lead_time from now
+            ring_moment, due_time = self.clock.next_minute_in(ring_lead_time)
+
+            self.post(main.settings_post_endpoint, f"ring_time={ring_moment:%H:%M}&ring_tone=main_audio.wav&snooze_time=10")
+
+            wait_for(lambda: main.get_audio().playing and main.get_audio().sink.first_write_time is not None)
+            ring_lateness.append(self.status_times[status_stream.event_ringing] - due_time)
+            sound_lateness.append(main.get_audio().sink.first_write_time - due_time)
+            display_latencies.append(wait_for(lambda: "(*) Wecker (*)" in self.display.lcd.lines()[1]) - self.status_times[status_stream.event_ringing])
+
+            time.sleep(0.05)
+            stop_time = time.monotonic()
+            if (run % 2 == 0):
+                tap(main.GPIO, main.config.stop_button)
+                button_stop_latencies.append(wait_for(lambda: not main.get_audio().playing) - stop_time)
+            else:
+                self.post(main.stop_alarm_endpoint, "action=stop_alarm")
+                http_stop_latencies.append(wait_for(lambda: not main.get_audio().playing) - stop_time)
+
+        self.results["ring_lateness"] = ring_lateness
+        self.results["wake_to_sound"] = sound_lateness
+        self.results["status_to_display"] = display_latencies
+        self.results["stop_button_to_silence"] = button_stop_latencies
+        self.results["stop_http_to_silence"] = http_stop_latencies
+
+    #Due time -> sound without the pre-arm stage, the audio output is only opened once the alarm is due
+    def run_cold_alarms(self):
+        main = self.main
+        sound_lateness = []
+        prearm_config = main.config
+        main.config = main.config._replace(prearm_seconds=0)
+
+        for run in range(cold_alarm_runs):
+            wait_for(lambda: not main.main_display_status["active"])
+            ring_moment, due_time = self.clock.next_minute_in(ring_lead_time)
+            set_time = time.monotonic()
+            self.post(main.settings_post_endpoint, f"ring_time={ring_moment:%H:%M}&ring_tone=main_audio.wav&snooze_time=10")
+
+            #The sink still holds the time of the last alarm until it is opened again
+            wait_for(lambda: main.get_audio().playing and (main.get_audio().sink.first_write_time or 0) > set_time)
+            sound_lateness.append(main.get_audio().sink.first_write_time - due_time)
+            self.post(main.stop_alarm_endpoint, "action=stop_alarm")
+            wait_for(lambda: not main.get_audio().playing)
+
+        main.config = prearm_config
+        self.results["wake_to_sound_without_prearm"] = sound_lateness
+
+#--------------------------------------------------Report-------------------------------------------------#
+
+def summarize(results):
+    summary = {}
+    for name, values in results.items():
+        summary[name] = {
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "max": max(values),
+            "mean": statistics.mean(values),
+        }
+    return summary
+
+def report(summary, baseline):
+    regressions = []
+    for name, values in summary.items():
+        if name.startswith("idle_cpu"):
+            line = f"{name:<34} {values['p50'] * 100:7.2f} % of one core"
+        else:
+            line = f"{name:<34} p50 {values['p50'] * 1000:7.2f} ms   p95 {values['p95'] * 1000:7.2f} ms   max {values['max'] * 1000:7.2f} ms"
+
+        if baseline and name in baseline:
+            base_p95 = baseline[name]["p95"]
+            line += f"   (baseline p95 {base_p95 * 1000:.2f})" if not name.startswith("idle_cpu") else f"   (baseline {base_p95 * 100:.2f} %)"
+            if (values["p95"] > base_p95 * regression_factor + regression_margin):
+                regressions.append(name)
+                line += " \033[91mREGRESSION\033[0m"
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the latencies and idle CPU of the alarm clock against fake hardware")
+    parser.add_argument("--baseline", default=os.path.join(baseline_directory, platform.node() + ".json"), help="Baseline file to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as new baseline")
+    parser.add_argument("--verbose", action="store_true", help="Show the log of the alarm clock scripts")
+    arguments = parser.parse_args()
+
+    alarm_logging.setup_logging("DEBUG" if arguments.verbose else "CRITICAL")
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        benchmark = LatencyBenchmark(temp_directory)
+        benchmark.run_idle()
+        benchmark.run_menu()
+        benchmark.run_ticks()
+        benchmark.run_alarms()
+        benchmark.run_cold_alarms()
+
+    summary = summarize(benchmark.results)
+    baseline = None
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+
+    print(f"Alarm clock latencies, {alarm_runs} alarms, {menu_runs} menu cycles, {tick_runs} minute changes, {idle_seconds} s idle windows")
+    regressions = report(summary, baseline)
+
+    if arguments.save_baseline:
+        os.makedirs(os.path.dirname(arguments.baseline), exist_ok=True)
+        with open(arguments.baseline, "w") as baseline_file:
+            json.dump({"created": datetime.now().isoformat(timespec="seconds"), "results": summary}, baseline_file, indent=2)
+        print(f"Saved baseline to {arguments.baseline}")
+    elif regressions:
+        print(f"\033[91m{len(regressions)} regression(s) compared to {arguments.baseline}\033[0m")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
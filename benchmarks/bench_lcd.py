@@ -0,0 +1,62 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+#Allow running the benchmark from any directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lcd_framebuffer
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+simulated_minutes = 24 * 60 #One clock update per minute
+week_days = ["So", "Mo", "Di", "Mi", "Do", "Fr", "Sa"]
+
+#------------------------------------------------Benchmark------------------------------------------------#
+
+#The clock screen of main_display1.2.py for every minute of a day, with the alarm ringing for 10 minutes at 06:00
+def clock_screens():
+    moment = datetime(2026, 1, 5)
+    for _ in range(simulated_minutes):
+        line1 = "    " + week_days[int(moment.strftime("%w"))] + " " + moment.strftime("%H:%M")
+        if (moment.hour == 6 and moment.minute < 10):
+            line2 = " (*) Wecker (*)"
+        else:
+            line2 = "Wecker um: 06:00"
+        yield line1, line2
+        moment += timedelta(minutes=1)
+
+#Old write_to_display(): both rows are rewritten whenever anything changed
+def full_line_writes():
+    lcd = lcd_framebuffer.FakeLCD()
+    last_content = None
+    for line1, line2 in clock_screens():
+        if (last_content != [line1, line2]):
+            lcd.cursor_pos = (0, 0)
+            lcd.write_string(line1.ljust(16))
+            lcd.cursor_pos = (1, 0)
+            lcd.write_string(line2.ljust(16))
+            last_content = [line1, line2]
+    return lcd
+
+def framebuffer_writes():
+    lcd = lcd_framebuffer.FakeLCD()
+    main_display = lcd_framebuffer.LCDFrameBuffer(lcd)
+    for line1, line2 in clock_screens():
+        main_display.write_line(0, line1)
+        main_display.write_line(1, line2)
+        main_display.flush()
+    return lcd
+
+def report(name, lcd):
+    print(f"{name:<18} {lcd.commands:7} cursor moves   {lcd.characters:7} characters   {lcd.i2c_writes:8} I2C writes")
+
+def main():
+    print(f"LCD writes for {simulated_minutes} clock updates")
+    old = full_line_writes()
+    new = framebuffer_writes()
+    report("full line rewrite", old)
+    report("frame buffer", new)
+    print(f"I2C writes saved: {100 * (1 - new.i2c_writes / old.i2c_writes):.1f} %")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+#Allow running the benchmark from any directory
+repository = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+runs = 5 #Starts per mode
+api_port = 8080 #Port of the main program when it binds the socket itself (api_server_port in alarm_clock.conf)
+poll_interval = 0.002 #Seconds between connection attempts while the port is not open yet
+start_timeout = 30 #Seconds a start may take before the run counts as failed
+ready_timeout = 5 #Seconds READY=1 may come after the first response
+
+#Run without the real hardware
+fake_environment = {"ALARM_CLOCK_FAKE_GPIO": "1", "ALARM_CLOCK_FAKE_LCD": "1", "ALARM_CLOCK_AUDIO_SINK": "null", "ALARM_CLOCK_LOG_LEVEL": "CRITICAL"}
+
+#------------------------------------------------Helpers--------------------------------------------------#
+
+#Sends GET /status on an open connection and waits for the status line
+def request_status(connection):
+    connection.sendall(b"GET /status HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+    response = connection.recv(64)
+    if not response.startswith(b"HTTP/1.1 200"):
+        raise RuntimeError(f"Unexpected response {response!r}")
+
+#Waits for READY=1 on the notify socket, returns time.monotonic() of that moment or None
+def wait_for_ready(notify_socket, deadline):
+    while time.monotonic() < deadline:
+        notify_socket.settimeout(max(deadline - time.monotonic(), 0.001))
+        try:
+            message = notify_socket.recv(4096)
+        except socket.timeout:
+            return None
+        if b"READY=1" in message.split(b"\n"):
+            return time.monotonic()
+    return None
+
+#------------------------------------------------Benchmark------------------------------------------------#
+
+#Starts the main program once and measures the time until it answers GET /status and until it reports READY=1
+#socket_activated=True passes pre-opened sockets like systemd does (LISTEN_FDS), the request is sent right away
+#and waits in the backlog, otherwise the benchmark retries until the program opened its port
+def start_once(temp_directory, socket_activated):
+    notify_path = os.path.join(temp_directory, "notify.sock")
+    if os.path.exists(notify_path):
+        os.remove(notify_path)
+    notify_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    notify_socket.bind(notify_path)
+
+    environment = dict(os.environ, **fake_environment, NOTIFY_SOCKET=notify_path)
+    command = [sys.executable, "main 1.6.py"]
+    preexec = None
+    passed_sockets = []
+
+    if socket_activated:
+        api_socket = socket.socket()
+        api_socket.bind(("127.0.0.1", 0))
+        api_socket.listen(16)
+        ipc_path = os.path.join(temp_directory, "alarm_ipc.sock")
+        if os.path.exists(ipc_path):
+            os.remove(ipc_path)
+        ipc_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        ipc_socket.bind(ipc_path)
+        ipc_socket.listen(16)
+        passed_sockets = [api_socket, ipc_socket]
+        port = api_socket.getsockname()[1]
+
+        #systemd puts the sockets at fd 3, 4, ... and sets LISTEN_PID to the pid of the exec'd program,
+        #the shell keeps its pid when it execs python
+        environment.update(LISTEN_FDS="2", LISTEN_FDNAMES="api:ipc")
+        command = ["/bin/sh", "-c", 'LISTEN_PID=$$ exec "$0" "$@"'] + command
+        def preexec():
+            os.dup2(api_socket.fileno(), 3)
+            os.dup2(ipc_socket.fileno(), 4)
+    else:
+        port = api_port
+
+    start_time = time.monotonic()
+    process = subprocess.Popen(command, cwd=repository, env=environment, preexec_fn=preexec, close_fds=not socket_activated, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = start_time + start_timeout
+    try:
+        while True:
+            if (time.monotonic() > deadline or process.poll() is not None):
+                raise RuntimeError("The main program did not answer")
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=start_timeout) as connection:
+                    request_status(connection)
+                break
+            except ConnectionRefusedError:
+                time.sleep(poll_interval)
+        first_response = time.monotonic() - start_time
+
+        ready_time = wait_for_ready(notify_socket, time.monotonic() + ready_timeout)
+        ready = None if ready_time is None else ready_time - start_time
+        return first_response, ready
+    finally:
+        process.terminate()
+        process.wait()
+        notify_socket.close()
+        for passed_socket in passed_sockets:
+            passed_socket.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures how long the main program needs after a start until it answers HTTP requests")
+    parser.add_argument("--runs", type=int, default=runs)
+    parser.add_argument("--skip-port", action="store_true", help=f"Only measure socket activation (port {api_port} is in use)")
+    arguments = parser.parse_args()
+
+    modes = [("socket activated", True)]
+    if not arguments.skip_port:
+        modes.insert(0, (f"binding port {api_port}", False))
+
+    print(f"Main program start up, {arguments.runs} starts per mode (fake hardware)")
+    with tempfile.TemporaryDirectory() as temp_directory:
+        for name, socket_activated in modes:
+            results = [start_once(temp_directory, socket_activated) for _ in range(arguments.runs)]
+            first_responses = [result[0] for result in results]
+            ready_times = [result[1] for result in results if result[1] is not None]
+
+            line = f"{name:<20} first response p50 {statistics.median(first_responses) * 1000:7.1f} ms   max {max(first_responses) * 1000:7.1f} ms"
+            if ready_times:
+                line += f"   READY=1 p50 {statistics.median(ready_times) * 1000:7.1f} ms"
+            else:
+                line += "   no READY=1"
+            print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import wave
+import shutil
+import atexit
+import asyncio
+import socket
+import argparse
+import tempfile
+import threading
+import statistics
+import http.client
+import urllib.parse
+import urllib.request
+import importlib.util
+from datetime import datetime, timedelta
+
+#Run without the real hardware, must be set before the scripts are loaded
+os.environ.setdefault("ALARM_CLOCK_FAKE_GPIO", "1")
+os.environ.setdefault("ALARM_CLOCK_FAKE_LCD", "1")
+os.environ.setdefault("ALARM_CLOCK_AUDIO_SINK", "null")
+os.environ.setdefault("ALARM_CLOCK_LOG_LEVEL", "CRITICAL")
+
+#Allow running the benchmark from any directory, the scripts load their pages relative to the repository
+repository = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repository)
+os.chdir(repository)
+import alarm_ipc
+import shared_state
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+runs = 20 #Page loads per scenario and cache state
+link_mbit = 20 #Throughput of the Wi-Fi link for the estimated load time (a Pi Zero W manages about this much)
+rtt_ms = 5 #Round trip time of the Wi-Fi link for the estimated load time
+request_timeout = 10 #Seconds a request may take
+
+#Pages a visitor opens: (name, path, alarm armed)
+scenarios = [
+    ("settings page", "/", False),
+    ("stop page", "/", True),
+    ("statistics page", "/index.php?page=stats", False),
+]
+
+#How the pages are loaded from the alarm clock: (name, options of Browser)
+#"emulated nginx + PHP" is the daemon with compression and caching turned off, it repeats what a browser got from the
+#old setup: index.php sent the page on every visit (compressed, the Debian nginx compresses text/html only), nginx sent
+#the assets uncompressed with an ETag but without Cache-Control, so every visit revalidated them
+#The real nginx + PHP-FPM setup is only measured with --baseline-url (reported as "nginx + PHP")
+modes = [
+    ("daemon", {}),
+    ("emulated nginx + PHP", {"gzip_assets": False, "cache_pages": False, "use_max_age": False}),
+]
+
+#------------------------------------------------Helpers--------------------------------------------------#
+
+def load_script(module_name, file_name):
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(repository, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def write_ringtone(path):
+    with wave.open(path, "wb") as ringtone:
+        ringtone.setnchannels(2)
+        ringtone.setsampwidth(2)
+        ringtone.setframerate(44100)
+        ringtone.writeframes(bytes(4 * 4410))
+
+#Estimated time of a page load on the real link: the bytes at mbit plus one round trip per request
+#(the requests are sent one after another over one kept-alive connection)
+def link_seconds(requests, received_bytes, mbit, rtt):
+    return received_bytes * 8 / (mbit * 1000000) + requests * rtt / 1000
+
+#------------------------------------------------Browser--------------------------------------------------#
+
+#Loads a page and the files it links (stylesheet, icon, images) like a browser does, over one kept-alive connection
+#It keeps what it received: responses with max-age are not requested again until they expire, the others are
+#revalidated with If-None-Match (304 if unchanged). Sends Accept-Encoding: gzip for the page and (gzip_assets) the assets
+#cache_pages=False and use_max_age=False ignore the validators of the page and the max-age of the assets
+#The requests the scripts of the pages send to the alarm API (GET /config, /history) are the same with every
+#server and are left out
+class Browser:
+
+    def __init__(self, base_url, gzip_assets=True, cache_pages=True, use_max_age=True):
+        url = urllib.parse.urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.prefix = url.path.rstrip("/")
+        self.gzip_assets = gzip_assets
+        self.cache_pages = cache_pages
+        self.use_max_age = use_max_age
+        self.cache = {} #path -> (etag, fresh until time.monotonic(), body)
+        self.connection = None
+
+    #Returns (body, received bytes) of a GET, the body of a 304 comes from the cache
+    def get(self, path, page=False):
+        headers = {"Accept-Encoding": "gzip" if (page or self.gzip_assets) else "identity"}
+        cached = self.cache.get(path) if (self.cache_pages or not page) else None
+        if (cached is not None and cached[0]):
+            headers["If-None-Match"] = cached[0]
+
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=request_timeout)
+            try:
+                self.connection.request("GET", self.prefix + path, headers=headers)
+                response = self.connection.getresponse()
+                received = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                #The server closed the kept-alive connection, the request is sent again on a new one
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+        if (response.getheader("Connection", "").lower() == "close"):
+            self.connection.close()
+            self.connection = None
+
+        if (response.status == 304 and cached is not None):
+            body = cached[2]
+        elif (response.status == 200):
+            body = gzip.decompress(received) if response.getheader("Content-Encoding") == "gzip" else received
+        else:
+            raise RuntimeError(f"GET {path} answered {response.status}")
+
+        cache_control = response.getheader("Cache-Control", "")
+        max_age = re.search(r"max-age=(\d+)", cache_control)
+        fresh_until = time.monotonic() + int(max_age.group(1)) if (max_age and self.use_max_age and "no-cache" not in cache_control) else 0
+        self.cache[path] = (response.getheader("ETag") or (cached[0] if cached else None), fresh_until, body)
+        return body, len(received)
+
+    #Returns (requests, received bytes, seconds) of one page load
+    def load(self, path):
+        start_time = time.perf_counter()
+        body, received = self.get(path, page=True)
+        requests = 1
+        base = path.split("?")[0].rsplit("/", 1)[0] + "/"
+        for link in re.findall(rb'(?:href|src)="([^":#]+)"', body):
+            link = link.decode()
+            if (os.path.splitext(link.split("?")[0])[1] in ("", ".php", ".html")):
+                continue
+            link = urllib.parse.urljoin(base, link)
+            cached = self.cache.get(link)
+            if (cached is not None and cached[1] > time.monotonic()):
+                continue
+            received += self.get(link)[1]
+            requests += 1
+        return requests, received, time.perf_counter() - start_time
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+#------------------------------------------------Benchmark------------------------------------------------#
+
+#Runs the main program in this process (API server on a free port, files in a temp directory)
+class WebServer:
+
+    def __init__(self, temp_directory):
+        main = load_script("alarm_clock_main", "main 1.6.py")
+        main.config = main.config._replace(ringtone_directory=temp_directory, api_server_port=free_port())
+        main.webserver_status_file = os.path.join(temp_directory, "alarm_webserver_status.status")
+        main.from_main_display_status_file = os.path.join(temp_directory, "status_from_main_display_to_main.status")
+        main.alarm_journal_file = os.path.join(temp_directory, "alarm_journal.log")
+        main.event_history_file = os.path.join(temp_directory, "alarm_history.bin")
+        main.main_display_shared_state = shared_state.SharedAlarmState(os.path.join(temp_directory, "alarm_clock_state"), create=True)
+        main.status_publisher = alarm_ipc.StatusPublisher(os.path.join(temp_directory, "alarm_ipc.sock"), on_message=main.handle_main_display_message)
+        main.status_publisher.start()
+        write_ringtone(os.path.join(temp_directory, "main_audio.wav"))
+        self.main = main
+        self.url = f"http://127.0.0.1:{main.config.api_server_port}"
+
+    def start(self):
+        loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.main.serve())
+
+        threading.Thread(target=run, daemon=True).start()
+        deadline = time.monotonic() + request_timeout
+        while (self.main.status_broadcaster.version == 0 or not self.main.web_ui.assets):
+            if time.monotonic() > deadline:
+                raise RuntimeError("The main program did not start")
+            time.sleep(0.01)
+
+    #Arms an alarm in twelve hours (the stop page is shown) or removes every alarm (the settings page is shown)
+    def set_armed(self, armed):
+        if armed:
+            ring_time = (datetime.now() + timedelta(hours=12)).strftime("%H:%M")
+            data = urllib.parse.urlencode({"ring_time": ring_time, "ring_tone": "main_audio.wav"}).encode()
+            urllib.request.urlopen(f"{self.url}{self.main.settings_post_endpoint}", data, timeout=request_timeout).read()
+        else:
+            alarms = json.loads(urllib.request.urlopen(f"{self.url}{self.main.list_alarms_endpoint}", timeout=request_timeout).read())
+            for alarm in alarms:
+                data = urllib.parse.urlencode({"id": alarm["id"]}).encode()
+                urllib.request.urlopen(f"{self.url}{self.main.remove_alarm_endpoint}", data, timeout=request_timeout).read()
+
+#Loads a page runs times with an empty cache (cold, a first visit) and runs times with the cache of the visit before
+#(warm, reopening the page), returns {"cold": [...], "warm": [...]} with (requests, bytes, seconds) per load
+def measure(base_url, path, options, runs):
+    results = {"cold": [], "warm": []}
+    for _ in range(runs):
+        browser = Browser(base_url, **options)
+        results["cold"].append(browser.load(path))
+        results["warm"].append(browser.load(path))
+        browser.close()
+    return results
+
+def print_results(name, results, arguments):
+    for state in ("cold", "warm"):
+        loads = results[state]
+        requests = statistics.median(load[0] for load in loads)
+        received = statistics.median(load[1] for load in loads)
+        local = statistics.median(load[2] for load in loads)
+        link = link_seconds(requests, received, arguments.link_mbit, arguments.rtt_ms)
+        print(f"  {name:<20} {state:<5} {requests:4.0f} requests {received / 1024:9.1f} KiB   local p50 {local * 1000:7.2f} ms   on the link {link * 1000:8.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures cold and warm loads of the web pages served by the alarm clock")
+    parser.add_argument("--runs", type=int, default=runs)
+    parser.add_argument("--link-mbit", type=float, default=link_mbit, help="Link throughput for the estimated load time")
+    parser.add_argument("--rtt-ms", type=float, default=rtt_ms, help="Link round trip time for the estimated load time")
+    parser.add_argument("--baseline-url", help="Also load the pages from this server, e.g. http://<pi> for nginx + PHP (arms and removes alarms on the alarm clock of this benchmark only, the state of the other server is left as it is)")
+    arguments = parser.parse_args()
+
+    #Removed at exit after the alarm journal wrote its last changes (atexit runs the latest registered function first)
+    temp_directory = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, temp_directory, True)
+
+    print(f"Web interface page loads, {arguments.runs} runs each (link estimate: {arguments.link_mbit:g} Mbit/s, {arguments.rtt_ms:g} ms round trip)")
+    server = WebServer(temp_directory)
+    server.start()
+
+    for name, path, armed in scenarios:
+        server.set_armed(armed)
+        print(name)
+        for mode, options in modes:
+            print_results(mode, measure(server.url, path, options, arguments.runs), arguments)
+        if arguments.baseline_url:
+            print_results("nginx + PHP", measure(arguments.baseline_url, path, {}, arguments.runs), arguments)
+
+if __name__ == "__main__":
+    main()
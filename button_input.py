@@ -0,0 +1,313 @@
+import os
+import time
+import queue
+import threading
+from collections import namedtuple
+import logging
+import alarm_metrics
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+fake_gpio_environment_variable = "ALARM_CLOCK_FAKE_GPIO" #Set to 1 to run without a Raspberry Pi (uses FakeGPIO)
+default_debounce_ms = 50 #Edges closer together than this are treated as contact bounce
+default_long_press_time = 1 #Seconds a button has to be held before long_press events are sent
+default_repeat_interval = 0.1 #Seconds between repeated long_press events while the button is held
+
+#Event kinds
+press = "press" #Sent as soon as the button goes HIGH
+long_press = "long_press" #Sent after long_press_time and then every repeat_interval while the button is held
+release = "release" #Sent when the button goes LOW again
+
+#Metrics (see alarm_metrics.py)
+button_events = alarm_metrics.registry.counter("alarm_button_events_total", "Button events", ["button", "kind"])
+button_bounces = alarm_metrics.registry.counter("alarm_button_bounces_total", "Edges ignored as contact bounce", ["button"])
+
+#button: name given to add_button(), kind: press/long_press/release, timestamp: time.monotonic() of the edge
+ButtonEvent = namedtuple("ButtonEvent", ["button", "kind", "timestamp"])
+
+#Returns the RPi.GPIO module, or a FakeGPIO if ALARM_CLOCK_FAKE_GPIO=1 is set
+def load_gpio():
+    if (os.environ.get(fake_gpio_environment_variable) == "1"):
+        log.warning("%s is set, using fake GPIO backend", fake_gpio_environment_variable)
+        return FakeGPIO()
+
+    import RPi.GPIO as GPIO
+    return GPIO
+
+#------------------------------------------------Fake GPIO------------------------------------------------#
+
+#Pure python stand-in for the parts of RPi.GPIO used by the alarm clock
+#Tests and benchmarks drive the inputs with set_input() / press() instead of real buttons
+class FakeGPIO:
+
+    BOARD = 10
+    BCM = 11
+    IN = 1
+    OUT = 0
+    HIGH = 1
+    LOW = 0
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.mode = None
+        self.levels = {}
+        self.directions = {}
+        self.callbacks = {} #pin -> (edge, callback, bouncetime in seconds, last callback time)
+        self.edge_condition = threading.Condition()
+        self.lock = threading.Lock()
+
+    def setwarnings(self, enabled):
+        pass
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def getmode(self):
+        return self.mode
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        self.directions[pin] = direction
+        if (direction == self.OUT and initial is not None):
+            self.levels[pin] = initial
+        elif pin not in self.levels:
+            self.levels[pin] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def output(self, pin, value):
+        self.levels[pin] = self.HIGH if value else self.LOW
+
+    def cleanup(self, pin=None):
+        with self.lock:
+            if pin is None:
+                self.callbacks.clear()
+                self.directions.clear()
+            else:
+                self.callbacks.pop(pin, None)
+                self.directions.pop(pin, None)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        with self.lock:
+            if pin in self.callbacks:
+                raise RuntimeError(f"Conflicting edge detection already enabled for pin {pin}")
+            self.callbacks[pin] = [edge, callback, (bouncetime or 0) / 1000, None]
+
+    def remove_event_detect(self, pin):
+        with self.lock:
+            self.callbacks.pop(pin, None)
+
+    #Blocks until the given edge happens on the pin, returns the pin or None on timeout (timeout in ms)
+    def wait_for_edge(self, pin, edge, timeout=None):
+        start_level = self.input(pin)
+        wanted_level = self.HIGH if edge == self.RISING else self.LOW
+
+        def edge_seen():
+            level = self.input(pin)
+            if edge == self.BOTH:
+                return level != start_level
+            return level == wanted_level and level != start_level
+
+        with self.edge_condition:
+            if self.edge_condition.wait_for(edge_seen, None if timeout is None else timeout / 1000):
+                return pin
+            return None
+
+    #--- Helpers to simulate hardware ---#
+
+    #Sets the level of an input pin and runs the edge callback like the real library would
+    def set_input(self, pin, level):
+        old_level = self.levels.get(pin, self.LOW)
+        self.levels[pin] = level
+
+        with self.edge_condition:
+            self.edge_condition.notify_all()
+
+        if old_level == level:
+            return
+
+        with self.lock:
+            detection = self.callbacks.get(pin)
+            if detection is None:
+                return
+            edge, callback, bouncetime, last_call = detection
+            if edge == self.RISING and level != self.HIGH:
+                return
+            if edge == self.FALLING and level != self.LOW:
+                return
+
+            now = time.monotonic()
+            if last_call is not None and now - last_call < bouncetime:
+                return
+            detection[3] = now
+
+        if callback:
+            callback(pin)
+
+    #Presses a button for the given number of seconds (0 = tap)
+    def press(self, pin, duration=0):
+        self.set_input(pin, self.HIGH)
+        if duration:
+            time.sleep(duration)
+        self.set_input(pin, self.LOW)
+
+#-----------------------------------------------Button input----------------------------------------------#
+
+#Turns GPIO edges into debounced press/long_press/release events and puts them into a queue
+#Nothing is polled: edges are detected by the GPIO library and long presses are timed with threading.Timer
+class ButtonInput:
+
+    def __init__(self, gpio, event_queue=None, debounce_ms=default_debounce_ms, long_press_time=default_long_press_time, repeat_interval=default_repeat_interval):
+        self.gpio = gpio
+        self.events = event_queue if event_queue is not None else queue.Queue()
+        self.debounce = debounce_ms / 1000
+        self.long_press_time = long_press_time
+        self.repeat_interval = repeat_interval
+        self.buttons = {} #pin -> name
+        self.pressed = {} #pin -> time.monotonic() of the press, only while held
+        self.last_edge = {} #pin -> time.monotonic() of the last accepted edge
+        self.timers = {} #pin -> long press timer
+        self.settle_timers = {} #pin -> timer that reads the level again after edges ignored as bounce
+        self.lock = threading.Lock()
+
+    #Registers a button (GPIO.BOARD numbering, pulled down, HIGH while pressed)
+    def add_button(self, name, pin):
+        self.gpio.setup(pin, self.gpio.IN, pull_up_down=self.gpio.PUD_DOWN)
+        self.buttons[pin] = name
+        self.gpio.add_event_detect(pin, self.gpio.BOTH, callback=self._edge)
+
+    #Also forgets held buttons, a button held while the pins are remapped (e.g. config reload) sends no release
+    def remove_all(self):
+        for pin in list(self.buttons):
+            self.gpio.remove_event_detect(pin)
+            with self.lock:
+                self._cancel_timer(pin)
+                settle_timer = self.settle_timers.pop(pin, None)
+                self.pressed.pop(pin, None)
+                self.last_edge.pop(pin, None)
+                del self.buttons[pin]
+            if settle_timer:
+                settle_timer.cancel()
+
+    #Returns the next ButtonEvent or None if none arrives within timeout seconds
+    def get_event(self, timeout=None):
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    #Drops the queued ButtonEvents, e.g. presses that happened while a message was shown
+    #The queue can be shared with other events (e.g. status updates of the main display), those are put back in order
+    def clear_events(self):
+        kept = []
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if not isinstance(event, ButtonEvent):
+                kept.append(event)
+        for event in kept:
+            self.events.put(event)
+
+    def is_pressed(self, name):
+        with self.lock:
+            return any(self.buttons.get(pin) == name for pin in self.pressed)
+
+    #Called by the GPIO library on every edge
+    def _edge(self, pin):
+        now = time.monotonic()
+        level = self.gpio.input(pin)
+
+        with self.lock:
+            #An edge callback that was already running when the button was removed
+            if pin not in self.buttons:
+                return
+
+            #Software debounce, the bouncetime of RPi.GPIO does not work well with GPIO.BOTH
+            last_edge = self.last_edge.get(pin)
+            if last_edge is not None and now - last_edge < self.debounce:
+                button_bounces.inc(button=self.buttons[pin])
+                #The ignored edge can be the last one (a tap shorter than the debounce time or a bouncing release),
+                #so the level is read again when the debounce time is over
+                if pin not in self.settle_timers:
+                    self._start_settle_timer(pin, last_edge + self.debounce - now)
+                return
+            self.last_edge[pin] = now
+            kind = self._apply_level(pin, level, now)
+
+        self._send(pin, kind, now)
+
+    #Updates the state of the button to the level, returns the event kind (press/release) or None if nothing changed
+    #Has to be called with self.lock held
+    def _apply_level(self, pin, level, now):
+        if (level == self.gpio.HIGH and pin not in self.pressed):
+            self.pressed[pin] = now
+            self._start_timer(pin, self.long_press_time)
+            return press
+        elif (level == self.gpio.LOW and pin in self.pressed):
+            del self.pressed[pin]
+            self._cancel_timer(pin)
+            return release
+        return None
+
+    #Events of a button that was removed in the meantime are dropped
+    def _send(self, pin, kind, timestamp):
+        name = self.buttons.get(pin)
+        if (kind is None or name is None):
+            return
+        button_events.inc(button=name, kind=kind)
+        self.events.put(ButtonEvent(name, kind, timestamp))
+
+    def _start_settle_timer(self, pin, delay):
+        timer = threading.Timer(max(delay, 0), self._settle, args=(pin,))
+        timer.name = "button-debounce"
+        timer.daemon = True
+        self.settle_timers[pin] = timer
+        timer.start()
+
+    #Runs when the debounce time after ignored edges is over, sends the press or release the ignored edges hid
+    def _settle(self, pin):
+        with self.lock:
+            if (self.settle_timers.pop(pin, None) is None or pin not in self.buttons):
+                return
+            now = time.monotonic()
+            kind = self._apply_level(pin, self.gpio.input(pin), now)
+            if kind is not None:
+                self.last_edge[pin] = now
+
+        self._send(pin, kind, now)
+
+    def _start_timer(self, pin, delay):
+        timer = threading.Timer(delay, self._long_press, args=(pin,))
+        timer.name = "button-long-press"
+        timer.daemon = True
+        self.timers[pin] = timer
+        timer.start()
+
+    def _cancel_timer(self, pin):
+        timer = self.timers.pop(pin, None)
+        if timer:
+            timer.cancel()
+
+    #Repeats while the button is held, a button that is not HIGH anymore is released (its release edge was lost)
+    def _long_press(self, pin):
+        now = time.monotonic()
+        with self.lock:
+            if pin not in self.pressed:
+                return
+            if (self.gpio.input(pin) == self.gpio.HIGH):
+                self._start_timer(pin, self.repeat_interval)
+                kind = long_press
+            else:
+                kind = self._apply_level(pin, self.gpio.LOW, now)
+
+        self._send(pin, kind, now)
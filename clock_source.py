@@ -0,0 +1,236 @@
+import os
+import time
+import heapq
+import errno
+import asyncio
+import selectors
+import ctypes
+import logging
+import itertools
+import threading
+import ctypes.util
+from datetime import datetime, timedelta
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+step_check_interval = 60 #Seconds between wall clock checks if timerfd is not available (not Linux)
+min_step = 1 #Changes of the wall clock smaller than this (seconds) are not reported as step
+
+#Linux constants for timerfd
+clock_realtime = 0
+tfd_timer_abstime = 1
+tfd_timer_cancel_on_set = 2
+
+#--------------------------------------------Wall clock steps---------------------------------------------#
+
+class timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+class itimerspec(ctypes.Structure):
+    _fields_ = [("it_interval", timespec), ("it_value", timespec)]
+
+#Calls the listeners whenever the wall clock is set (NTP step after boot, date -s, ...)
+#On Linux a timerfd with TFD_TIMER_CANCEL_ON_SET is armed far in the future: the kernel cancels it when the
+#clock is set, so the thread sleeps in read() and never wakes up otherwise
+#Other systems compare the wall clock with the monotonic clock every step_check_interval seconds
+class WallClockWatcher:
+
+    def __init__(self):
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add_listener(self, callback):
+        with self.lock:
+            self.listeners.append(callback)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._watch, name="clock-watcher", daemon=True)
+                self.thread.start()
+
+    def _notify(self):
+        log.warning("The wall clock was set, recalculating alarm times")
+        with self.lock:
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener()
+
+    def _watch(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            timer_descriptor = libc.timerfd_create(clock_realtime, 0)
+            if (timer_descriptor < 0):
+                raise OSError(ctypes.get_errno(), "timerfd_create failed")
+        except (OSError, AttributeError) as error:
+            log.info("timerfd not available (%s), checking the wall clock every %s s", error, step_check_interval)
+            self._poll()
+            return
+
+        while True:
+            #A year ahead keeps the value in range of a 32 bit time_t
+            timer = itimerspec()
+            timer.it_value.tv_sec = int(time.time()) + 365 * 24 * 3600
+            if (libc.timerfd_settime(timer_descriptor, tfd_timer_abstime | tfd_timer_cancel_on_set, ctypes.byref(timer), None) < 0):
+                log.error("timerfd_settime failed (errno %s), checking the wall clock every %s s", ctypes.get_errno(), step_check_interval)
+                os.close(timer_descriptor)
+                self._poll()
+                return
+
+            try:
+                os.read(timer_descriptor, 8)
+            except OSError as error:
+                if (error.errno != errno.ECANCELED):
+                    raise
+                self._notify()
+
+    def _poll(self):
+        offset = time.time() - time.monotonic()
+        while True:
+            time.sleep(step_check_interval)
+            new_offset = time.time() - time.monotonic()
+            if (abs(new_offset - offset) >= min_step):
+                self._notify()
+            offset = new_offset
+
+wall_clock_watcher = WallClockWatcher()
+
+#--------------------------------------------------Clocks-------------------------------------------------#
+
+#Every time decision of the alarm clock goes through a clock object, so the scripts can run against
+#the real time (SystemClock) or a simulated timeline (SimulatedClock)
+#Alarm times are wall clock times (now(), time()), timeouts always run on the monotonic clock (sleep() and the
+#event loop from new_event_loop()), so watch_steps() tells when the two drifted apart and wall clock deadlines
+#have to be recalculated
+
+#The real time
+class SystemClock:
+
+    def now(self):
+        return datetime.now()
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    #asyncio event loop whose timers run on this clock
+    def new_event_loop(self):
+        return asyncio.new_event_loop()
+
+    #Calls callback() whenever the wall clock is set
+    def watch_steps(self, callback):
+        wall_clock_watcher.add_listener(callback)
+
+#Raised by SimulatedClock when the end of the simulation is reached or nothing is left that could wake a waiting caller
+class SimulationFinished(Exception):
+    pass
+
+#Time warp: the simulated time only moves while the event loop (or a sleep) waits, and then jumps straight to
+#the next thing that can happen (a timer of the event loop or a scheduled action), so days pass in microseconds
+#Everything runs in the thread of the event loop: actions (button presses, HTTP requests, ...) are scheduled
+#with call_at()/call_later() and run when the simulated time reaches them, which keeps every run deterministic
+#The wall clock follows the local timezone (daylight saving time included) and can be set with step()
+class SimulatedClock:
+
+    def __init__(self, start, end=None):
+        self.start_time = start.timestamp()
+        self.elapsed = 0.0 #Simulated monotonic clock
+        self.offset = 0.0 #Wall clock steps so far
+        self.end = None if end is None else end.timestamp() - self.start_time #Waiting past this point raises SimulationFinished
+        self.actions = [] #Heap of [elapsed, sequence, callback]
+        self.sequence = itertools.count()
+        self.step_listeners = []
+
+    def now(self):
+        return datetime.fromtimestamp(self.time())
+
+    def time(self):
+        return self.start_time + self.elapsed + self.offset
+
+    def monotonic(self):
+        return self.elapsed
+
+    #Runs callback() once the wall clock reaches moment (as it looks now, later steps don't move the action)
+    def call_at(self, moment, callback):
+        self.call_later(moment.timestamp() - self.time(), callback)
+
+    def call_later(self, seconds, callback):
+        heapq.heappush(self.actions, [self.elapsed + max(seconds, 0), next(self.sequence), callback])
+
+    #Sets the wall clock forward (or back) like an NTP step, the monotonic clock does not move
+    def step(self, seconds):
+        self.offset += seconds
+        for listener in list(self.step_listeners):
+            listener()
+
+    def watch_steps(self, callback):
+        self.step_listeners.append(callback)
+
+    #Moves the monotonic clock forward and runs every action that is due on the way, in order
+    def advance_to(self, elapsed):
+        if (self.end is not None and elapsed > self.end):
+            elapsed = self.end
+
+        while self.actions and self.actions[0][0] <= elapsed:
+            due, _, callback = heapq.heappop(self.actions)
+            self.elapsed = max(self.elapsed, due)
+            callback()
+
+        self.elapsed = max(self.elapsed, elapsed)
+        if (self.end is not None and self.elapsed >= self.end):
+            raise SimulationFinished(f"Reached the end of the simulation at {self.now()}")
+
+    def sleep(self, seconds):
+        self.advance_to(self.elapsed + seconds)
+
+    def new_event_loop(self):
+        return SimulatedEventLoop(self)
+
+    #Jumps to the deadline (monotonic, None = none) or the next action, whichever comes first
+    def _step(self, deadline):
+        if self.actions and (deadline is None or self.actions[0][0] < deadline):
+            self.advance_to(self.actions[0][0])
+        elif deadline is not None:
+            self.advance_to(deadline)
+        elif self.end is not None:
+            self.advance_to(self.end)
+        else:
+            raise SimulationFinished("Waiting without a timeout and no action is scheduled")
+
+#Waiting for I/O is where the event loop would block, so that is where the simulated time jumps ahead
+#Sockets that are ready (e.g. call_soon_threadsafe() wakeups) are handled first, without moving the time
+class SimulatedSelector(selectors.DefaultSelector):
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if (events or timeout == 0):
+            return events
+
+        #Timeouts are rounded up to a simulated microsecond, after months of simulated time adding a few
+        #nanoseconds would get lost in float rounding and the time would never reach the timer
+        self.clock._step(None if timeout is None else self.clock.elapsed + max(timeout, 1e-6))
+        return super().select(0)
+
+#asyncio event loop on a SimulatedClock: its timers (asyncio.sleep(), wait_for() timeouts, call_later()) use
+#the simulated monotonic clock, SimulationFinished is raised out of run_until_complete() at the end
+class SimulatedEventLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self, clock):
+        super().__init__(SimulatedSelector(clock))
+        self.clock = clock
+        #Timers closer than this count as due, the default (the resolution of time.monotonic()) gets lost in
+        #float rounding after months of simulated time and the loop would spin without reaching the timer
+        self._clock_resolution = 1e-6
+
+    def time(self):
+        return self.clock.monotonic()
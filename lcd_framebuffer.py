@@ -0,0 +1,174 @@
+import os
+import threading
+import logging
+import alarm_metrics
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+fake_lcd_environment_variable = "ALARM_CLOCK_FAKE_LCD" #Set to 1 to run without the I2C display (uses FakeLCD)
+i2c_writes_per_byte = 6 #PCF8574 in 4 bit mode: 2 nibbles, each written with enable low, high, low
+max_merge_gap = 1 #Unchanged cells up to this size are rewritten instead of moving the cursor (a cursor move costs one byte too)
+
+#Metrics (see alarm_metrics.py)
+lcd_flushes = alarm_metrics.registry.counter("alarm_lcd_flushes_total", "Frame buffer flushes")
+lcd_cells_written = alarm_metrics.registry.counter("alarm_lcd_cells_written_total", "Characters sent to the LCD")
+lcd_cursor_moves = alarm_metrics.registry.counter("alarm_lcd_cursor_moves_total", "Cursor moves sent to the LCD")
+
+#Returns the RPLCD CharLCD on the I2C bus, or a FakeLCD if ALARM_CLOCK_FAKE_LCD=1 is set
+def load_lcd(cols=16, rows=2):
+    if (os.environ.get(fake_lcd_environment_variable) == "1"):
+        log.warning("%s is set, using fake LCD backend", fake_lcd_environment_variable)
+        return FakeLCD(cols, rows)
+
+    from RPLCD.i2c import CharLCD
+    return CharLCD(i2c_expander='PCF8574', address=0x27, port=1, cols=cols, rows=rows)
+
+#-------------------------------------------------Fake LCD------------------------------------------------#
+
+#Stand-in for RPLCD's CharLCD that keeps the screen content in memory and counts what would go over the I2C bus
+class FakeLCD:
+
+    def __init__(self, cols=16, rows=2):
+        self.cols = cols
+        self.rows = rows
+        self.screen = [[" "] * cols for _ in range(rows)]
+        self.cursor = (0, 0)
+        self.backlight_enabled = True
+        self.commands = 0 #Cursor moves, clears, ...
+        self.characters = 0 #Characters written
+
+    @property
+    def i2c_writes(self):
+        return (self.commands + self.characters) * i2c_writes_per_byte
+
+    def reset_counters(self):
+        self.commands = 0
+        self.characters = 0
+
+    @property
+    def cursor_pos(self):
+        return self.cursor
+
+    @cursor_pos.setter
+    def cursor_pos(self, position):
+        self.cursor = position
+        self.commands += 1
+
+    def write_string(self, text):
+        row, col = self.cursor
+        for char in text:
+            if col < self.cols:
+                self.screen[row][col] = char
+            col += 1
+            self.characters += 1
+        self.cursor = (row, col)
+
+    def clear(self):
+        self.screen = [[" "] * self.cols for _ in range(self.rows)]
+        self.cursor = (0, 0)
+        self.commands += 1
+
+    def lines(self):
+        return ["".join(row) for row in self.screen]
+
+#-----------------------------------------------Frame buffer----------------------------------------------#
+
+#Owns the content of the display: screens are drawn into the buffer with the same calls as CharLCD
+#(cursor_pos, write_string, clear) and flush() only sends the cells that changed
+class LCDFrameBuffer:
+
+    def __init__(self, lcd, cols=16, rows=2):
+        self.lcd = lcd
+        self.cols = cols
+        self.rows = rows
+        self.buffer = [[" "] * cols for _ in range(rows)] #What should be shown
+        self.shown = [[None] * cols for _ in range(rows)] #What the display shows, None = unknown
+        self.cursor = (0, 0) #Cursor for drawing into the buffer
+        self.lcd_cursor = None #Cursor of the real display, None = unknown
+        self.lock = threading.RLock()
+
+    #Passed through, the backlight is not part of the buffer
+    @property
+    def backlight_enabled(self):
+        return self.lcd.backlight_enabled
+
+    @backlight_enabled.setter
+    def backlight_enabled(self, enabled):
+        with self.lock:
+            self.lcd.backlight_enabled = enabled
+
+    @property
+    def cursor_pos(self):
+        return self.cursor
+
+    @cursor_pos.setter
+    def cursor_pos(self, position):
+        self.cursor = position
+
+    #Draws text into the buffer at the cursor, text beyond the end of the row is cut off
+    def write_string(self, text):
+        with self.lock:
+            row, col = self.cursor
+            for char in text:
+                if 0 <= col < self.cols:
+                    self.buffer[row][col] = char
+                col += 1
+            self.cursor = (row, col)
+
+    #Clears the buffer only, the display itself is updated by flush()
+    def clear(self):
+        with self.lock:
+            self.buffer = [[" "] * self.cols for _ in range(self.rows)]
+            self.cursor = (0, 0)
+
+    #Draws a whole row, padded with spaces
+    def write_line(self, row, text):
+        self.cursor_pos = (row, 0)
+        self.write_string(text[:self.cols].ljust(self.cols))
+
+    #Forgets what the display shows, the next flush() rewrites everything (e.g. after the display was reset)
+    def invalidate(self):
+        with self.lock:
+            self.shown = [[None] * self.cols for _ in range(self.rows)]
+            self.lcd_cursor = None
+
+    #Sends the changed cells to the display, returns the number of cells written
+    def flush(self):
+        written = 0
+        cursor_moves = 0
+        with self.lock:
+            for row in range(self.rows):
+                for start, end in self._changed_runs(row):
+                    #Writing advances the cursor, so runs directly after each other need no cursor move
+                    if (self.lcd_cursor != (row, start)):
+                        self.lcd.cursor_pos = (row, start)
+                        cursor_moves += 1
+                    self.lcd.write_string("".join(self.buffer[row][start:end]))
+                    self.shown[row][start:end] = self.buffer[row][start:end]
+                    self.lcd_cursor = (row, end)
+                    written += end - start
+
+        lcd_flushes.inc()
+        if written:
+            lcd_cells_written.inc(written)
+            lcd_cursor_moves.inc(cursor_moves)
+        return written
+
+    #Returns (start, end) ranges of changed cells in a row, nearby runs are merged
+    def _changed_runs(self, row):
+        runs = []
+        for col in range(self.cols):
+            if self.buffer[row][col] == self.shown[row][col]:
+                continue
+            if runs and col - runs[-1][1] <= max_merge_gap:
+                runs[-1][1] = col + 1
+            else:
+                runs.append([col, col + 1])
+        return runs
+
+    def lines(self):
+        with self.lock:
+            return ["".join(row) for row in self.buffer]
@@ -0,0 +1,94 @@
+import time
+import threading
+from collections import deque
+import logging
+import alarm_metrics
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+default_timeout_ms = 1000 #Longest charge time measured, longer means "as dark as it gets" (or no sensor connected)
+default_window = 5 #Number of readings in the moving average
+default_dark_threshold = 100 #Average charge time (ms) above which the room counts as dark
+default_hysteresis = 20 #The average has to move this far past the threshold before the state flips
+discharge_time = 0.1 #Seconds the capacitor is discharged before each measurement
+timeout_warning_count = 5 #Warn after this many timeouts in a row
+
+#Metrics (see alarm_metrics.py)
+light_samples = alarm_metrics.registry.counter("alarm_light_samples_total", "Light sensor readings")
+light_timeouts = alarm_metrics.registry.counter("alarm_light_timeouts_total", "Light sensor readings that timed out")
+light_charge_time = alarm_metrics.registry.gauge("alarm_light_charge_milliseconds", "Smoothed charge time of the light sensor, higher is darker")
+light_dark = alarm_metrics.registry.gauge("alarm_light_dark", "1 while the room counts as dark")
+
+#------------------------------------------------Sampler--------------------------------------------------#
+
+#Measures the brightness with a light-dependent resistor and a capacitor: the brighter it is, the faster the capacitor charges
+#The charge time is measured with edge detection (no busy loop) and capped at timeout_ms
+#Readings are smoothed with a moving average and the dark/bright state uses hysteresis so the backlight does not flicker
+class BrightnessSampler:
+
+    def __init__(self, gpio, pin, timeout_ms=default_timeout_ms, window=default_window, dark_threshold=default_dark_threshold, hysteresis=default_hysteresis):
+        self.gpio = gpio
+        self.pin = pin
+        self.timeout_ms = timeout_ms
+        self.readings = deque(maxlen=window)
+        self.dark_threshold = dark_threshold
+        self.hysteresis = hysteresis
+        self.dark = False
+        self.timeouts_in_a_row = 0
+        self.lock = threading.Lock()
+        self.latest = None #Last result of sample(), read by other threads
+
+    #Returns the charge time in ms, or None if the pin did not go HIGH within timeout_ms
+    def measure(self):
+        #Discharge the capacitor by setting the pin to output and driving it LOW
+        self.gpio.setup(self.pin, self.gpio.OUT)
+        self.gpio.output(self.pin, self.gpio.LOW)
+        time.sleep(discharge_time)
+
+        #Set the pin to input mode and sleep until the capacitor has charged enough to pull it HIGH
+        self.gpio.setup(self.pin, self.gpio.IN)
+        start_time = time.monotonic()
+        channel = self.gpio.wait_for_edge(self.pin, self.gpio.RISING, timeout=self.timeout_ms)
+
+        if channel is None:
+            return None
+        return round((time.monotonic() - start_time) * 1000)
+
+    #Takes one reading and returns the smoothed result as dict
+    def sample(self):
+        charge_time = self.measure()
+
+        with self.lock:
+            if charge_time is None:
+                self.timeouts_in_a_row += 1
+                charge_time = self.timeout_ms
+                if (self.timeouts_in_a_row == timeout_warning_count):
+                    log.warning("Light sensor on pin %s timed out %s times in a row. Is it connected?", self.pin, timeout_warning_count)
+            else:
+                self.timeouts_in_a_row = 0
+
+            self.readings.append(charge_time)
+            average = sum(self.readings) / len(self.readings)
+            light_samples.inc()
+            if self.timeouts_in_a_row:
+                light_timeouts.inc()
+
+            if (not self.dark and average > self.dark_threshold + self.hysteresis):
+                self.dark = True
+            elif (self.dark and average < self.dark_threshold - self.hysteresis):
+                self.dark = False
+
+            light_charge_time.set(round(average, 1))
+            light_dark.set(int(self.dark))
+
+            self.latest = {
+                "raw_ms": charge_time,
+                "average_ms": round(average, 1),
+                "dark": self.dark,
+                "timed_out": self.timeouts_in_a_row > 0,
+                "time": time.time(),
+            }
+            return self.latest
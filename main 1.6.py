@@ -1,232 +1,875 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from datetime import datetime
-import RPi.GPIO as GPIO
 import time
-from time import sleep
+import asyncio
 import urllib.parse
-import subprocess
-import threading
 import os
 import re
+import json
+import itertools
+import wave
+import alarm_ipc
+import alarm_config
+import async_http
+import alarm_scheduler as alarm_scheduler_module
+import alarm_store
+import alarm_history
+import alarm_profiler
+import web_ui as web_ui_module
+import button_input
+import audio_engine
+import audio_dsp
+import ringtone_ingest
+import shared_state
+import status_stream
+import clock_source
+import alarm_metrics
+import alarm_logging
+import sd_daemon
+import logging
+import threading
+import concurrent.futures
+from datetime import datetime
 
 #-------------------------------------define Variables and GPIO setup-------------------------------------#
 
 #Edit if needed
 
-#HTTP endpoints for receiving alarm settings and stopping the alarm
-settings_post_endpoint = "/send_data"
-stop_alarm_endpoint = "/stop_alarm"
+#HTTP endpoints of the alarm API
+settings_post_endpoint = "/send_data" #POST: set a new alarm (web form)
+stop_alarm_endpoint = "/stop_alarm" #POST: stop the ringing or next alarm
+snooze_alarm_endpoint = "/snooze_alarm" #POST: snooze the ringing alarm
+remove_alarm_endpoint = "/remove_alarm" #POST: remove the alarm with the given id
+list_alarms_endpoint = "/alarms" #GET: all armed alarms as JSON
+upload_ringtone_endpoint = "/upload_ringtone" #POST: upload a WAV file as custom ringtone (raw file as request body)
+upload_status_endpoint = "/upload_status" #GET: state of the last ringtone upload as JSON
+status_endpoint = "/status" #GET: current alarm status as JSON (?version=N waits until the status differs from version N)
+status_stream_endpoint = "/status_stream" #GET: every status change as Server-Sent Events
+metrics_endpoint = "/metrics" #GET: counters and latencies in the Prometheus text format
+config_endpoint = "/config" #GET: ringtones and defaults for the web form as JSON
+history_endpoint = "/history" #GET: past alarm events as JSON, newest first (?since=, ?until=, ?kind=, ?alarm=, ?limit=)
+history_stats_endpoint = "/history/stats" #GET: wake statistics of the last days as JSON (?days=N)
+profile_endpoint = "/profile" #GET: CPU time per thread and the profiler state as JSON (?format=collapsed: stacks for flame graphs), POST: action=start or stop
 stop_alarm_command = "stop_alarm"
 
-default_snooze_duration = 10 #Default snooze duration in seconds
+#Ports, pins, ringtones and defaults are set in alarm_clock.conf (see alarm_config.py), all API endpoints above
+#are served on api_server_port
+#Names of the sockets systemd passes when it starts the program (FileDescriptorName= in systemd/*.socket)
+#The program binds api_server_port and alarm_ipc.ipc_socket_path itself if it was started without them
+api_socket_name = "api"
+ipc_socket_name = "ipc"
 
-#Server ports for handling alarm settings and stop requests
-settings_server_port = 8080
-stop_server_port = 8081
+#Pages of the web interface in config.web_directory (served on / like index.php did, see web_ui.py)
+settings_page = "settings_page.html" #Shown while no alarm is armed
+stop_page = "stop_page.html" #Shown while an alarm is armed or ringing
+stats_page = "stats_page.html" #/?page=stats
 
 #File displayed when the alarm is successfully activated or stopped
 success_set_timer_page = "success_set_timer.html"
 success_stop_timer_page = "success_stop_timer.html"
 
-# Path to audio files and allowed ringtones
-ringtone_directory = "audios/"
-allowed_ringtones = ["main_audio.wav", "audio1.wav", "audio2.wav", "audio3.wav", "audio4.wav", "custom_audio.wav"] #allowed ringtones
-
 webserver_status_file = "status_files/alarm_webserver_status.status" #The file the script writes into if a alarm is set or not (Webserver uses it to display the correct page if the alarm was set)
-to_main_display_status_file = "status_files/status_to_main_display.status" #The file the script writes into if a alarm is set, ringing or change in ring time
-default_main_display_status = "11:11\ninactive\nnot_ringing" #Default content for the status file from the line above (time, status, ringing state)
+alarm_journal_file = "status_files/alarm_journal.log" #The alarms are saved here, so they survive a crash or reboot (see alarm_store.py)
+event_history_file = "status_files/alarm_history.bin" #When alarms rang, were snoozed and stopped (see alarm_history.py), has a fixed size
 from_main_display_status_file = "status_files/status_from_main_display_to_main.status" #Path to the status file where the main_display writes the user set tingtime into
 
-# GPIO pin assignments for the stop and snooze buttons
-stop_button = 8 #GPIO input for Stop-Button
-snooze_button = 10 #GPIO input for Snooze-Button
+#Pre-arm stage before every alarm (config.prearm_seconds in alarm_clock.conf)
+main_display_check_timeout = 3 #Seconds the main display has to answer the hardware check
+prearm_release_delay = 5 #Seconds the audio output is held after the pre-armed alarm was stopped or removed without ringing
+
+#Ringtone uploads are read by their own worker threads, so stalled uploads can't take the threads the alarm loads its
+#ringtone with (a stalled upload fails after async_http.body_read_timeout seconds)
+max_parallel_uploads = 2 #Further uploads wait until one of these is done
+
+
+#Inputs of the alarm (put into alarm_inputs as (kind, source))
+input_stop = "stop" #Stop the ringing alarm or skip the next one, source is "button" or "http"
+input_snooze = "snooze" #Snooze the ringing alarm
+
 
+#Queue the event loop waits on, put() can be called from any thread (GPIO callbacks, IPC reader threads, ...)
+class LoopQueue:
+
+    def __init__(self):
+        self.loop = None
+        self.queue = None
+
+    #Has to be called before the queue is used, items put before are dropped
+    def bind(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, item):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def get_nowait(self):
+        return self.queue.get_nowait()
 
 #Runtime Variables (updated dynamically). Do not edit!
-ring_time = None #Stores the ring time, set by the user
-selected_ringtone = None #Stores the ring tone, set by the user
-snooze_duration = None #Stores the snooze duration, set by the user
-alarm_stop_requested = None
-stop_stop_server_event = threading.Event() #If set, the stop server will shut down
-stop_settings_server_event = threading.Event() #If set, the settings server will shut down
-
-#GPIO setup
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BOARD)
-GPIO.setup(stop_button, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-GPIO.setup(snooze_button, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+config = alarm_config.defaults #Current settings, replaced as a whole when alarm_clock.conf changes (see apply_config())
+config_watcher = None #Loads alarm_clock.conf again when it changes, started by serve()
+ringtone_catalog = alarm_config.RingtoneCatalog() #Ringtones in config.ringtone_directory
+api_server = None #The HTTP API server, started by serve()
+alarm_inputs = LoopQueue() #Stop/snooze requests from the buttons and the API, the alarm tasks wait on it
+button_events = LoopQueue() #Events of the stop/snooze buttons (see button_input.py)
+main_display_status = {"ring_time": "06:00", "active": False, "ringing": False, "prearm": None} #Last status pushed to the main display
+main_display_ring_times = LoopQueue() #Ring times the main display sent over the IPC socket
+main_display_check_answers = LoopQueue() #Answers of the main display to the pre-arm hardware checks
+hardware_check_ids = itertools.count(1) #Every hardware check the main display is asked for has its own id
+prearmed_sound = None #(alarm id, PCMSound) the pre-arm stage prepared for the next alarm
+main_display_brightness = None #Last light sensor reading sent by the main display
+status_publisher = None #Pushes status changes to the main display (see alarm_ipc.py)
+main_display_shared_state = None #Alarm status the main display reads (see shared_state.py), created by start_services()
+status_broadcaster = status_stream.StatusBroadcaster() #Pushes status changes to the web pages (see status_stream.py)
+clock = clock_source.SystemClock() #Every time decision goes through this clock (see clock_source.py)
+alarm_scheduler = alarm_scheduler_module.AlarmScheduler(clock) #Holds all armed alarms ordered by their next ring time
+audio = None #Plays the ringtones (see audio_engine.py), created by get_audio()
+ringtone_cache = ringtone_ingest.RingtoneCache(on_release=audio_engine.evict) #Converted uploads (see ringtone_ingest.py), replaced or removed files are dropped from memory too
+ringtone_ingest_worker = None #Converts uploads in the background
+upload_executor = None #Worker threads that read the uploads, created by serve()
+event_history = None #Past alarm events (see alarm_history.py), opened by open_event_history()
+wake_sessions = {} #alarm id -> [time of the first ring, snoozes] of every alarm that rang and was not stopped yet
+profiler = None #Samples the stacks of all threads on demand (see alarm_profiler.py), created by serve()
+web_ui = web_ui_module.WebUI() #The web pages and their assets, compressed in memory
+
+#Logging (ALARM_CLOCK_LOG_LEVEL=DEBUG shows every request and status change, see alarm_logging.py)
+log = logging.getLogger("main")
+
+#Metrics (see alarm_metrics.py), the main display sends its own metrics over the IPC socket
+ring_drift = alarm_metrics.registry.histogram("alarm_ring_drift_seconds", "How late alarms start ringing after their due time")
+snoozes = alarm_metrics.registry.counter("alarm_snoozes_total", "Snoozed alarms")
+stops = alarm_metrics.registry.counter("alarm_stops_total", "Stopped alarms by source (button, http) and whether it was ringing or skipped before", ["source", "kind"])
+http_requests = alarm_metrics.registry.counter("alarm_http_requests_total", "API requests", ["method", "path", "status"])
+http_latency = alarm_metrics.registry.histogram("alarm_http_request_seconds", "Time spent handling API requests", ["path"])
+loop_iterations = alarm_metrics.registry.counter("alarm_loop_iterations_total", "Iterations of the long running loops", ["loop"])
+brightness = alarm_metrics.registry.gauge("alarm_brightness_charge_milliseconds", "Last smoothed light sensor reading sent by the main display")
+prearm_results = alarm_metrics.registry.counter("alarm_prearm_total", "Pre-arm stages before an alarm by result (ready, problems)", ["result"])
+prearm_problems = alarm_metrics.registry.counter("alarm_prearm_problems_total", "Failed pre-arm checks by part (ringtone, audio, buttons, main_display)", ["check"])
+prearm_time = alarm_metrics.registry.histogram("alarm_prearm_seconds", "Time the pre-arm stage took")
+startup_time = alarm_metrics.registry.gauge("alarm_startup_seconds", "Seconds from the process start until the API answered (ready) and the hardware was set up (hardware)", ["stage"])
+main_display_metrics = {} #Last metrics snapshot sent by the main display
+
+#GPIO and buttons are set up by init_hardware() once the API answers
+GPIO = None
+buttons = None
+
+#-------------------------------------------------Hardware------------------------------------------------#
+
+#GPIO setup (buttons are edge detected, see button_input.py)
+#Loading RPi.GPIO, the audio device and numpy takes seconds on a Pi Zero, so this runs after the program reported
+#that it is ready, button presses queue up in button_events until dispatch_button_events() handles them
+def init_hardware():
+    global GPIO, buttons
+
+    if buttons is None:
+        GPIO = button_input.load_gpio()
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BOARD)
+        button_input_pins = button_input.ButtonInput(GPIO, event_queue=button_events)
+        register_buttons(button_input_pins, config)
+        buttons = button_input_pins
+
+    #Open the audio device and import numpy now, so the first alarm does not wait for them
+    get_audio()
+    audio_dsp.load_numpy()
+
+#Sets up the stop and snooze buttons on the pins of settings, the pins used before are released
+def register_buttons(button_input_pins, settings):
+    button_input_pins.remove_all()
+    button_input_pins.debounce = settings.button_debounce_ms / 1000
+    button_input_pins.add_button("stop", settings.stop_button)
+    button_input_pins.add_button("snooze", settings.snooze_button)
+
+#Returns the audio engine, opens the audio device on first use
+def get_audio():
+    global audio
+    if audio is None:
+        audio = audio_engine.AudioEngine(audio_engine.default_sink())
+    return audio
+
+#Reads every button pin, returns the problems as (check, message)
+def check_buttons():
+    if buttons is None:
+        return [("buttons", "GPIO is not set up yet")]
+
+    problems = []
+    for pin, name in list(buttons.buttons.items()):
+        try:
+            GPIO.input(pin)
+        except (RuntimeError, ValueError, OSError) as error:
+            problems.append(("buttons", f"{name} button on pin {pin}: {error}"))
+    return problems
 
 #------------------------------------------------Webserver------------------------------------------------#
 
-#HTTP handler for processing alarm settings
-class SentSettingsHandler(BaseHTTPRequestHandler):
-
-    def do_POST(self):
-        global ring_time, selected_ringtone, snooze_duration, stop_settings_server_event
-
-        #Check if the correct endpoint was called
-        if self.path == settings_post_endpoint:
-            #Parse POST request to extract alarm settings from the web form
-            content_length = int(self.headers["Content-Length"])
-            post_data = self.rfile.read(content_length)
-
-            #Encode post data to utf-8 and save it in variables
-            ring_time = urllib.parse.parse_qs(post_data.decode("utf-8")).get("ring_time", [""])[0]
-            selected_ringtone = urllib.parse.parse_qs(post_data.decode("utf-8")).get("ring_tone", [""])[0]
-            snooze_duration = urllib.parse.parse_qs(post_data.decode("utf-8")).get("snooze_time", [""])[0]
-
-            #Load the success confirmation page and insert received values
-            with open(success_set_timer_page, "r") as file:
-                success_message = file.read()
-
-            #Replace placeholders with actual data
-            success_message = success_message.replace("{{ ring_time }}", ring_time)
-            success_message = success_message.replace("{{ ring_tone }}", selected_ringtone)
-            success_message = success_message.replace("{{ snooze_time }}", snooze_duration)
-
-            #Send HTTP response with confirmation page
-            self.send_response(200)
-            self.send_header("Content-type", "text/html")
-            self.end_headers()
-            self.wfile.write(success_message.encode("utf-8"))
-
-            #Signal that the server can shut down after processing
-            stop_settings_server_event.set()
-
-#Stop command receiver webserver
-class StopAlarmHandler(BaseHTTPRequestHandler):
-
-    def do_POST(self):
-        global alarm_stop_requested
-
-        #Check if the correct endpoint was called
-        if (self.path == stop_alarm_endpoint):
-            #Read and decode POST data
-            content_length = int(self.headers["Content-Length"])
-            post_data = self.rfile.read(content_length)
-            usable_data = urllib.parse.parse_qs(post_data.decode("utf-8"))
-
-            #Check if value sent to server matches
-            if ('action' in usable_data and usable_data['action'][0] == stop_alarm_command):
-                alarm_stop_requested = True
-                
-            else: 
-                print(f"\033[91m Wrong paramenter was sent by the HTTP server\033[0m")
-        
-        #Load the success confirmation page and sent response
-        with open(success_stop_timer_page, "r") as file:
-            success_message = file.read()
+#Reads a form encoded POST body
+def read_form_data(handler):
+    content_length = int(handler.headers.get("Content-Length", 0))
+    post_data = handler.rfile.read(content_length)
+    return urllib.parse.parse_qs(post_data.decode("utf-8"))
+
+#Loads a confirmation page and replaces its placeholders
+def load_page(page, replacements={}):
+    with open(page, "r") as file:
+        content = file.read()
+    for placeholder, value in replacements.items():
+        content = content.replace("{{ " + placeholder + " }}", str(value))
+    return content.encode("utf-8")
+
+def json_response(data, status=200):
+    return status, "application/json", json.dumps(data).encode("utf-8")
+
+#POST /send_data: adds an alarm with the settings from the web form
+def handle_set_alarm(handler):
+    form = read_form_data(handler)
+
+    ring_time = form.get("ring_time", [""])[0]
+    selected_ringtone = form.get("ring_tone", [""])[0]
+    snooze_duration = form.get("snooze_time", [str(config.default_snooze_duration)])[0]
+    recurrence = form.get("recurrence", [alarm_scheduler_module.recurrence_once])[0]
+    interval_days = form.get("interval_days", ["1"])[0]
+    fade_in_seconds = form.get("fade_in", ["0"])[0] or "0"
+
+    if (selected_ringtone not in allowed_ringtones()):
+        return 400, "text/plain", b"ERROR: specified ringtone is not in allowed_ringtones!"
 
-        self.send_response(200)
-        self.send_header("Content-type", "text/html")
-        self.end_headers()
-        self.wfile.write(success_message.encode("utf-8"))
+    try:
+        alarm = alarm_scheduler_module.Alarm(ring_time, selected_ringtone, snooze_duration, recurrence, interval_days, fade_in_seconds=fade_in_seconds)
+        alarm_id = alarm_scheduler.add(alarm)
+    except ValueError as error:
+        log.error("Invalid alarm settings: %s", error)
+        return 400, "text/plain", f"Invalid alarm settings: {error}".encode("utf-8")
+
+    #Print received alarm settings for debugging
+    log.info("Alarm %s set by user: %s %s %s %s", alarm_id, ring_time, selected_ringtone, snooze_duration, recurrence)
+    record_event(alarm_history.event_set, alarm, "http")
+    publish_next_alarm()
+
+    return 200, "text/html", load_page(success_set_timer_page, {"ring_time": ring_time, "ring_tone": selected_ringtone, "snooze_time": snooze_duration})
+
+#POST /stop_alarm: stops the ringing alarm or skips the next one
+def handle_stop_alarm(handler):
+    form = read_form_data(handler)
+
+    #Check if value sent to server matches
+    if ("action" in form and form["action"][0] == stop_alarm_command):
+        request_alarm_stop("http")
+    else:
+        log.error("Wrong paramenter was sent by the HTTP server")
 
+    return 200, "text/html", load_page(success_stop_timer_page)
 
-#Start settings webserver
-def run_settings_server():
-    global ring_time, selected_ringtone, snooze_duration
+#POST /snooze_alarm: snoozes the ringing alarm
+def handle_snooze_alarm(handler):
+    read_form_data(handler)
+    request_alarm_snooze("http")
+    return json_response({"snoozed": main_display_status["ringing"]})
 
-    server_address = ('', settings_server_port)
-    server = HTTPServer(server_address, SentSettingsHandler)
-    server.timeout = 0.5
+#POST /remove_alarm: removes the alarm with the id given in the form
+def handle_remove_alarm(handler):
+    form = read_form_data(handler)
+    try:
+        alarm_id = int(form.get("id", [""])[0])
+    except ValueError:
+        return json_response({"error": "id has to be a number"}, 400)
+
+    alarm = alarm_scheduler.get(alarm_id)
+    if not alarm_scheduler.remove(alarm_id):
+        return json_response({"error": f"Unknown alarm {alarm_id}"}, 404)
+    record_event(alarm_history.event_removed, alarm, "http")
+    publish_next_alarm()
+    return json_response({"removed": alarm_id})
+
+#POST /upload_ringtone: streams the uploaded WAV to disk, validates it and converts it in the background
+#The body is read by an upload worker thread, the event loop keeps serving requests and ringing alarms meanwhile
+async def handle_upload_ringtone(handler):
+    try:
+        content_length = int(handler.headers.get("Content-Length", 0))
+        digest = await asyncio.get_running_loop().run_in_executor(upload_executor, ringtone_ingest_worker.submit, handler.rfile, content_length, config.uploaded_ringtone)
+    except (ValueError, ringtone_ingest.IngestError) as error:
+        #The body may not have been read completely, so the connection can't be reused
+        handler.close_connection = True
+        log.error("Rejected ringtone upload: %s", error)
+        return json_response({"error": str(error)}, 400)
+
+    return json_response({"ringtone": config.uploaded_ringtone, "digest": digest, "state": "processing"}, 202)
+
+#GET /upload_status: state of the last upload (processing, ready or failed)
+def handle_upload_status(handler):
+    return json_response(ringtone_ingest_worker.status)
+
+#GET /alarms: lists all armed alarms with their next ring time
+def handle_list_alarms(handler):
+    alarms = []
+    for due, alarm in alarm_scheduler.list_alarms():
+        alarm_data = alarm.to_dict()
+        alarm_data["next_ring"] = due.isoformat(timespec="seconds")
+        alarms.append(alarm_data)
+    return json_response(alarms)
+
+#GET /config: the ringtones with their labels and the defaults of the web form, the web page builds its form from it
+def handle_config(handler):
+    ringtones = [{"name": ringtone, "label": config.ringtone_names.get(ringtone, ringtone)} for ringtone in allowed_ringtones()]
+    return json_response({"ringtones": ringtones, "default_ringtone": config.default_ringtone, "default_snooze_duration": config.default_snooze_duration})
+
+#GET /status: current alarm status, the ETag is the status version
+#With ?version=N the request is held until the status differs from version N (long polling),
+#a request that times out without a change is answered with 304
+async def handle_status(handler):
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(handler.path).query)
+    known_version = query.get("version", [""])[0] or handler.headers.get("If-None-Match", "").strip('"')
+
+    if ("version" in query and known_version):
+        await status_broadcaster.wait_for_change(known_version, config.long_poll_timeout)
+
+    status = status_broadcaster.snapshot()
+    etag = f'"{status["version"]}"'
+    if (str(status["version"]) == known_version):
+        return 304, "application/json", b"", {"ETag": etag}
+
+    status["brightness"] = main_display_brightness
+    status_code, content_type, body = json_response(status)
+    return status_code, content_type, body, {"ETag": etag, "Cache-Control": "no-cache"}
+
+#GET /status_stream: sends the headers and hands the connection to the status broadcaster
+#The handler returns right away, an open stream only costs its socket
+async def handle_status_stream(handler):
+    connection = await handler.detach(200, [("Content-type", "text/event-stream"), ("Cache-Control", "no-cache"), ("Access-Control-Allow-Origin", "*")])
+    status_broadcaster.attach(connection, handler.headers.get("Last-Event-ID"))
+    return None
+
+#Returns the unix time of a query value: seconds since 1970 or a local date and time like 2026-03-01T06:00
+def parse_query_time(text):
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
 
-    print(f"\033[92mStarting settings post server on port:'{settings_server_port}'\033[0m")
+#GET /history: past alarm events, newest first, filtered by time range (since <= time < until), kind and alarm id
+def handle_history(handler):
+    if event_history is None:
+        return json_response({"error": "The event history is not available"}, 503)
 
-    #Run the server until the stop_settings_server_event is set
-    while not stop_settings_server_event.is_set():
-        server.handle_request()
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(handler.path).query)
+    try:
+        since = parse_query_time(query["since"][0]) if "since" in query else None
+        until = parse_query_time(query["until"][0]) if "until" in query else None
+        alarm_id = int(query["alarm"][0]) if "alarm" in query else None
+        limit = min(int(query.get("limit", [alarm_history.default_query_limit])[0]), event_history.capacity)
+        kind = query.get("kind", [None])[0]
+        if (kind is not None and kind not in alarm_history.event_kinds):
+            raise ValueError(f"kind has to be one of {', '.join(alarm_history.event_kinds)}")
+    except ValueError as error:
+        return json_response({"error": str(error)}, 400)
+
+    return json_response(event_history.query(since, until, kind, alarm_id, limit))
+
+#GET /history/stats: wakes, snoozes per day, time to stop distribution and stops by source of the last ?days=N days
+def handle_history_stats(handler):
+    if event_history is None:
+        return json_response({"error": "The event history is not available"}, 503)
+
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(handler.path).query)
+    try:
+        days = int(query.get("days", [alarm_history.default_stats_days])[0])
+        if not 1 <= days <= alarm_history.max_stats_days:
+            raise ValueError(f"days has to be between 1 and {alarm_history.max_stats_days}")
+    except ValueError as error:
+        return json_response({"error": str(error)}, 400)
+
+    return json_response(event_history.stats(days, clock.time()))
+
+#GET /profile: CPU time of every thread and the state of the profiler, the CPU times of the running or last profile
+#are listed per thread. ?format=collapsed returns its stacks for flame graph tools (flamegraph.pl, speedscope)
+def handle_profile(handler):
+    if profiler is None:
+        return json_response({"error": "The profiler is not available"}, 503)
+
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(handler.path).query)
+    if (query.get("format", [""])[0] == "collapsed"):
+        return 200, "text/plain", profiler.collapsed().encode("utf-8")
+    return json_response(profiler.report())
+
+#POST /profile: action=start (optional interval and seconds, mode=cpu or wall) starts a profile, action=stop stops it
+#and writes it into status_files/, the alarms keep running meanwhile
+async def handle_profile_control(handler):
+    if profiler is None:
+        return json_response({"error": "The profiler is not available"}, 503)
+
+    form = read_form_data(handler)
+    action = form.get("action", [""])[0]
+    if (action == "start"):
+        try:
+            interval = float(form.get("interval", [alarm_profiler.sample_interval])[0])
+            seconds = float(form.get("seconds", [alarm_profiler.max_profile_seconds])[0])
+            started = profiler.start(interval, seconds, form.get("mode", [alarm_profiler.mode_cpu])[0])
+        except ValueError as error:
+            return json_response({"error": str(error)}, 400)
+        if not started:
+            return json_response({"error": "A profile is already running"}, 409)
+    elif (action == "stop"):
+        if not profiler.running:
+            return json_response({"error": "No profile is running"}, 409)
+        #Waits for the last sample and the file in a worker thread
+        await asyncio.get_running_loop().run_in_executor(None, profiler.stop)
+    else:
+        return json_response({"error": "action has to be start or stop"}, 400)
+
+    return json_response(profiler.report())
+
+#GET /metrics: metrics of the main program and the main display
+def handle_metrics(handler):
+    alarm_profiler.update_thread_cpu_metrics()
+    remote = {"main_display": main_display_metrics["metrics"]} if main_display_metrics else {}
+    return 200, alarm_metrics.metrics_content_type, alarm_metrics.registry.render("main", remote).encode("utf-8")
+
+#Returns the port the API server listens on: the socket from systemd or config.api_server_port
+def listening_port():
+    if (api_server is not None and api_server.sock is not None):
+        return api_server.sock.getsockname()[1]
+    return config.api_server_port
+
+#GET / and /index.php: the settings page while no alarm is armed, the stop page while one is, ?page=stats the statistics
+#The page is chosen from the alarm state in memory (index.php read the status file) and rendered once per change of its file
+async def handle_web_page(handler):
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(handler.path).query)
+    if (query.get("page", [""])[0] == "stats"):
+        page = stats_page
+    elif main_display_status["active"]:
+        page = stop_page
+    else:
+        page = settings_page
+
+    replacements = {web_ui_module.api_port_placeholder: listening_port()}
+    asset = web_ui.page_cached(config.web_directory, page, replacements)
+    if asset is None:
+        try:
+            asset = await asyncio.get_running_loop().run_in_executor(None, web_ui.page, config.web_directory, page, replacements)
+        except OSError as error:
+            log.error("Could not load the web page '%s': %s", page, error)
+            return 500, "text/plain", b"The web page could not be loaded"
+    return web_ui_module.respond(asset, handler.headers, web_ui_module.page_cache_control, "page")
+
+#GET of a file the web pages load (CSS, images): compressed, with ETag, URLs with the fingerprint of the file (?v=) are
+#cached by the browser for good
+async def handle_web_asset(handler):
+    url = urllib.parse.urlsplit(handler.path)
+    asset = web_ui.get_cached(config.web_directory, url.path)
+    if asset is None:
+        asset = await asyncio.get_running_loop().run_in_executor(None, web_ui.get, config.web_directory, url.path)
+    if asset is None:
+        return 404, "text/plain", b"Not found"
+
+    fingerprinted = urllib.parse.parse_qs(url.query).get("v", [""])[0] == asset.etag
+    return web_ui_module.respond(asset, handler.headers, web_ui_module.fingerprinted_cache_control if fingerprinted else web_ui_module.page_cache_control)
+
+#Maps (method, path) to the function handling it, the assets of the web pages are served by handle_web_asset()
+api_routes = {
+    ("POST", settings_post_endpoint): handle_set_alarm,
+    ("POST", stop_alarm_endpoint): handle_stop_alarm,
+    ("POST", snooze_alarm_endpoint): handle_snooze_alarm,
+    ("POST", remove_alarm_endpoint): handle_remove_alarm,
+    ("POST", upload_ringtone_endpoint): handle_upload_ringtone,
+    ("GET", list_alarms_endpoint): handle_list_alarms,
+    ("GET", upload_status_endpoint): handle_upload_status,
+    ("GET", status_endpoint): handle_status,
+    ("GET", status_stream_endpoint): handle_status_stream,
+    ("GET", metrics_endpoint): handle_metrics,
+    ("GET", config_endpoint): handle_config,
+    ("GET", history_endpoint): handle_history,
+    ("GET", history_stats_endpoint): handle_history_stats,
+    ("GET", profile_endpoint): handle_profile,
+    ("POST", profile_endpoint): handle_profile_control,
+    ("GET", "/"): handle_web_page,
+    ("GET", "/index.php"): handle_web_page,
+}
+
+#Handles every API request on the event loop (see async_http.py), routes are plain functions or coroutines
+#HTTP/1.1 keeps connections alive, the server adds the Content-Length
+async def handle_api_request(handler):
+    start_time = time.perf_counter()
+
+    #CORS preflight, the CORS headers are only needed for the optional nginx/PHP setup (pages on port 80, API on this port)
+    if (handler.command == "OPTIONS"):
+        return 204, [("Access-Control-Allow-Origin", "*"), ("Access-Control-Allow-Methods", "GET, POST, OPTIONS"), ("Access-Control-Allow-Headers", "Content-Type")], b""
+
+    path = urllib.parse.urlsplit(handler.path).path
+    route = api_routes.get((handler.command, path))
+    if (route is None and handler.command == "GET" and web_ui.asset_path(config.web_directory, path)):
+        route = handle_web_asset
+    if route is None:
+        result = 404, "text/plain", b"Not found"
+    else:
+        result = route(handler)
+        if asyncio.iscoroutine(result):
+            result = await result
+
+    #Streams send their own headers and keep the connection
+    if result is None:
+        http_requests.inc(method=handler.command, path=path, status=200)
+        log.debug("%s %s -> stream opened", handler.command, handler.path)
+        return None
+
+    #Routes may return extra headers as fourth value
+    status, content_type, body = result[:3]
+    extra_headers = result[3] if len(result) > 3 else {}
+
+    #Report how long the request took (also sent to the client as Server-Timing header)
+    latency_ms = (time.perf_counter() - start_time) * 1000
+
+    headers = [("Content-type", content_type), ("Server-Timing", f"app;dur={latency_ms:.2f}"), ("Access-Control-Allow-Origin", "*")]
+    headers.extend(extra_headers.items())
+
+    #Unknown paths and the assets of the web pages are counted together, so scanners can't create endless label values
+    metric_path = "web_asset" if route is handle_web_asset else path if route else "other"
+    http_requests.inc(method=handler.command, path=metric_path, status=status)
+    http_latency.observe(latency_ms / 1000, path=metric_path)
+    log.debug("%s %s -> %s in %.2f ms", handler.command, handler.path, status, latency_ms)
+    return status, headers, body
+
+#Start the API webserver, runs for the whole lifetime of the program as part of the event loop
+#listen_socket is the socket systemd opened (socket activation), otherwise the server binds config.api_server_port
+async def start_api_server(listen_socket=None):
+    server = async_http.AsyncHTTPServer(handle_api_request, config.api_server_port, sock=listen_socket)
+    await server.start()
+    if listen_socket is not None:
+        log.info("Starting alarm API server on the socket from systemd (%s)", listen_socket.getsockname())
+    else:
+        log.info("Starting alarm API server on port:'%s'", config.api_server_port)
+    return server
+
+#Moves the API server to the new config.api_server_port, the old port is closed once the new one is open
+#Open connections (status streams, ...) stay on the old port until they end
+async def restart_api_server():
+    global api_server
+
+    if api_server.sock is not None:
+        log.warning("The API socket was opened by systemd, change ListenStream= in systemd/alarm-clock-api.socket to move it to port %s", config.api_server_port)
+        return
+    try:
+        new_server = await start_api_server()
+    except OSError as error:
+        log.error("Could not open port %s, the API stays on port %s: %s", config.api_server_port, api_server.port, error)
+        return
+    old_server, api_server = api_server, new_server
+    old_server.close()
 
-    #Stop server
-    server.server_close()
-    print("Stopping HTTP settings server")
+#------------------------------------------------Set timer------------------------------------------------#
 
-#Start stop webserver
-def run_stop_server():
+#Asks a waiting, snoozed or ringing alarm to stop, source is "button" or "http"
+#Requests while no alarm is armed are dropped, otherwise they would stay queued and skip the next alarm that is set
+def request_alarm_stop(source):
+    if main_display_status["active"]:
+        alarm_inputs.put((input_stop, source))
+
+#Asks a ringing alarm to snooze, source is "button" or "http"
+def request_alarm_snooze(source):
+    if main_display_status["active"]:
+        alarm_inputs.put((input_snooze, source))
+
+#Delivers button events to the alarm, runs as task for the whole lifetime of the program
+async def dispatch_button_events():
+    while True:
+        event = await button_events.get()
+        loop_iterations.inc(loop="dispatch_button_events")
+        #Buttons only do something while an alarm is armed
+        if (event.kind != button_input.press or not main_display_status["active"]):
+            continue
+
+        if (event.button == "stop"):
+            request_alarm_stop("button")
+        elif (event.button == "snooze"):
+            request_alarm_snooze("button")
+
+#Waits for the next stop request and returns its source, snooze requests are dropped while nothing rings
+async def next_stop_request():
+    while True:
+        kind, source = await alarm_inputs.get()
+        if (kind == input_stop):
+            return source
+
+
+#Waits until the next alarm of the scheduler is due and rings it
+#Waiting (also while snoozed) and ringing are tasks, a stop request cancels them right away
+async def set_alarm():
+    while True:
+        #Wait until the next alarm (or a snoozed alarm) is due or a stop request arrives, new alarms wake the scheduler up
+        publish_next_alarm()
+        waiting = asyncio.ensure_future(alarm_scheduler.next_alarm())
+        stop_request = asyncio.ensure_future(next_stop_request())
+        try:
+            await asyncio.wait([waiting, stop_request], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiting.cancel()
+            stop_request.cancel()
+        loop_iterations.inc(loop="set_alarm")
+
+        alarm = waiting.result() if waiting.done() else None
+        stop_source = stop_request.result() if stop_request.done() else None
+
+        if stop_source:
+            #Stopped before ringing: cancel the snooze or skip the pending ring (one-time alarms are removed)
+            if alarm is not None:
+                alarm_scheduler.finish(alarm)
+                skipped_alarms = [alarm]
+            else:
+                skipped_alarms = alarm_scheduler.stop_snoozed() or [alarm_scheduler.skip_next()]
+            if (stop_source == "http"):
+                log.info("Stopping alarm from HTTP request")
+            else:
+                log.info("Stopping alarm from stop button request")
+            stops.inc(source=stop_source, kind="skipped")
+            for skipped_alarm in skipped_alarms:
+                if skipped_alarm:
+                    log.info("Skipped alarm at %s", skipped_alarm.ring_time)
+                    #A snoozed alarm already rang, stopping it ends its wake
+                    record_event(alarm_history.event_stopped if skipped_alarm.alarm_id in wake_sessions else alarm_history.event_skipped, skipped_alarm, stop_source)
+            return
+
+        #All alarms were removed over the API
+        if alarm is None:
+            return
+
+        #Playing rintone
+        ring_drift.observe(max((clock.now() - alarm_scheduler.last_due).total_seconds(), 0))
+        log.info("Playing: %s", alarm.ringtone)
+        #Update alarm status to ringing so the main display reflect the correct state
+        update_main_display_status(status_stream.event_ringing, ringing=True)
+        record_event(alarm_history.event_rang, alarm)
+
+        if await ring_alarm(alarm):
+            return
+
+        #Snoozed: the scheduler rings the alarm again after its snooze duration, stop still works while snoozing
+        log.info("Snoozing for %s seconds", alarm.snooze_duration)
+        snoozes.inc()
+        alarm_scheduler.snooze(alarm)
+
+#Returns the ringtones that can be picked: the files in the ringtone directory (see alarm_config.RingtoneCatalog)
+#and the uploaded ringtone once there is one
+def allowed_ringtones():
+    ringtones = ringtone_catalog.ringtones(config.ringtone_directory)
+    if (config.uploaded_ringtone not in ringtones and ringtone_cache.lookup(config.uploaded_ringtone)):
+        ringtones.append(config.uploaded_ringtone)
+    return ringtones
+
+#Returns the file of a ringtone to play, uploaded ringtones are played from the converted copy in the cache
+def ringtone_path(ringtone):
+    return ringtone_cache.lookup(ringtone, mark_used=True) or os.path.join(config.ringtone_directory, ringtone)
+
+#Decodes the ringtone of the alarm, raises FileNotFoundError if it is not in the ringtone directory anymore
+def load_ringtone_sound(alarm):
+    if (alarm.ringtone not in allowed_ringtones()):
+        raise FileNotFoundError(f"not in '{config.ringtone_directory}'")
+    return audio_engine.load_ringtone(ringtone_path(alarm.ringtone))
+
+#Returns the sound of the alarm: the one the pre-arm stage prepared, otherwise the ringtone is decoded now
+#The built-in ringtone is played if the ringtone is missing or can't be decoded, so an alarm always rings
+def alarm_sound(alarm):
+    if (prearmed_sound is not None and prearmed_sound[0] == alarm.alarm_id):
+        return prearmed_sound[1]
+    try:
+        return load_ringtone_sound(alarm)
+    except (OSError, EOFError, wave.Error) as error:
+        log.error("Could not load ringtone '%s', playing the built-in ringtone: %s", alarm.ringtone, error)
+        return audio_engine.builtin_ringtone()
+
+#Decodes a freshly converted upload right away, so ringing it later only reads memory
+#Only the file the uploaded ringtone points to now is decoded, the one it replaced was dropped by the ringtone cache
+def preload_ringtone(ringtone, path):
+    if (ringtone != config.uploaded_ringtone or ringtone_cache.lookup(ringtone) != path):
+        return
+    try:
+        audio_engine.load_ringtone(path)
+    except (OSError, EOFError, wave.Error) as error:
+        log.error("Could not preload ringtone '%s': %s", ringtone, error)
+
+#Returns the DSP stage (fade in, loudness normalization) for the alarm or None if nothing has to be done
+def create_ringtone_processor(alarm, sound):
+    if (alarm.fade_in_seconds == 0 and not config.normalize_ringtones):
+        return None
+
+    if not audio_dsp.can_process(sound):
+        log.warning("numpy is missing or the ringtone format is not supported, playing without fade in/normalization")
+        return None
+
+    return audio_dsp.RingtoneProcessor(sound, alarm.fade_in_seconds, config.normalize_ringtones)
+
+#Returns (sound, DSP stage) of the alarm, runs in a worker thread
+#Without pre-arm the normalization measures the loudness of the whole ringtone here, not on the event loop
+def load_alarm_playback(alarm):
+    sound = alarm_sound(alarm)
+    return sound, create_ringtone_processor(alarm, sound)
+
+#Shows the ring time of the next alarm on the main display
+def publish_next_alarm():
+    next_alarm = alarm_scheduler.peek()
+    if next_alarm is None:
+        return
+
+    next_ring, alarm = next_alarm
+    if (main_display_status["ring_time"] != alarm.ring_time):
+        update_main_display_status(status_stream.event_alarm_set, ring_time=alarm.ring_time)
+    log.debug("%s until alarm sounds...", (next_ring - clock.now()).total_seconds())
+
+
+#Plays the ringtone of the alarm until the task is cancelled
+#The ringtone is decoded once and then looped from memory without gaps by the audio engine
+#If it was not pre-armed it is decoded and measured in a worker thread (an upload can be about 100 MB), so stop,
+#snooze and the API keep working meanwhile
+async def play_ringtone(alarm):
+    sound, processor = await asyncio.get_running_loop().run_in_executor(None, load_alarm_playback, alarm)
+    get_audio().play(sound, processor=processor)
 
-    server_address = ('', stop_server_port)
-    server = HTTPServer(server_address, StopAlarmHandler)
-    server.timeout = 0.5
+    try:
+        await asyncio.get_running_loop().create_future()
+    finally:
+        #The engine stops within one audio period, the event loop does not wait for it
+        get_audio().stop(wait=False)
 
-    print(f"\033[92mStarting stop post server on port:'{stop_server_port}'\033[0m")
+#Plays the ringtone of the alarm until it is stopped (returns True) or snoozed (returns False)
+async def ring_alarm(alarm):
+    #Ignore presses from before the alarm started ringing
+    while True:
+        try:
+            alarm_inputs.get_nowait()
+        except asyncio.QueueEmpty:
+            break
 
-    #Run the server until the stop_stop_server_event is set
-    while not stop_stop_server_event.is_set():
-            server.handle_request()
+    playback = asyncio.ensure_future(play_ringtone(alarm))
+    try:
+        #Alarm keeps playing until it is stopped or snoozed, the task sleeps until a button or HTTP request arrives
+        kind, source = await alarm_inputs.get()
+        loop_iterations.inc(loop="ring_alarm")
+
+        if (kind == input_stop):
+            log.info("Stop button pressed or stopped by HTTP sever")
+            stops.inc(source=source, kind="ringing")
+            log.info("Stopping alarm")
+            alarm_scheduler.finish(alarm)
+            record_event(alarm_history.event_stopped, alarm, source)
+            return True
+
+        log.info("Snooze button pressed")
+        record_event(alarm_history.event_snoozed, alarm, source)
+        #Update alarm status to not_ringing so the main display reflect the correct state
+        update_main_display_status(status_stream.event_snoozed, ringing=False)
+        return False
 
-    #Stop server
-    server.server_close()
-    print("Stopping HTTP stop server")
+    finally:
+        #Also stops the ringtone when this task is cancelled
+        playback.cancel()
+
+#Adds an event to the history, the events of an alarm that rang carry its snoozes and the seconds since its first
+#ring (the time to stop once it is stopped)
+def record_event(kind, alarm=None, source=None):
+    now = clock.time()
+    if (alarm is not None and kind in (alarm_history.event_rang, alarm_history.event_snoozed)):
+        wake = wake_sessions.setdefault(alarm.alarm_id, [now, 0])
+        if (kind == alarm_history.event_snoozed):
+            wake[1] += 1
+    first_ring, snoozes = wake_sessions.get(alarm.alarm_id, (now, 0)) if alarm is not None else (now, 0)
+    if (alarm is not None and kind in (alarm_history.event_stopped, alarm_history.event_skipped, alarm_history.event_removed)):
+        wake_sessions.pop(alarm.alarm_id, None)
+
+    if event_history is not None:
+        event_history.record(kind, alarm, source, snoozes, now - first_ring, now)
+
+#-------------------------------------------------Pre-arm-------------------------------------------------#
+
+#Loads the ringtone of the alarm into memory, opens the audio output and reads the button pins, runs in a worker thread
+#Returns (sound, problems), sound is the built-in ringtone if the ringtone is missing or broken
+def prepare_alarm(alarm):
+    problems = []
+    try:
+        sound = load_ringtone_sound(alarm)
+    except (OSError, EOFError, wave.Error) as error:
+        problems.append(("ringtone", f"'{alarm.ringtone}' could not be loaded ({error or type(error).__name__}), the built-in ringtone will be played"))
+        sound = audio_engine.builtin_ringtone()
 
-#------------------------------------------------Set timer------------------------------------------------#
+    #Normalizing measures the loudness of the whole ringtone once, better now than when it rings
+    if (config.normalize_ringtones and audio_dsp.can_process(sound)):
+        audio_dsp.loudness_gain(sound)
 
-#Calculate the number of seconds until the alarm time
-def calculate_wait_seconds(target_time):
     try:
-        #Convert input string to a datetime object with today's date
-        target_time = datetime.strptime(target_time, "%H:%M").replace(year=datetime.now().year, month=datetime.now().month, day=datetime.now().day)
-        time_now = datetime.now()
-        difference_time = (target_time - time_now).total_seconds()
-    except:
-        print(f"\033[91m Time has to be HH:MM\033[0m")
-
-    #If the specified time is earlier than the current time, schedule the alarm for the next day
-    if (difference_time < 0):
-        difference_time += 86400
-
-    return difference_time
-
-
-#Start the alarm at the scheduled time
-def set_alarm():
-    global alarm_stop_requested
-
-    #Check if ringtone is in allowed_rintones
-    if (selected_ringtone in allowed_ringtones):
-        time_now = time.time()
-        check_time = 0.1
-
-        #Check every 0.1 seconds if alarm_stop_requested == True or stop_button == HIGH and stop alarm if it's the case
-        while time.time() - time_now < seconds:
-            if alarm_stop_requested:
-                print("Stopping alarm from HTTP request")
-                return
-            elif (GPIO.input(stop_button) == GPIO.HIGH):
-                 print("Stopping alarm from stop button request")
-                 return
-            sleep(check_time)
-
-        while not alarm_stop_requested:
-
-            #Playing rintone
-            print("Playing:", selected_ringtone)
-            #Update alarm status to ringing so the main display reflect the correct state
-            update_main_display_status_file(2, "ringing")
-            ring_tone_playing_process = subprocess.Popen(["aplay", f"{ringtone_directory}{selected_ringtone}"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-            #Alarm keeps playing until it is stopped or snoozed
-            print("GPIO Mode: ", GPIO.getmode()) #Not sure why this GPIO setup is needed again, but it works =)
-            while ring_tone_playing_process.poll() is None:
-                if (GPIO.input(stop_button) == GPIO.HIGH or alarm_stop_requested):
-                    print("Stop button pressed or stopped by HTTP sever")
-                    ring_tone_playing_process.terminate()
-                    print("Stopping alarm")
-                    stop_stop_server_event.set()
-                    alarm_stop_requested = None
-                    sleep(0.1)
-                    return
-                
-                elif (GPIO.input(snooze_button) == GPIO.HIGH):
-                    print("Snooze button pressed")
-                    #Update alarm status to not_ringing so the main display reflect the correct state
-                    update_main_display_status_file(2, "not_ringing")
-                    ring_tone_playing_process.terminate()
-                    print("Snoozing for", snooze_duration, "seconds")
-                    snooze_time_int = int(snooze_duration)
-                    sleep(snooze_time_int)
-                    break
-    else:
-        print(f"\032[91m ERROR: specified ringtone is not in allowed_ringtones!\033[0m")
+        get_audio().prepare(sound)
+    except Exception as error:
+        problems.append(("audio", f"could not open the audio output: {error}"))
+
+    problems.extend(check_buttons())
+    return sound, problems
+
+#Waits for the answer of the main display to hardware check check_id (it rewrites the LCD and reads its buttons,
+#see answer_hardware_check() in main_display1.2.py), returns the problems as (check, message)
+async def check_main_display(check_id):
+    if (status_publisher is None or not status_publisher.clients):
+        return [("main_display", "not connected")]
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + main_display_check_timeout
+    while True:
+        try:
+            answer = await asyncio.wait_for(main_display_check_answers.get(), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            return [("main_display", f"no answer within {main_display_check_timeout} s")]
+        #Late answers to earlier checks are dropped
+        if (answer.get("check") == check_id):
+            return [("main_display", problem) for problem in answer.get("problems", [])]
+
+#Gets everything ready for the alarm that is due next and reports the result in the status ("prearm")
+#The checks of this program run in a worker thread while the main display checks its own hardware
+async def prearm_alarm(alarm):
+    global prearmed_sound
+
+    start_time = time.perf_counter()
+    check_id = next(hardware_check_ids)
+    #The main display starts its check when it receives this status
+    update_main_display_status(status_stream.event_prearm, prearm={"ring_time": alarm.ring_time, "state": "checking", "check": check_id, "problems": [], "builtin_ringtone": False})
+
+    main_display_check = asyncio.ensure_future(check_main_display(check_id))
+    try:
+        sound, problems = await asyncio.get_running_loop().run_in_executor(None, prepare_alarm, alarm)
+        problems.extend(await main_display_check)
+    finally:
+        main_display_check.cancel()
+    prearmed_sound = (alarm.alarm_id, sound)
+
+    for check, message in problems:
+        prearm_problems.inc(check=check)
+        log.warning("Pre-arm check of the alarm at %s failed: %s: %s", alarm.ring_time, check, message)
+    state = "problems" if problems else "ready"
+    prearm_results.inc(result=state)
+    prearm_time.observe(time.perf_counter() - start_time)
+    log.info("Alarm at %s pre-armed in %.1f ms: %s", alarm.ring_time, (time.perf_counter() - start_time) * 1000, state)
+
+    update_main_display_status(status_stream.event_prearm, prearm={"ring_time": alarm.ring_time, "state": state, "check": check_id,
+        "problems": [f"{check}: {message}" for check, message in problems], "builtin_ringtone": sound is audio_engine.builtin_ringtone()})
+
+#Closes an audio output the pre-arm stage opened before prepared_before unless it plays by now
+#Closing can wait for the output (e.g. for aplay to exit), so it runs in a worker thread
+def release_audio(prepared_before):
+    if audio is not None:
+        audio.release(prepared_before)
+
+#Runs the pre-arm stage config.prearm_seconds before every alarm rings (also before a snoozed alarm rings again),
+#runs as task for the whole lifetime of the program
+#Once the pre-armed alarm rings or is snoozed, stopped or removed, the audio output is closed after prearm_release_delay
+#seconds unless it plays by then
+async def prearm_alarms():
+    prepared = None
+    while True:
+        upcoming = await alarm_scheduler.upcoming_alarm(config.prearm_seconds, prepared)
+        loop_iterations.inc(loop="prearm_alarms")
+
+        if prepared is not None:
+            loop = asyncio.get_running_loop()
+            loop.call_later(prearm_release_delay, loop.run_in_executor, None, release_audio, time.monotonic())
+        prepared = upcoming
+
+        if (upcoming is not None and config.prearm_seconds > 0):
+            await prearm_alarm(upcoming[1])
 
 #-------------------------------------------Update status files-------------------------------------------#
 
@@ -239,150 +882,218 @@ def write_to_webserver_status(active):
             status_file.write("inactive")
 
 
-def update_main_display_status_file(line, content):
-        
-        #Check if the status file exists, if not, create it with default content
-        if (not os.path.exists(to_main_display_status_file)):
-            print(f"\033[33m'{to_main_display_status_file}' does not exist, creating it...\033[0m")
-            with open(to_main_display_status_file, "w") as status_file:
-                    status_file.write(default_main_display_status)
-        
-        #Read the lines from the status file
-        with open(to_main_display_status_file, "r") as status_file:
-                line_count = status_file.readlines()
-
-        #If the file has more than 3 lines, reset it to the default content
-        if (len(line_count) != 3):
-                print(f"\033[33m'{to_main_display_status_file}' has more than 3 lines. Writing default content with 3 lines...\033[0m")
-                with open(to_main_display_status_file, "w") as status_file:
-                    status_file.write(default_main_display_status)
-                
-                #Re-read the file after resetting it
-                with open(to_main_display_status_file, "r") as status_file:
-                    line_count = status_file.readlines()
-
-        #Check if the specified line index is valid
-        if (line < 0 or line >= len(line_count)):
-                print(f"\033[33m'{to_main_display_status_file}' has fewer lines than expected or the line index is out of range. Writing default content with 3 lines...\033[0m")
-                with open(to_main_display_status_file, "w") as status_file:
-                    status_file.write(default_main_display_status)
-        else:
-            #Update the specified line with the new content
-            line_count[line] = content + "\n"
-
-            #Write the updated content back to the status file
-            with open(to_main_display_status_file, "w") as status_file:
-                status_file.writelines(line_count)
-                print("writing status to: " + to_main_display_status_file)
-
-def check_main_display_input():
-     global ring_time, snooze_duration, selected_ringtone
-
-    #Loop until the settings server is told to stop
-     while not stop_settings_server_event.is_set():
+#Updates the alarm status for the main display and the web pages, only the given values change
+#The whole status is written to the shared memory in one atomic update and then pushed over the IPC socket
+#and to the web pages, event tells the web pages what happened (see status_stream.py)
+def update_main_display_status(event, ring_time=None, active=None, ringing=None, prearm=None):
+    if ring_time is not None:
+        main_display_status["ring_time"] = ring_time
+    if active is not None:
+        main_display_status["active"] = active
+    if ringing is not None:
+        main_display_status["ringing"] = ringing
+    if prearm is not None:
+        main_display_status["prearm"] = prearm
+
+    if main_display_shared_state:
+        main_display_shared_state.write(main_display_status["ring_time"], main_display_status["active"], main_display_status["ringing"])
+
+    if status_publisher:
+        status_publisher.publish(main_display_status)
+    status_broadcaster.publish(event, main_display_status)
+
+#Called by the IPC publisher for every message sent by the main display
+def handle_main_display_message(message):
+    global main_display_brightness
+
+    if (message.get("type") == "set_ring_time"):
+        main_display_ring_times.put(str(message.get("ring_time", "")))
+    elif (message.get("type") == "disconnected"):
+        #Wakes check_main_display_input(), it reads the fallback file again while no main display is connected
+        main_display_ring_times.put("")
+    elif (message.get("type") == "brightness"):
+        main_display_brightness = message
+        brightness.set(message.get("average_ms", 0))
+    elif (message.get("type") == "metrics"):
+        main_display_metrics["metrics"] = message.get("metrics", [])
+    elif (message.get("type") == "hardware_check"):
+        main_display_check_answers.put(message)
+
+#Adds the ring times the main display sends as alarms, runs as task for the whole lifetime of the program
+#While a main display is connected over IPC this only wakes up for its messages. Without one, the status file the
+#main display writes as fallback is read every 0.5 s (and once more after it connected, for a ring time written just before)
+async def check_main_display_input():
+     read_fallback_file = True
+     while True:
+        loop_iterations.inc(loop="check_main_display_input")
+        connected = status_publisher is not None and status_publisher.has_clients()
         try:
-                #Try to open and read the status file where the main display writes user-set alarm time
-                with open(from_main_display_status_file, "r") as status_file:
-                    file_content = status_file.read().strip()
-        except FileNotFoundError:
-               #If the file does not exist, just set file_content to empty string and continue
-               file_content = ""
+            #Wait until the main display pushes a ring time over the IPC socket
+            file_content = await asyncio.wait_for(main_display_ring_times.get(), None if (connected and not read_fallback_file) else 0.5)
+        except asyncio.TimeoutError:
+            read_fallback_file = not connected
+            try:
+                    #Fallback: Try to open and read the status file where the main display writes user-set alarm time
+                    with open(from_main_display_status_file, "r") as status_file:
+                        file_content = status_file.read().strip()
+            except FileNotFoundError:
+                   #If the file does not exist, just set file_content to empty string and continue
+                   file_content = ""
         
         #Use regex to check if the content matches HH:MM
         match = re.match(r"^([01]?\d|2[0-3]):([0-5]?\d)$", file_content)
 
         if match:
-            #If a valid time was found, update global alarm settings accordingly
-            ring_time = file_content
-            snooze_duration = default_snooze_duration
-            selected_ringtone = "main_audio.wav"
-            print("Alarm set due to user imput form the main display")
-
-            #Signal to stop the settings server
-            stop_settings_server_event.set()
-            break
+            #If a valid time was found, add a one-time alarm with the default settings
+            alarm = alarm_scheduler_module.Alarm(f"{int(match.group(1)):02}:{int(match.group(2)):02}", config.default_ringtone, config.default_snooze_duration)
+            alarm_scheduler.add(alarm)
+            log.info("Alarm set due to user imput form the main display")
+            record_event(alarm_history.event_set, alarm, "display")
+            publish_next_alarm()
+
+            #Reset the fallback file so the same ring time is not added twice
+            with open(from_main_display_status_file, "w") as status_file:
+                 status_file.write("None")
 
 #------------------------------------------------Main code------------------------------------------------#
 
-#Main Loop: Runs indefinitely to handle alarm scheduling
-while True:
+#Starts what runs next to the event loop: the shared memory and IPC socket for the main display and the upload worker
+#ipc_socket is the socket systemd opened (socket activation), services that already run are not started again
+def start_services(ipc_socket=None):
+    global main_display_shared_state, status_publisher, ringtone_ingest_worker
+
+    #Start pushing status changes to the main display
+    if main_display_shared_state is None:
+        main_display_shared_state = shared_state.SharedAlarmState(create=True)
+    if status_publisher is None:
+        status_publisher = alarm_ipc.StatusPublisher(on_message=handle_main_display_message, server_socket=ipc_socket)
+        status_publisher.start()
+
+    #Convert uploaded ringtones in the background
+    if ringtone_ingest_worker is None:
+        ringtone_ingest_worker = ringtone_ingest.IngestWorker(ringtone_cache, on_ready=preload_ringtone)
+        ringtone_ingest_worker.start()
+
+#Loads the alarms saved before the last shutdown or crash, every change from now on is saved (see alarm_store.py)
+def restore_alarms():
+    if alarm_scheduler.store is not None:
+        return
+    start_time = time.perf_counter()
+    restored = alarm_scheduler.restore(alarm_store.AlarmStore(alarm_journal_file))
+    log.info("Restored %s alarm(s) in %.1f ms", restored, (time.perf_counter() - start_time) * 1000)
+
+#Opens the history of the alarm events, the alarm clock works without it if the file can't be opened
+def open_event_history():
+    global event_history
+    if event_history is not None:
+        return
     try:
-        #Set alarm status to inactive so the webserver and main display displays the correct page
-        #The ring time can be set to any value in HH:MM format — the specific time doesn't matter, only that a time is provided
-        write_to_webserver_status(False)
-        update_main_display_status_file(0, "6:00")
-        update_main_display_status_file(1, "inactive")
-        update_main_display_status_file(2, "not_ringing")
-
-        #Start the settings server in a separate thread (waits for alarm configuration)
-        settings_server_thread = threading.Thread(target=run_settings_server)
-        settings_server_thread.start()
-
-        #Start the watcher thread server in a separate thread (waits for main display to sent a user set ring time)
-        main_display_thread = threading.Thread(target=check_main_display_input)
-        main_display_thread.start()
-
-        settings_server_thread.join()
-        main_display_thread.join()
-
-        #Print received alarm settings for debugging
-        print("Ringtime set by user:", ring_time)
-        print("Ringtone set by user:", selected_ringtone)
-        print("Snooze time set by user:" ,snooze_duration)
-
-        update_main_display_status_file(0, ring_time)
-
-        #Calculate the number of seconds until the alarm should go off
-        seconds = calculate_wait_seconds(ring_time)
-        print(seconds, "until alarm sounds...")
-
-        #Update alarm status to active so the webserver and main display reflect the correct state
-        write_to_webserver_status(True)
-        update_main_display_status_file(1, "active")
-
-        #Start the stop-server in a separate thread (allows stopping the alarm remotely)
-        stop_server_thread = threading.Thread(target=run_stop_server)
-        stop_server_thread.start()
-        
-        #Activate the alarm (plays sound and checks for stop/snooze) and upades alarm status so the main display reflects the correct state
-        set_alarm()
+        event_history = alarm_history.EventHistory(event_history_file)
+    except (OSError, ValueError) as error:
+        log.error("Could not open the event history '%s', events are not recorded: %s", event_history_file, error)
 
-        #Stop the stop-server thread after the alarm is stoped
-        stop_stop_server_event.set()
-        stop_server_thread.join()
-        
-        #Reset alarm status to inactive and ringtime to none after the alarm is stopped
-        write_to_webserver_status(False)
-        update_main_display_status_file(1, "inactive")
-        update_main_display_status_file(2, "not_ringing")
-        with open(from_main_display_status_file, "w") as status_file:
-             status_file.write("None")
+#Applies new settings (see alarm_config.py), runs on the event loop, so requests and alarms see either the old or
+#the new settings and never a mix. The armed alarms stay, the buttons and the API server move to their new pins and port
+def apply_config(new_config):
+    global config
+    old_config, config = config, new_config
 
-        #Clear HTTP server events so that they can start again
-        stop_settings_server_event.clear()
-        stop_stop_server_event.clear()
+    if (buttons is not None and (old_config.stop_button, old_config.snooze_button, old_config.button_debounce_ms) != (new_config.stop_button, new_config.snooze_button, new_config.button_debounce_ms)):
+        register_buttons(buttons, new_config)
+        log.info("Stop button on pin %s, snooze button on pin %s", new_config.stop_button, new_config.snooze_button)
 
-    finally:
-        
-        #Clean up GPIO pins to prevent conflicts
-        GPIO.cleanup()
+    if (api_server is not None and old_config.api_server_port != new_config.api_server_port):
+        asyncio.ensure_future(restart_api_server())
 
-        #Reset global variables to their initial state
-        ring_time = None
-        selected_ringtone = None
-        snooze_duration = None
-        alarm_stop_requested = None
+#Creates the queues the tasks wait on, has to be called with the event loop that runs them
+def bind_event_loop(loop):
+    for loop_queue in (alarm_inputs, button_events, main_display_ring_times, main_display_check_answers):
+        loop_queue.bind(loop)
 
-        #Reinitialize GPIO settings for the next alarm cycle
-        GPIO.setwarnings(False)
-        GPIO.setmode(GPIO.BOARD)
-        GPIO.setup(stop_button, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(snooze_button, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+#Main Loop: Runs indefinitely to handle alarm scheduling
+async def run_alarm_loop():
+    while True:
+        loop_iterations.inc(loop="run_alarm_loop")
+        try:
+            #Set alarm status to inactive so the webserver and main display displays the correct page
+            #The ring time can be set to any value in HH:MM format — the specific time doesn't matter, only that a time is provided
+            #Alarms restored after a restart are shown as active right away
+            if not alarm_scheduler.has_alarms():
+                write_to_webserver_status(False)
+                update_main_display_status(status_stream.event_inactive, ring_time="06:00", active=False, ringing=False)
+
+            #Wait until an alarm is set over the API or the main display
+            await alarm_scheduler.wait_until_armed()
+
+            #Update alarm status to active so the webserver and main display reflect the correct state
+            write_to_webserver_status(True)
+            update_main_display_status(status_stream.event_alarm_set, active=True)
+
+            #Activate the alarm (plays sound and checks for stop/snooze) and upades alarm status so the main display reflects the correct state
+            #Recurring alarms stay in the scheduler, so keep ringing them until no alarm is left
+            while alarm_scheduler.has_alarms():
+                await set_alarm()
+                update_main_display_status(status_stream.event_stopped, ringing=False)
+
+        finally:
+
+            #Ensure alarm status is inactive for the webserver display
+            write_to_webserver_status(False)
+
+            log.info("End of program cycle. Waiting for the next alarm...")
+
+#Runs the alarm clock on one event loop: the API server, the buttons, the main display input, the keep alive
+#of the status streams and the alarms are tasks, nothing blocks and every input is handled as soon as it arrives
+#listen_sockets are the sockets systemd opened (see sd_daemon.listen_sockets()), requests that arrived while the
+#program was starting wait in their backlog and are answered as soon as the API server runs
+#config_file is loaded first and watched, its changes are applied on the event loop (without it the settings in config are used)
+async def serve(listen_sockets={}, config_file=None):
+    global api_server, config_watcher, profiler, upload_executor
+
+    loop = asyncio.get_running_loop()
+    bind_event_loop(loop)
+
+    #Worker threads get a name, the profiler and alarm_thread_cpu_seconds list them under it
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(thread_name_prefix="worker"))
+    upload_executor = concurrent.futures.ThreadPoolExecutor(max_parallel_uploads, thread_name_prefix="upload")
+
+    #kill -USR1 starts and stops a profile (see alarm_profiler.py), signal handlers only work on the main thread
+    profiler = alarm_profiler.SamplingProfiler("main", loop)
+    if (alarm_profiler.toggle_signal is not None and threading.current_thread() is threading.main_thread()):
+        loop.add_signal_handler(alarm_profiler.toggle_signal, lambda: loop.run_in_executor(None, profiler.toggle))
+
+    if config_file is not None:
+        config_watcher = alarm_config.ConfigWatcher(config_file, lambda new_config: loop.call_soon_threadsafe(apply_config, new_config))
+        apply_config(config_watcher.start())
+
+    #The saved alarms are back before the first request can add one, then the API and the IPC socket come,
+    #everything that is slow to set up follows after READY=1
+    restore_alarms()
+    open_event_history()
+    api_server = await start_api_server(listen_sockets.get(api_socket_name))
+    start_services(listen_sockets.get(ipc_socket_name))
+    tasks = [asyncio.ensure_future(task) for task in (run_alarm_loop(), dispatch_button_events(), check_main_display_input(), prearm_alarms(), status_broadcaster.keepalive())]
+
+    startup_time.set(sd_daemon.seconds_since_start(), stage="ready")
+    sd_daemon.notify("READY=1", "STATUS=Waiting for alarms")
+    log.info("Ready after %.3f s", sd_daemon.seconds_since_start())
 
-        #Ensure alarm status is inactive for the webserver display
-        write_to_webserver_status(False)
+    try:
+        #GPIO and the audio device are set up in a worker thread, the event loop keeps answering requests meanwhile
+        await loop.run_in_executor(None, init_hardware)
+        startup_time.set(sd_daemon.seconds_since_start(), stage="hardware")
+        log.info("Hardware set up after %.3f s", sd_daemon.seconds_since_start())
 
-        print("End of program cycle. Waiting for settings server to start...")
+        #Compress the assets of the web pages before the first visitor asks for them
+        await loop.run_in_executor(None, web_ui.preload, config.web_directory)
 
-#FixMe
-#Alarm can't be stopped while snoozing
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        api_server.close()
+
+#The script can be imported without starting anything (e.g. by tools/replay_alarms.py)
+if __name__ == "__main__":
+    alarm_logging.setup_logging()
+    asyncio.run(serve(sd_daemon.listen_sockets(), alarm_config.config_path()))
@@ -1,220 +1,322 @@
-from RPLCD.i2c import CharLCD
-import RPi.GPIO as GPIO
-from datetime import datetime
-from time import sleep
-import time
 import threading
+import queue
+import alarm_ipc
+import alarm_config
+import button_input
+import lcd_framebuffer
+import light_sensor
+import shared_state
+import clock_source
+import alarm_metrics
+import alarm_profiler
+import alarm_logging
+import sd_daemon
+import logging
 
 #-------------------------------------define Variables and GPIO setup-------------------------------------#
 
 #Edit if needed
-main_display = CharLCD(i2c_expander='PCF8574', address=0x27, port=1, cols=16, rows=2) #Initialize LCD display
-
-status_from_main = "status_files/status_to_main_display.status" #Path to the status file where the main program writes the alarm status
+#Pins, the light sensor and the menu defaults are set in alarm_clock.conf (see alarm_config.py)
 status_to_main = "status_files/status_from_main_display_to_main.status" #The file the script writes into the user set ringtime (e.g. 11:11)
 
-ok_button = 16 #GPIO input for OK-Button
-down_button= 18 #GPIO input for DOWN-BUTTON
-up_button = 22 #GPIO input for UP-BUTTON
-menu_button = 24 #GPIO input for MENU-BUTTON
-daylight_resistor_pin = 11 #GPIO input for DAYLIGHT_RESISTOR
-
-default_alarm_hour = 6 # Default alarm time displayed when opening the menu
-default_alarm_minute = 0 # Default alarm time displayed when opening the menu
-
-menu_time_increment = 1 #Time increment step when adjusting the alarm time (in minutes)
+week_days = ["So", "Mo", "Di", "Mi", "Do", "Fr", "Sa"] #Weekday names shown on the clock screen, starting on sunday
+metrics_report_interval = 10 #Seconds between sending the metrics of the display to the main program (GET /metrics there)
 
 
 #Runtime Variables (updated dynamically). Do not edit!
+config = alarm_config.defaults #Current settings, replaced as a whole when alarm_clock.conf changes (see apply_config())
+config_watcher = None #Loads alarm_clock.conf again when it changes, started by run_display_loop()
+default_alarm_hour, default_alarm_minute = config.default_alarm_time #Time shown in the menu, it keeps the last selected time
 alarm_active = False #Indicates if the alarm is currently set
 ring_time = None #Stores the alarm time
 ringing = False #Indicates if the alarm is currently ringing
-last_display_content = False #Stores the last content displayed on the LCD
 user_set_ringtime = None #Stores the alarm time set by the user
 auto_backlight_control = True #Indicates if the backlight should be automaticly controlled or not
-
-#GPIO setup
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BOARD)
-GPIO.setup(ok_button, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-GPIO.setup(down_button, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-GPIO.setup(up_button, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-GPIO.setup(menu_button, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+display_events = queue.Queue() #Button events and status updates, the main loop sleeps on this queue
+status_update = "status_update" #Put into display_events when the main program pushes a new status
+clock_stepped = "clock_stepped" #Put into display_events when the wall clock was set, the time until the next minute changed
+line_cache = {} #Last formatted string of every screen line (see cached_line())
+answered_hardware_check = None #Id of the last pre-arm hardware check answered (see answer_hardware_check())
+status_subscriber = alarm_ipc.StatusSubscriber(on_update=lambda: display_events.put(status_update)) #Wakes the display up when the main program changes the status
+shared_alarm_state = None #Alarm status written by the main program (see shared_state.py), opened on first use
+lcd = None #LCD display, opened by init_display()
+main_display = None #All screens are drawn into this buffer, flush() sends only the changed characters (see lcd_framebuffer.py)
+GPIO = None #Set up by init_hardware()
+buttons = None
+brightness_sampler = None #Smoothed light sensor readings, brightness_sampler.latest holds the newest one
+clock = clock_source.SystemClock() #Every time decision goes through this clock (see clock_source.py)
+profiler = alarm_profiler.SamplingProfiler("main_display") #kill -USR1 starts and stops a profile (see alarm_profiler.py)
+
+#Logging (ALARM_CLOCK_LOG_LEVEL=DEBUG shows every LCD write and status update, see alarm_logging.py)
+log = logging.getLogger("main_display")
+
+#Metrics (see alarm_metrics.py)
+loop_iterations = alarm_metrics.registry.counter("alarm_display_loop_iterations_total", "Iterations of the long running loops of the main display", ["loop"])
+status_latency = alarm_metrics.registry.histogram("alarm_display_status_latency_seconds", "Time from a status change in the main program until the main display received it")
+
+#------------------------------------------------Hardware------------------------------------------------#
+
+#Opens the LCD display, the first screen is drawn right after it
+def init_display():
+    global lcd, main_display
+
+    if lcd is None:
+        lcd = lcd_framebuffer.load_lcd(cols=16, rows=2)
+        main_display = lcd_framebuffer.LCDFrameBuffer(lcd, cols=16, rows=2)
+
+#GPIO setup (buttons are edge detected, see button_input.py)
+#Runs after the first screen is shown, so the time is visible while RPi.GPIO loads
+def init_hardware():
+    global GPIO, buttons, brightness_sampler
+
+    if buttons is None:
+        GPIO = button_input.load_gpio()
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BOARD)
+        buttons = button_input.ButtonInput(GPIO, event_queue=display_events)
+        register_buttons(buttons, config)
+        brightness_sampler = light_sensor.BrightnessSampler(GPIO, config.daylight_resistor_pin, dark_threshold=config.dark_threshold)
+
+#Sets up the menu buttons on the pins of settings, the pins used before are released
+def register_buttons(button_input_pins, settings):
+    button_input_pins.remove_all()
+    button_input_pins.debounce = settings.button_debounce_ms / 1000
+    button_input_pins.long_press_time = settings.long_press_time
+    button_input_pins.add_button("ok", settings.ok_button)
+    button_input_pins.add_button("down", settings.down_button)
+    button_input_pins.add_button("up", settings.up_button)
+    button_input_pins.add_button("menu", settings.menu_button)
+
+#Applies new settings (see alarm_config.py), runs in the display loop between two screens
+#The config watcher puts every new Config into display_events
+def apply_config(new_config):
+    global config, default_alarm_hour, default_alarm_minute
+    old_config, config = config, new_config
+
+    button_settings = ("ok_button", "down_button", "up_button", "menu_button", "button_debounce_ms", "long_press_time")
+    if (buttons is not None and any(getattr(old_config, name) != getattr(new_config, name) for name in button_settings)):
+        register_buttons(buttons, new_config)
+        log.info("Menu buttons on pins %s/%s/%s/%s", new_config.ok_button, new_config.down_button, new_config.up_button, new_config.menu_button)
+
+    if brightness_sampler is not None:
+        brightness_sampler.dark_threshold = new_config.dark_threshold
+        if (old_config.daylight_resistor_pin != new_config.daylight_resistor_pin):
+            #Readings of the old pin would be averaged with the new ones
+            brightness_sampler.pin = new_config.daylight_resistor_pin
+            brightness_sampler.readings.clear()
+
+    if (old_config.default_alarm_time != new_config.default_alarm_time):
+        default_alarm_hour, default_alarm_minute = new_config.default_alarm_time
 
 #------------------------------------------------Functions------------------------------------------------#
 
-#Opens and reads the alarm status file
-#Only if the status file exists and contains exactly three lines:
-#Writes the content of the status file into global variables
+#Reads the alarm status the main program keeps in shared memory into global variables
+#Reads never see a half written status, so there is nothing to retry or wait for
 def read_alarm_status_from_main():
-    global alarm_active, ring_time, ringing
-
-    attempt = 0
-    max_attempts = 3
+    global alarm_active, ring_time, ringing, shared_alarm_state
 
-    #Try up to max_attempts times to read the file
-    while attempt < max_attempts:
+    #The main program creates the shared state when it starts
+    if shared_alarm_state is None:
         try:
-            with open(status_from_main, "r") as status_file:
-                #Read all lines and strip whitespace
-                lines = [line.strip() for line in status_file.readlines()]
-
-                #Ensure the file contains exactly 3 lines
-                if len(lines) == 3:
-                    ring_time = lines[0]                    #Line 1: Time when alarm is set (e.g. "07:30")
-                    alarm_active = (lines[1] == "active")   #Line 2: Alarm status ("active" or inactive)
-                    ringing = (lines[2] == "ringing")       #Line 3: Ringing status ("ringing" or not_ringing)
-                    return
-                else:
-                    print(f"\033[33m Warning: '{status_from_main}' must contain exactly 3 lines. Retrying...\033[0m")
-
+            shared_alarm_state = shared_state.SharedAlarmState()
         except FileNotFoundError:
-            #File not found, remind the user to run the main script first
-            print(f"\033[91m Error: '{status_from_main}' does not exist. Try starting main script.\033[0m")
-
-        attempt = attempt + 1
-        sleep(1) # Wait 1 second before retrying
-
-    print(f"\033[91m Error: Failed to read '{status_from_main}' after {max_attempts} attempts. Waiting 10 seconds and trying again...\033[0m")
-    sleep(10)
-
-
-#Returns the current date or time depending of the argument given to the function:
-#"date" returns the current date, e.g. "Mo", "Di", ...
-#"time" returnes the current time, e.g. 11:11
-def get_time_date(time_or_date):
-
-    week_days = ["So", "Mo", "Di", "Mi", "Do", "Fr", "Sa"]
-    
-    if (time_or_date == "time"):
-        time = datetime.now()
-        timenow = time.strftime("%H:%M")
-        return timenow
-    elif (time_or_date == "date"):
-        date = datetime.now()
-        datenow = int(date.strftime("%w"))
-        return week_days[datenow]
+            return
+        log.info("Reading alarm status from '%s'", shared_alarm_state.path)
+
+    state = shared_alarm_state.read()
+    if state is None:
+        log.warning("The main program did not finish updating the alarm status, keeping the last one")
+        return
+
+    ring_time = state["ring_time"]      #Time when alarm is set (e.g. "07:30")
+    alarm_active = state["active"]      #Alarm status (active or inactive)
+    ringing = state["ringing"]          #Ringing status (ringing or not ringing)
+
+
+#Checks the LCD and the menu buttons when the main program asks for it before an alarm rings (status "prearm")
+#The whole screen is sent to the LCD again, which fails if the display does not answer on the I2C bus and repairs
+#it if it shows garbage. The problems are sent back to the main program, which reports them in its status
+def answer_hardware_check():
+    global answered_hardware_check
+
+    prearm = (status_subscriber.state or {}).get("prearm") or {}
+    if (prearm.get("state") != "checking" or prearm.get("check") == answered_hardware_check):
+        return
+    answered_hardware_check = prearm.get("check")
+
+    problems = []
+    try:
+        main_display.invalidate()
+        main_display.flush()
+    except OSError as error:
+        problems.append(f"LCD does not respond: {error}")
+
+    if buttons is None:
+        problems.append("GPIO is not set up yet")
+    else:
+        for pin, name in list(buttons.buttons.items()):
+            try:
+                GPIO.input(pin)
+            except (RuntimeError, ValueError, OSError) as error:
+                problems.append(f"{name} button on pin {pin}: {error}")
+
+    status_subscriber.send({"type": "hardware_check", "check": answered_hardware_check, "problems": problems})
+    log.info("Answered hardware check %s: %s", answered_hardware_check, problems or "ok")
+
+#Seconds until the next minute starts, the clock screen only changes then
+def seconds_until_next_minute(now):
+    return 60 - now.second - now.microsecond / 1000000
+
+#Returns the cached line called name, format_line() is only called when key (what the line shows) changed
+def cached_line(name, key, format_line):
+    cached = line_cache.get(name)
+    if (cached is None or cached[0] != key):
+        cached = line_cache[name] = (key, format_line())
+    return cached[1]
+
+#Returns the weekday and time line, e.g. "    Mo 11:11"
+def format_clock_line(now):
+    return f"    {week_days[now.isoweekday() % 7]} {now.hour:02}:{now.minute:02}"
+
+#Returns the line with the alarm status
+def format_status_line():
+    #Alarm is set but not ringing
+    if(alarm_active and not ringing):
+        return "Wecker um: " + ring_time
+
+    #Alarm is currently ringing
+    elif(alarm_active and ringing):
+        return " (*) Wecker (*)"
+
+    #No alarm set
     else:
-        print(f"\033[91m Error: Please specify whether you want the <date> or the <time>\033[0m")
+        return "  Keine Wecker"
+
+#Returns the two lines of the clock screen for the current alarm status
+#Both lines are rendered from one time snapshot (now, the current time if None), so they can't disagree
+def render_clock_screen(now=None):
+    if now is None:
+        now = clock.now()
+    line1 = cached_line("clock", (now.isoweekday(), now.hour, now.minute), lambda: format_clock_line(now))
+    line2 = cached_line("status", (alarm_active, ringing, ring_time), format_status_line)
+    return line1, line2
 
 
-#Updating the content of the lcd display, only if the content has changed
+#Updating the content of the lcd display, only the characters that changed are sent
 def write_to_display(line1, line2):
-    global last_display_content
-
-    if (last_display_content != [line1 , line2]):
-        main_display.cursor_pos = (0, 0)
-        main_display.write_string(line1.ljust(16))
-        main_display.cursor_pos = (1, 0)
-        main_display.write_string(line2.ljust(16))
-        last_display_content = [line1, line2]
-        
-        print("Wrote to Line 1 on main display: " + line1.strip())
-        print("Wrote to Line 2 on main display: " + line2.strip())
+    main_display.write_line(0, line1)
+    main_display.write_line(1, line2)
+    written = main_display.flush()
 
-#Writes selected ringtime to the status file for the main program to read
+    if written:
+        log.debug("Wrote %s characters to main display: '%s' / '%s'", written, line1.strip(), line2.strip())
+
+#Sends the selected ringtime to the main program
+#The status file is only written as a fallback if the main program is not connected, it reads the file once it
+#connects again (a file written after main handled the message would add the alarm twice)
 def write_to_main_status(ringtime):
+    if status_subscriber.send({"type": "set_ring_time", "ring_time": ringtime}):
+        return
+
+    log.warning("Main program not connected, only writing '%s'", status_to_main)
     with open(status_to_main, "w") as status_file:
             status_file.write(ringtime)
 
-#Measures the brightness level in the room using a light-dependent resistor and a capacitor. The charging time of the capacitor depends on the light intensity:
-#The brighter it is, the faster it charges.
-def get_brightnes():
-
-    #Discharge the capacitor by setting the pin to output and driving it LOW
-    GPIO.setup(daylight_resistor_pin, GPIO.OUT)
-    GPIO.output(daylight_resistor_pin, GPIO.LOW)
-    time.sleep(0.1)
-    
-    #Set the pin to input mode to start measuring the capacitor charging tim
-    GPIO.setup(daylight_resistor_pin, GPIO.IN)
-    currentTime = time.time()
-    diff = 0
-    
-    #Wait until the capacitor has charged enough to pull the pin HIGH
-    while(GPIO.input(daylight_resistor_pin) == GPIO.LOW):
-        diff  = time.time() - currentTime
-
-    #Convert the charging time to a brightness value (shorter time = more light)
-    brightness = round(diff * 1000) #Convert seconds to milliseconds
-
-    #Return the measured brightness value
-    return brightness
-
+#Samples the brightness every backlight_check_interval seconds (see light_sensor.py)
+#Turns the backlight off while the room is dark and sends the readings to the main program, the metrics are sent along every metrics_report_interval
 def backlight_control ():
+    last_metrics_report = None
     while True:
-        if(get_brightnes() > 100 and auto_backlight_control == True):
-            main_display.backlight_enabled = False
-        else:
-            main_display.backlight_enabled = True
-        sleep(2)
+        loop_iterations.inc(loop="backlight_control")
+        reading = brightness_sampler.sample()
+        backlight_enabled = not (reading["dark"] and auto_backlight_control == True)
+
+        if (main_display.backlight_enabled != backlight_enabled):
+            main_display.backlight_enabled = backlight_enabled
+
+        brightness_message = dict(reading)
+        brightness_message["type"] = "brightness"
+        status_subscriber.send(brightness_message)
+
+        if (last_metrics_report is None or clock.monotonic() - last_metrics_report >= metrics_report_interval):
+            alarm_profiler.update_thread_cpu_metrics()
+            status_subscriber.send({"type": "metrics", "metrics": alarm_metrics.registry.snapshot()})
+            last_metrics_report = clock.monotonic()
+
+        clock.sleep(config.backlight_check_interval)
 #---------------------------------------------Menu Functions----------------------------------------------#
 
 #Opens a settings menu, where the user can make changes to the alarm ring time
 #The user can adjust the ring time with the up/down arrows and confirm with ok
 def main_display_menu_button_pressed():
-    global default_alarm_hour, default_alarm_minute, menu_time_increment, user_set_ringtime
+    global user_set_ringtime
 
     if (alarm_active or ringing):
-        print("Menu button pressed while alarm was armed")
+        log.info("Menu button pressed while alarm was armed")
         main_display.clear()
         main_display.cursor_pos = (0, 1)
         main_display.write_string("Wecker bereits")
         main_display.cursor_pos = (1, 4)
         main_display.write_string("gestellt")
-        sleep(2)
+        main_display.flush()
+        clock.sleep(2)
         return
 
     main_display.clear()
     update_menu_time(default_alarm_hour, default_alarm_minute)
-    print("Menu opend")
+    log.info("Menu opend")
 
-    #Main loop to capture user input for setting the alarm time
+    #Main loop to capture user input for setting the alarm time, sleeps until a button event arrives
     while True:
-        sleep(0.1)
-
-        #UP button increases time
-        if (GPIO.input(up_button) == GPIO.HIGH):
-            press_time = time.time()
-            while GPIO.input(up_button) == GPIO.HIGH:
-                elapsed = time.time() - press_time
-                if elapsed > 1:
-                    adjust_menu_time(menu_time_increment * 5)
-                else:
-                    adjust_menu_time(menu_time_increment)
-                    sleep(0.1)
-            sleep(0.01)
+        event = display_events.get()
+
+        #New settings apply right away, the selected time is shown again in case the default changed
+        if isinstance(event, alarm_config.Config):
+            apply_config(event)
+            update_menu_time(default_alarm_hour, default_alarm_minute)
+            continue
+
+        #A pre-arm hardware check is answered right away, the main program only waits a few seconds for it
+        #Everything else in the status and clock steps is picked up again after the menu is closed
+        if (event == status_update):
+            answer_hardware_check()
+            continue
+
+        if (not isinstance(event, button_input.ButtonEvent) or event.kind == button_input.release):
+            continue
+
+        #UP button increases time, in bigger steps while it is held down
+        if (event.button == "up"):
+            if (event.kind == button_input.long_press):
+                adjust_menu_time(config.menu_time_increment * config.menu_fast_increment)
+            else:
+                adjust_menu_time(config.menu_time_increment)
         
-        #DOWN button decreases time
-        elif (GPIO.input(down_button) == GPIO.HIGH):
-            press_time = time.time()
-            while GPIO.input(down_button) == GPIO.HIGH:
-                elapsed = time.time() - press_time
-                if elapsed > 1:
-                    adjust_menu_time(-menu_time_increment * 5)
-                else:
-                    adjust_menu_time(-menu_time_increment)
-                    sleep(0.1)
-            sleep(0.01)
+        #DOWN button decreases time, in bigger steps while it is held down
+        elif (event.button == "down"):
+            if (event.kind == button_input.long_press):
+                adjust_menu_time(-config.menu_time_increment * config.menu_fast_increment)
+            else:
+                adjust_menu_time(-config.menu_time_increment)
         
         #MENU button exits the menu without saving
-        elif(GPIO.input(menu_button) == GPIO.HIGH):
-            sleep(0.1)
+        elif(event.button == "menu" and event.kind == button_input.press):
             user_set_ringtime = None
-            print("Menu closed")
+            log.info("Menu closed")
             break
 
         #OK button confirms the selected time
-        elif(GPIO.input(ok_button) == GPIO.HIGH):
+        elif(event.button == "ok" and event.kind == button_input.press):
             user_set_ringtime = f"{default_alarm_hour:02}:{default_alarm_minute:02}"
             main_display.clear()
             main_display.cursor_pos = (0, 5)
             main_display.write_string("Wecker")
             main_display.cursor_pos = (1, 4)
             main_display.write_string("gestellt")
+            main_display.flush()
             write_to_main_status(user_set_ringtime)
-            print("User set ringtime to: " + str(user_set_ringtime))
-            sleep(2)
+            log.info("User set ringtime to: %s", user_set_ringtime)
+            clock.sleep(2)
             break
 
 
@@ -224,6 +326,7 @@ def update_menu_time(hours, minutes):
     main_display.write_string("<Weckzeit>")
     main_display.cursor_pos = (1, 5)
     main_display.write_string(f"{hours:02}:{minutes:02}")
+    main_display.flush()
 
 
 #Adjusts the alarm time by the specified number of minutes.
@@ -248,30 +351,60 @@ def adjust_menu_time(minutes):
 
 #------------------------------------------------Main Code------------------------------------------------#
 
-backlight_control_thread = threading.Thread(target=backlight_control, daemon=True)
-backlight_control_thread.start()
+#config_file is loaded first and watched, its changes are applied by the loop (without it the settings in config are used)
+def run_display_loop(config_file=None):
+    global auto_backlight_control, config_watcher
 
-while True:
+    if config_file is not None:
+        config_watcher = alarm_config.ConfigWatcher(config_file, display_events.put)
+        apply_config(config_watcher.start())
+    profiler.install_signal_handler()
 
+    #Show the time first, then report ready and set up the buttons and the light sensor
+    init_display()
+    status_subscriber.start()
     read_alarm_status_from_main()
+    write_to_display(*render_clock_screen())
+    sd_daemon.notify("READY=1", "STATUS=Showing the time")
+    log.info("First screen shown after %.3f s", sd_daemon.seconds_since_start())
 
-    if(GPIO.input(menu_button) == GPIO.HIGH):
-            auto_backlight_control = False #Stop the automatic backlight control
-            main_display.backlight_enabled = True #Turn on the backlight
-            main_display_menu_button_pressed()
-            sleep(0.1)
-            last_display_content = False #Reset display state to force update
-            auto_backlight_control = True #Restart the automatic backlight control
-            continue
+    init_hardware()
+    backlight_control_thread = threading.Thread(target=backlight_control, name="backlight-control", daemon=True)
+    backlight_control_thread.start()
+    clock.watch_steps(lambda: display_events.put(clock_stepped))
 
-    #Alarm is set but not ringing
-    elif(alarm_active and not ringing):
-        write_to_display("    " + get_time_date("date") + " " + get_time_date("time"), "Wecker um: " + ring_time)
+    while True:
 
-    #Alarm is currently ringing
-    elif(alarm_active and ringing):
-        write_to_display("    " + get_time_date("date") + " " + get_time_date("time"), " (*) Wecker (*)")
-    
-    #No alarm set
-    else:
-        write_to_display("    " + get_time_date("date") + " " + get_time_date("time"), "  Keine Wecker")
+        #Sleep until a button is pressed, the main program pushes a new status or the next minute starts
+        #Nothing on the clock screen changes in between, so the loop does not wake up otherwise
+        try:
+            event = display_events.get(timeout=seconds_until_next_minute(clock.now()))
+        except queue.Empty:
+            event = None
+
+        loop_iterations.inc(loop="run_display_loop")
+        if (event == status_update and status_subscriber.state):
+            status_latency.observe(status_subscriber.last_latency)
+            log.debug("Status update from main received after %.1f ms (max %.1f ms)", status_subscriber.last_latency * 1000, status_subscriber.max_latency * 1000)
+            answer_hardware_check()
+
+        if isinstance(event, alarm_config.Config):
+            apply_config(event)
+
+        read_alarm_status_from_main()
+
+        if(isinstance(event, button_input.ButtonEvent) and event.button == "menu" and event.kind == button_input.press):
+                auto_backlight_control = False #Stop the automatic backlight control
+                main_display.backlight_enabled = True #Turn on the backlight
+                main_display_menu_button_pressed()
+                buttons.clear_events() #Drop presses made while the confirmation was shown, status updates stay queued
+                main_display.clear() #The clock screen is drawn into an empty buffer again
+                auto_backlight_control = True #Restart the automatic backlight control
+
+        #A wakeup right before the minute starts draws the old minute again and waits for the rest
+        write_to_display(*render_clock_screen(clock.now()))
+
+#The script can be imported without starting anything (e.g. by tools/replay_alarms.py)
+if __name__ == "__main__":
+    alarm_logging.setup_logging()
+    run_display_loop(alarm_config.config_path())
@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import wave
+import queue
+import hashlib
+import tempfile
+import threading
+import logging
+import audio_dsp
+
+log = logging.getLogger(__name__)
+
+#NumPy is only needed if an upload has to be converted (sudo apt install python3-numpy)
+#It is imported when the first upload needs it (see audio_dsp.load_numpy())
+numpy = None
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+cache_directory = "audio_cache/" #Converted ringtones are stored here, named by the SHA-256 of the upload
+cache_index_file = "audio_cache/ringtone_index.json" #Maps ringtone names (e.g. custom_audio.wav) to cached files
+max_cache_bytes = 200 * 1024 * 1024 #Least recently used files are removed once the cache is bigger than this
+max_upload_bytes = 200 * 1024 * 1024 #Larger uploads are rejected before they are written to disk
+max_ringtone_seconds = 600 #Longer ringtones are rejected
+
+#Format the playback path expects, uploads are converted to it
+target_sample_rate = 44100
+target_channels = 2
+target_sample_width = 2
+
+stream_chunk_bytes = 64 * 1024 #Uploads are copied to disk in chunks of this size
+convert_block_frames = 65536 #Frames converted at once, keeps memory use bounded for long files
+
+#-------------------------------------------------Helpers-------------------------------------------------#
+
+class IngestError(Exception):
+    pass
+
+#Copies the request body to a temporary file without holding it in memory
+#Returns (temporary path, SHA-256 hex digest of the content)
+def receive_upload(stream, content_length):
+    if (content_length <= 0):
+        raise IngestError("Upload is empty")
+    if (content_length > max_upload_bytes):
+        raise IngestError(f"Upload is larger than {max_upload_bytes // (1024 * 1024)} MB")
+
+    os.makedirs(cache_directory, exist_ok=True)
+    digest = hashlib.sha256()
+    remaining = content_length
+
+    file_descriptor, temp_path = tempfile.mkstemp(dir=cache_directory, suffix=".upload")
+    try:
+        with os.fdopen(file_descriptor, "wb") as temp_file:
+            while remaining > 0:
+                try:
+                    chunk = stream.read(min(stream_chunk_bytes, remaining))
+                except TimeoutError as error:
+                    raise IngestError(f"Upload stalled: {error}")
+                if not chunk:
+                    raise IngestError("Upload ended early")
+                digest.update(chunk)
+                temp_file.write(chunk)
+                remaining -= len(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    return temp_path, digest.hexdigest()
+
+#Checks the WAV header, returns (channels, sample width, sample rate, frames)
+def validate_wav(path):
+    try:
+        with wave.open(path, "rb") as wav_file:
+            params = (wav_file.getnchannels(), wav_file.getsampwidth(), wav_file.getframerate(), wav_file.getnframes())
+    except (wave.Error, EOFError) as error:
+        raise IngestError(f"Not a PCM WAV file: {error}")
+
+    channels, sample_width, sample_rate, frames = params
+    if channels not in (1, 2):
+        raise IngestError(f"Only mono and stereo are supported, file has {channels} channels")
+    if sample_width not in (1, 2, 3, 4):
+        raise IngestError(f"Unsupported sample width of {sample_width} bytes")
+    if (sample_rate < 8000 or sample_rate > 192000):
+        raise IngestError(f"Unsupported sample rate {sample_rate}")
+    if (frames == 0):
+        raise IngestError("File contains no audio")
+    if (frames / sample_rate > max_ringtone_seconds):
+        raise IngestError(f"Ringtone is longer than {max_ringtone_seconds} seconds")
+
+    return params
+
+def is_target_format(channels, sample_width, sample_rate):
+    return (channels, sample_width, sample_rate) == (target_channels, target_sample_width, target_sample_rate)
+
+#---------------------------------------------------Convert-----------------------------------------------#
+
+#Raw PCM bytes -> float32 array of shape (frames, channels) scaled to -1..1
+def pcm_to_float(data, channels, sample_width):
+    if (sample_width == 1):
+        samples = (numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.float32) - 128) / 128
+    elif (sample_width == 3):
+        raw = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, 3).astype(numpy.int32)
+        samples = (raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16))
+        samples = numpy.where(samples >= 2 ** 23, samples - 2 ** 24, samples).astype(numpy.float32) / 2 ** 23
+    else:
+        dtype = "<i2" if sample_width == 2 else "<i4"
+        samples = numpy.frombuffer(data, dtype=dtype).astype(numpy.float32) / 2 ** (8 * sample_width - 1)
+    return samples.reshape(-1, channels)
+
+#Converts a WAV file to the target format block by block
+#Resampling uses linear interpolation, the last frame of every block is carried over to the next one
+def convert_wav(source_path, target_path):
+    global numpy
+    if not audio_dsp.load_numpy():
+        raise IngestError(f"Converting needs numpy, upload a {target_sample_rate} Hz {target_sample_width * 8} bit stereo WAV instead")
+    numpy = audio_dsp.numpy
+
+    with wave.open(source_path, "rb") as source, wave.open(target_path, "wb") as target:
+        channels = source.getnchannels()
+        sample_width = source.getsampwidth()
+        ratio = source.getframerate() / target_sample_rate
+
+        target.setnchannels(target_channels)
+        target.setsampwidth(target_sample_width)
+        target.setframerate(target_sample_rate)
+
+        carry = None #Last source frame of the previous block
+        block_start = 0 #Source index of the first frame in the current block (including carry)
+        next_output = 0 #Index of the next output frame
+
+        while True:
+            data = source.readframes(convert_block_frames)
+            if not data:
+                break
+
+            block = pcm_to_float(data, channels, sample_width)
+            if (channels == 1 and target_channels == 2):
+                block = numpy.repeat(block, 2, axis=1)
+            elif (channels == 2 and target_channels == 1):
+                block = block.mean(axis=1, keepdims=True)
+
+            if carry is not None:
+                block = numpy.vstack([carry, block])
+
+            #Output frames whose source position lies inside this block
+            last_position = block_start + len(block) - 1
+            count = int((last_position - next_output * ratio) // ratio) + 1 if next_output * ratio <= last_position else 0
+            positions = (next_output + numpy.arange(count)) * ratio - block_start
+            lower = numpy.floor(positions).astype(numpy.int64)
+            upper = numpy.minimum(lower + 1, len(block) - 1)
+            fraction = (positions - lower)[:, None].astype(numpy.float32)
+            output = block[lower] * (1 - fraction) + block[upper] * fraction
+
+            next_output += count
+            block_start += len(block) - 1
+            carry = block[-1:]
+
+            scale = 2 ** (8 * target_sample_width - 1)
+            target.writeframes(numpy.clip(output * scale, -scale, scale - 1).astype("<i2").tobytes())
+
+#----------------------------------------------------Cache------------------------------------------------#
+
+#Converted ringtones named by the hash of the upload, least recently used files are evicted
+class RingtoneCache:
+
+    #on_release is called with the path of a cached file once no ringtone name points to it anymore or it was
+    #removed, e.g. to drop its decoded copy from memory (audio_engine.evict())
+    def __init__(self, directory=cache_directory, index_file=cache_index_file, max_bytes=max_cache_bytes, on_release=None):
+        self.directory = directory
+        self.index_file = index_file
+        self.max_bytes = max_bytes
+        self.on_release = on_release
+        self.lock = threading.Lock()
+        self.index = self._load_index()
+
+    def path_for(self, digest):
+        return os.path.join(self.directory, digest + ".wav")
+
+    #Returns the cached file of a ringtone name or None
+    #mark_used=True (only when the ringtone is played) marks the file as recently used for evict(), plain lookups
+    #(e.g. for every GET /config) don't write to the SD card
+    def lookup(self, ringtone, mark_used=False):
+        with self.lock:
+            digest = self.index.get(ringtone)
+        if digest is None:
+            return None
+
+        path = self.path_for(digest)
+        if not os.path.exists(path):
+            return None
+        if mark_used:
+            os.utime(path)
+        return path
+
+    def contains(self, digest):
+        return os.path.exists(self.path_for(digest))
+
+    #Points a ringtone name to a cached file and evicts old files
+    def assign(self, ringtone, digest):
+        with self.lock:
+            previous = self.index.get(ringtone)
+            self.index[ringtone] = digest
+            self._save_index()
+            in_use = set(self.index.values())
+        os.utime(self.path_for(digest))
+        if (previous is not None and previous not in in_use and self.on_release):
+            self.on_release(self.path_for(previous))
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            in_use = set(self.index.values())
+            files = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".wav"):
+                    path = os.path.join(self.directory, name)
+                    status = os.stat(path)
+                    files.append((status.st_mtime, status.st_size, path, name[:-len(".wav")]))
+
+            total = sum(size for _, size, _, _ in files)
+            for _, size, path, digest in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                #Never evict a file a ringtone name still points to
+                if digest in in_use:
+                    continue
+                os.remove(path)
+                total -= size
+                log.info("Removed '%s' from the ringtone cache", path)
+                if self.on_release:
+                    self.on_release(path)
+
+    def _load_index(self):
+        try:
+            with open(self.index_file, "r") as index_file:
+                return json.load(index_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    #Written to a temporary file first so a crash can't leave a half written index
+    def _save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = self.index_file + ".tmp"
+        with open(temp_path, "w") as index_file:
+            json.dump(self.index, index_file)
+        os.replace(temp_path, self.index_file)
+
+#---------------------------------------------------Worker------------------------------------------------#
+
+#Converts validated uploads in a background thread so the HTTP request and the alarm never wait for it
+class IngestWorker:
+
+    def __init__(self, cache, on_ready=None):
+        self.cache = cache
+        self.on_ready = on_ready #Called with (ringtone, path) once the converted file is in the cache
+        self.jobs = queue.Queue()
+        self.status = {"state": "idle"} #Last upload: idle, processing, ready or failed
+
+    def start(self):
+        threading.Thread(target=self._run, name="ringtone-ingest", daemon=True).start()
+
+    #Streams, hashes and validates an upload, conversion happens later in the worker thread
+    def submit(self, stream, content_length, ringtone):
+        temp_path, digest = receive_upload(stream, content_length)
+        try:
+            params = validate_wav(temp_path)
+        except IngestError:
+            os.remove(temp_path)
+            raise
+
+        self.status = {"state": "processing", "ringtone": ringtone, "digest": digest, "started": time.time()}
+        self.jobs.put((temp_path, digest, params, ringtone))
+        return digest
+
+    def _run(self):
+        while True:
+            temp_path, digest, params, ringtone = self.jobs.get()
+            try:
+                #Same file uploaded before: nothing to convert
+                if not self.cache.contains(digest):
+                    channels, sample_width, sample_rate, _ = params
+                    target_temp_path = self.cache.path_for(digest) + ".tmp"
+                    if is_target_format(channels, sample_width, sample_rate):
+                        os.replace(temp_path, target_temp_path)
+                    else:
+                        convert_wav(temp_path, target_temp_path)
+                    os.replace(target_temp_path, self.cache.path_for(digest))
+
+                self.cache.assign(ringtone, digest)
+                self.status = {"state": "ready", "ringtone": ringtone, "digest": digest}
+                log.info("Ringtone '%s' is ready (%s)", ringtone, digest[:12])
+                if self.on_ready:
+                    self.on_ready(ringtone, self.cache.path_for(digest))
+
+            except (IngestError, wave.Error, EOFError, OSError) as error:
+                self.status = {"state": "failed", "ringtone": ringtone, "error": str(error)}
+                log.error("Could not convert uploaded ringtone: %s", error)
+
+            finally:
+                for path in (temp_path, self.cache.path_for(digest) + ".tmp"):
+                    if os.path.exists(path):
+                        os.remove(path)
@@ -0,0 +1,73 @@
+import os
+import time
+import socket
+import logging
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Socket activation and readiness notification of systemd, same protocol as sd_listen_fds() and sd_notify()
+#of libsystemd, so python3-systemd is not needed (see the units in systemd/)
+listen_fds_start = 3 #First file descriptor systemd passes (SD_LISTEN_FDS_START)
+
+#------------------------------------------------Functions------------------------------------------------#
+
+#Returns the listening sockets systemd opened for this process as dict name -> socket.socket
+#The names come from FileDescriptorName= in the .socket units, the dict is empty if the process was not socket activated
+#Connections that arrive while the program is still starting wait in the socket's backlog instead of being refused
+def listen_sockets():
+    if (os.environ.get("LISTEN_PID") != str(os.getpid())):
+        return {}
+
+    count = int(os.environ.get("LISTEN_FDS", "0") or 0)
+    names = os.environ.get("LISTEN_FDNAMES", "").split(":")
+
+    #Child processes (e.g. aplay) must not think the sockets are meant for them
+    for variable in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+        os.environ.pop(variable, None)
+
+    sockets = {}
+    for index in range(count):
+        file_descriptor = listen_fds_start + index
+        os.set_inheritable(file_descriptor, False)
+        name = names[index] if (index < len(names) and names[index]) else f"fd{file_descriptor}"
+        sockets[name] = socket.socket(fileno=file_descriptor)
+
+    log.info("Received %s socket(s) from systemd: %s", len(sockets), ", ".join(sockets))
+    return sockets
+
+#Sends state lines like "READY=1" or "STATUS=Waiting for alarms" to systemd (Type=notify services)
+#Returns False if the process was not started by systemd
+def notify(*states):
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+
+    #Abstract socket names start with @
+    if address.startswith("@"):
+        address = "\0" + address[1:]
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as notify_socket:
+            notify_socket.connect(address)
+            notify_socket.sendall("\n".join(states).encode("utf-8"))
+    except OSError as error:
+        log.warning("Could not notify systemd: %s", error)
+        return False
+    return True
+
+#Seconds since this process was started (by systemd or a shell), so start up times include the time
+#python needs to start and import everything. Falls back to the time since this module was imported
+def seconds_since_start():
+    try:
+        with open("/proc/self/stat", "r") as stat_file:
+            #The command name can contain spaces, the fields after it are fixed
+            start_ticks = int(stat_file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - module_import_time
+
+module_import_time = time.monotonic()
@@ -0,0 +1,94 @@
+import os
+import mmap
+import time
+import struct
+import threading
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+#/dev/shm is a RAM disk, so updating the state never writes to the SD card
+shared_state_path = "/dev/shm/alarm_clock_state" if os.path.isdir("/dev/shm") else "status_files/alarm_clock_state.shm"
+max_read_attempts = 1000 #A reader gives up after this many attempts while the writer is stuck half way (e.g. crashed)
+
+#Layout: sequence number, then the state
+#The sequence number is odd while the writer is changing the state and even when the state is complete
+header_format = "<I"
+payload_format = "<bbBBd" #ring hour (-1 = none), ring minute, active, ringing, time of the update
+header_size = struct.calcsize(header_format)
+state_size = header_size + struct.calcsize(payload_format)
+
+#----------------------------------------------Shared state-----------------------------------------------#
+
+#Alarm status shared between the main program (writer) and the main display (readers) through a memory mapped file
+#Works like a seqlock: readers never lock, they just retry if the sequence number changed while they were reading,
+#so they can never see half of an update
+class SharedAlarmState:
+
+    #create=True is used by the writer, it creates (or resets) the file
+    def __init__(self, path=shared_state_path, create=False):
+        self.path = path
+        self.write_lock = threading.Lock()
+
+        #Readers get FileNotFoundError if the writer has not created the file yet
+        #The file is never truncated once it exists, readers that still map it would crash
+        flags = os.O_RDWR | os.O_CREAT if create else os.O_RDWR
+        file_descriptor = os.open(path, flags, 0o644)
+        try:
+            new_file = os.fstat(file_descriptor).st_size < state_size
+            if new_file:
+                os.ftruncate(file_descriptor, state_size)
+            self.memory = mmap.mmap(file_descriptor, state_size)
+        finally:
+            os.close(file_descriptor)
+
+        #A new file starts with "no ring time" instead of 00:00
+        if (create and new_file):
+            struct.pack_into(payload_format, self.memory, header_size, -1, -1, False, False, 0)
+
+        #A writer that crashed half way left an odd sequence number behind
+        if (create and self._sequence() % 2 == 1):
+            struct.pack_into(header_format, self.memory, 0, (self._sequence() + 1) & 0xFFFFFFFF)
+
+    def _sequence(self):
+        return struct.unpack_from(header_format, self.memory, 0)[0]
+
+    #Replaces the whole state in one update
+    def write(self, ring_time, active, ringing):
+        if ring_time:
+            hour, minute = (int(part) for part in ring_time.split(":"))
+        else:
+            hour, minute = -1, -1
+
+        with self.write_lock:
+            sequence = self._sequence()
+            struct.pack_into(header_format, self.memory, 0, (sequence + 1) & 0xFFFFFFFF)
+            struct.pack_into(payload_format, self.memory, header_size, hour, minute, bool(active), bool(ringing), time.time())
+            struct.pack_into(header_format, self.memory, 0, (sequence + 2) & 0xFFFFFFFF)
+
+    #Returns a version number that changes with every write
+    def version(self):
+        return self._sequence() // 2
+
+    #Returns the state as dict, or None if the writer did not finish an update in time
+    def read(self):
+        for _ in range(max_read_attempts):
+            sequence_before = self._sequence()
+            if (sequence_before % 2 == 1):
+                time.sleep(0)
+                continue
+
+            hour, minute, active, ringing, updated_at = struct.unpack_from(payload_format, self.memory, header_size)
+
+            if (self._sequence() == sequence_before):
+                return {
+                    "ring_time": f"{hour:02}:{minute:02}" if hour >= 0 else None,
+                    "active": bool(active),
+                    "ringing": bool(ringing),
+                    "updated_at": updated_at,
+                    "version": sequence_before // 2,
+                }
+        return None
+
+    def close(self):
+        self.memory.close()
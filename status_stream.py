@@ -0,0 +1,128 @@
+import json
+import asyncio
+import threading
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+keepalive_interval = 15 #Seconds between keep alive comments, also how fast dead connections are noticed
+retry_ms = 2000 #How long browsers wait before reconnecting after the stream was closed
+
+#Event names sent to the browsers
+event_alarm_set = "alarm_set"
+event_ringing = "ringing"
+event_snoozed = "snoozed"
+event_stopped = "stopped"
+event_inactive = "inactive"
+event_prearm = "prearm" #The pre-arm check before an alarm started or finished (status "prearm")
+
+#------------------------------------------------Broadcaster----------------------------------------------#
+
+#Pushes status changes to browsers as Server-Sent Events
+#Connected browsers only cost an open socket: the HTTP handler hands the socket over and returns,
+#so no task waits per connection. Every event has a version number (SSE id / ETag) so clients can
+#tell if they missed something
+class StatusBroadcaster:
+
+    def __init__(self):
+        self.clients = []
+        self.listeners = [] #Called with (event, state) on every change, for in-process users
+        self.version = 0
+        self.event = event_inactive
+        self.state = {}
+        self.lock = threading.Lock()
+
+    @property
+    def etag(self):
+        return f'"{self.version}"'
+
+    def add_listener(self, callback):
+        with self.lock:
+            self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self.lock:
+            if callback in self.listeners:
+                self.listeners.remove(callback)
+
+    #Sends a new status to all connected browsers and listeners
+    def publish(self, event, state):
+        with self.lock:
+            self.version += 1
+            self.event = event
+            self.state = dict(state)
+            data = self._format_event()
+
+            for client in list(self.clients):
+                self._send(client, data)
+            listeners = list(self.listeners)
+
+        for listener in listeners:
+            listener(event, dict(state))
+
+    #Takes over a socket whose HTTP headers were already sent
+    #The current status is sent right away unless the browser already has it (Last-Event-ID)
+    def attach(self, client, last_event_id=None):
+        client.setblocking(False)
+        with self.lock:
+            self.clients.append(client)
+            self._send(client, f"retry: {retry_ms}\n\n".encode("utf-8"))
+            if (last_event_id != str(self.version)):
+                self._send(client, self._format_event())
+
+    #Long polling: waits until the version differs from known_version or the timeout expires
+    #Returns True if there is something new
+    async def wait_for_change(self, known_version, timeout):
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        listener = lambda event, state: loop.call_soon_threadsafe(changed.set)
+        self.add_listener(listener)
+        try:
+            if (str(self.version) == str(known_version)):
+                await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.remove_listener(listener)
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = dict(self.state)
+            snapshot["event"] = self.event
+            snapshot["version"] = self.version
+            return snapshot
+
+    def client_count(self):
+        with self.lock:
+            return len(self.clients)
+
+    def _format_event(self):
+        data = self.state.copy()
+        data["event"] = self.event
+        data["version"] = self.version
+        return f"id: {self.version}\nevent: status\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+    #Sockets are non blocking: a browser that can't keep up is dropped and reconnects on its own
+    def _send(self, client, data):
+        try:
+            sent = client.send(data)
+            if sent == len(data):
+                return
+        except (BlockingIOError, OSError):
+            pass
+
+        if client in self.clients:
+            self.clients.remove(client)
+        try:
+            client.close()
+        except OSError:
+            pass
+
+    #Runs as task on the event loop for the whole lifetime of the program
+    async def keepalive(self):
+        while True:
+            await asyncio.sleep(keepalive_interval)
+            with self.lock:
+                for client in list(self.clients):
+                    self._send(client, b": keepalive\n\n")
@@ -0,0 +1,98 @@
+import io
+import os
+import sys
+import shutil
+import asyncio
+import tempfile
+import unittest
+import urllib.parse
+import importlib.util
+
+#Run without the real hardware, must be set before the script is loaded
+os.environ.setdefault("ALARM_CLOCK_FAKE_GPIO", "1")
+os.environ.setdefault("ALARM_CLOCK_FAKE_LCD", "1")
+os.environ.setdefault("ALARM_CLOCK_AUDIO_SINK", "null")
+
+#Allow running the tests from any directory, the script loads its pages relative to the repository
+repository = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repository)
+import alarm_logging
+
+#Loads the main program (its name contains a space and dots, so import does not work)
+def load_main():
+    spec = importlib.util.spec_from_file_location("alarm_clock_main", os.path.join(repository, "main 1.6.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+#Stand-in for BaseHTTPRequestHandler with what the route functions of the main program use
+class FakeRequest:
+
+    def __init__(self, path, form=None):
+        body = urllib.parse.urlencode(form or {}).encode("utf-8")
+        self.path = path
+        self.headers = {"Content-Length": str(len(body))}
+        self.rfile = io.BytesIO(body)
+        self.close_connection = False
+
+#Sends stop and snooze requests to the alarm loop of the main program through its API routes
+class AlarmInputsTest(unittest.TestCase):
+
+    def setUp(self):
+        alarm_logging.setup_logging("CRITICAL")
+        self.working_directory = os.getcwd()
+        os.chdir(repository)
+        self.directory = tempfile.mkdtemp()
+        open(os.path.join(self.directory, "main_audio.wav"), "w").close()
+
+        self.main = load_main()
+        self.main.config = self.main.config._replace(ringtone_directory=self.directory)
+        self.main.webserver_status_file = os.path.join(self.directory, "alarm_webserver_status.status")
+        self.loop = asyncio.new_event_loop()
+        self.main.bind_event_loop(self.loop)
+        self.alarm_loop = self.loop.create_task(self.main.run_alarm_loop())
+        self.run_for(0.05)
+
+    def tearDown(self):
+        self.alarm_loop.cancel()
+        self.loop.run_until_complete(asyncio.gather(self.alarm_loop, return_exceptions=True))
+        self.loop.close()
+        os.chdir(self.working_directory)
+        shutil.rmtree(self.directory, True)
+
+    def run_for(self, seconds):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def request(self, path, form=None):
+        route = self.main.api_routes[("POST", path)]
+        return route(FakeRequest(path, form))[0]
+
+    def set_alarm(self):
+        status = self.request(self.main.settings_post_endpoint, {"ring_time": "06:00", "ring_tone": "main_audio.wav", "snooze_time": "300"})
+        self.assertEqual(status, 200)
+        self.run_for(0.05)
+
+    #A stop sent while no alarm is armed must not skip the alarm that is set next
+    def test_stop_while_idle_then_set(self):
+        self.request(self.main.stop_alarm_endpoint, {"action": self.main.stop_alarm_command})
+        self.run_for(0.05)
+        self.set_alarm()
+        self.assertTrue(self.main.alarm_scheduler.has_alarms())
+        self.assertTrue(self.main.main_display_status["active"])
+
+    #The same for a snooze
+    def test_snooze_while_idle_then_set(self):
+        self.request(self.main.snooze_alarm_endpoint)
+        self.run_for(0.05)
+        self.set_alarm()
+        self.assertTrue(self.main.alarm_scheduler.has_alarms())
+
+    #A stop sent while an alarm is armed skips it (a one-time alarm is removed)
+    def test_stop_while_armed(self):
+        self.set_alarm()
+        self.request(self.main.stop_alarm_endpoint, {"action": self.main.stop_alarm_command})
+        self.run_for(0.05)
+        self.assertFalse(self.main.alarm_scheduler.has_alarms())
+
+if __name__ == "__main__":
+    unittest.main()
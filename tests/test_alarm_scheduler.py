@@ -0,0 +1,34 @@
+import os
+import sys
+import unittest
+
+#Allow running the tests from any directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import alarm_scheduler
+
+#Settings of an alarm that can't work are rejected with ValueError, like the web form sends them (strings)
+class AlarmSettingsTest(unittest.TestCase):
+
+    def test_valid_settings(self):
+        alarm = alarm_scheduler.Alarm("06:30", "main_audio.wav", "1", alarm_scheduler.recurrence_every_n_days, "3", fade_in_seconds="0")
+        self.assertEqual((alarm.ring_time, alarm.snooze_duration, alarm.interval_days), ("06:30", 1, 3))
+
+    #A snooze of 0 or less would ring the alarm again right away, over and over
+    def test_snooze_duration(self):
+        for snooze_duration in ("0", "-300", 0):
+            with self.assertRaises(ValueError):
+                alarm_scheduler.Alarm("06:30", "main_audio.wav", snooze_duration)
+
+    def test_invalid_settings(self):
+        invalid = [
+            dict(ring_time="6:70"),
+            dict(recurrence="hourly"),
+            dict(interval_days="0"),
+            dict(fade_in_seconds="-1"),
+        ]
+        for settings in invalid:
+            with self.subTest(**settings), self.assertRaises(ValueError):
+                alarm_scheduler.Alarm(**dict(dict(ring_time="06:30"), **settings))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import sys
+import time
+import atexit
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+#Allow running the tests from any directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import alarm_store
+
+#Writes alarms into a journal in a temporary directory, damages it like a crash would and loads it again
+class AlarmStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "alarm_journal.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    #Returns a store on the journal, the tests call flush() themselves instead of the background thread
+    def open_store(self):
+        store = alarm_store.AlarmStore(self.path)
+        store._request_flush = lambda: None
+        return store
+
+    def read_lines(self):
+        with open(self.path, "rb") as journal:
+            return journal.readlines()
+
+    def write_lines(self, lines):
+        with open(self.path, "wb") as journal:
+            journal.write(b"".join(lines))
+
+    #Two alarms, the first one written again and the second one removed: one line from the first flush (it creates the
+    #journal by compaction) and three appended ones
+    def write_journal(self):
+        store = self.open_store()
+        store.load()
+        store.put("1", {"ring_time": "06:00"})
+        store.flush()
+        store.put("2", {"ring_time": "07:30"})
+        store.put("1", {"ring_time": "06:15"})
+        store.delete("2")
+        store.flush()
+        self.assertEqual(len(self.read_lines()), 4)
+
+    def test_restore(self):
+        self.write_journal()
+        self.assertEqual(self.open_store().load(), {"1": {"ring_time": "06:15"}})
+
+    #A line that was only written half (power loss during the append) is skipped, the lines before it are restored
+    def test_torn_last_line(self):
+        self.write_journal()
+        lines = self.read_lines()
+        self.write_lines(lines[:2] + [lines[2][:len(lines[2]) // 2]])
+
+        dropped = alarm_store.journal_dropped_lines.value()
+        store = self.open_store()
+        self.assertEqual(store.load(), {"1": {"ring_time": "06:00"}, "2": {"ring_time": "07:30"}})
+        self.assertEqual(alarm_store.journal_dropped_lines.value(), dropped + 1)
+
+        #The next flush compacts the journal, the damaged line is gone
+        store.flush()
+        self.assertEqual(len(self.read_lines()), 2)
+        self.assertEqual(self.open_store().load(), {"1": {"ring_time": "06:00"}, "2": {"ring_time": "07:30"}})
+
+    #A line with a wrong checksum is skipped, the others are still restored
+    def test_corrupt_line(self):
+        self.write_journal()
+        lines = self.read_lines()
+        lines[1] = lines[1].replace(b"07:30", b"07:31")
+        self.write_lines(lines)
+
+        self.assertIsNone(alarm_store.decode_line(lines[1]))
+        self.assertEqual(self.open_store().load(), {"1": {"ring_time": "06:15"}})
+
+    #A journal without a single intact line restores no alarms
+    def test_garbage_journal(self):
+        self.write_lines([b"\x00\x00\x00", b"not a journal\n"])
+        self.assertEqual(self.open_store().load(), {})
+
+    #Changes made before a flush are appended with one write and one fdatasync
+    def test_batched_sync(self):
+        self.write_journal()
+        store = self.open_store()
+        store.load()
+
+        sync = getattr(os, "fdatasync", os.fsync)
+        with mock.patch.object(alarm_store.os, sync.__name__, wraps=sync) as synced:
+            for minute in range(10):
+                store.put("3", {"ring_time": f"08:{minute:02}"})
+            store.flush()
+        self.assertEqual(synced.call_count, 1)
+        self.assertEqual(len(self.read_lines()), 14)
+        self.assertEqual(self.open_store().load()["3"], {"ring_time": "08:09"})
+
+    #Without flush() the background thread writes a burst of changes flush_delay seconds later, with one fdatasync
+    def test_background_flush(self):
+        self.write_journal()
+        store = alarm_store.AlarmStore(self.path)
+        store.load()
+        #The journal is gone by exit, the flush at exit must not recreate it
+        self.addCleanup(atexit.unregister, store._try_flush)
+
+        sync = getattr(os, "fdatasync", os.fsync)
+        with mock.patch.object(alarm_store, "flush_delay", 0.05), mock.patch.object(alarm_store.os, sync.__name__, wraps=sync) as synced:
+            for minute in range(5):
+                store.put("3", {"ring_time": f"08:{minute:02}"})
+            store.delete("1")
+            deadline = time.monotonic() + 5
+            #journal_lines is counted after the sync
+            while (store.journal_lines < 10 and time.monotonic() < deadline):
+                time.sleep(0.01)
+            self.assertEqual(synced.call_count, 1)
+
+        self.assertEqual(len(self.read_lines()), 10)
+        self.assertEqual(self.open_store().load(), {"3": {"ring_time": "08:04"}})
+
+    #Once the journal is long enough it is rewritten with one line per alarm, the file and its directory are synced
+    def test_compaction(self):
+        self.write_journal()
+        store = self.open_store()
+        store.load()
+        for minute in range(alarm_store.compact_min_lines):
+            store.put("1", {"ring_time": f"06:{minute % 60:02}"})
+
+        with mock.patch.object(alarm_store.os, "fsync", wraps=os.fsync) as synced:
+            store.flush()
+        self.assertEqual(synced.call_count, 2)
+        self.assertEqual(len(self.read_lines()), 1)
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+        self.assertEqual(self.open_store().load(), {"1": {"ring_time": f"06:{(alarm_store.compact_min_lines - 1) % 60:02}"}})
+
+if __name__ == "__main__":
+    unittest.main()
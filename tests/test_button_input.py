@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import unittest
+
+#Allow running the tests from any directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import button_input
+
+pin = 11
+debounce_ms = 50
+long_press_time = 0.2
+repeat_interval = 0.05
+
+#Drives ButtonInput with FakeGPIO edges like a real (bouncing) button would
+class ButtonInputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gpio = button_input.FakeGPIO()
+        self.buttons = button_input.ButtonInput(self.gpio, debounce_ms=debounce_ms, long_press_time=long_press_time, repeat_interval=repeat_interval)
+        self.buttons.add_button("up", pin)
+
+    def tearDown(self):
+        self.buttons.remove_all()
+
+    #Returns the kinds of all events sent within seconds
+    def collect(self, seconds):
+        kinds = []
+        deadline = time.monotonic() + seconds
+        while True:
+            event = self.buttons.get_event(max(deadline - time.monotonic(), 0))
+            if event is None:
+                return kinds
+            kinds.append(event.kind)
+
+    #A tap shorter than the debounce time: the release edge is ignored as bounce, the level is read again afterwards
+    def test_short_tap(self):
+        self.gpio.press(pin, 0.02)
+        self.assertEqual(self.collect(long_press_time + 3 * repeat_interval), [button_input.press, button_input.release])
+        self.assertFalse(self.buttons.is_pressed("up"))
+
+    #Contact bounce on press, the level read after the debounce time (HIGH) must not send a second press
+    def test_bouncing_press(self):
+        self.gpio.set_input(pin, self.gpio.HIGH)
+        self.gpio.set_input(pin, self.gpio.LOW)
+        self.gpio.set_input(pin, self.gpio.HIGH)
+        time.sleep(0.1)
+        self.gpio.set_input(pin, self.gpio.LOW)
+        self.assertEqual(self.collect(long_press_time + 3 * repeat_interval), [button_input.press, button_input.release])
+        self.assertFalse(self.buttons.is_pressed("up"))
+
+    #A held button repeats long_press until it is released
+    def test_long_press(self):
+        self.gpio.press(pin, long_press_time + 2.5 * repeat_interval)
+        kinds = self.collect(3 * repeat_interval)
+        self.assertEqual(kinds[0], button_input.press)
+        self.assertEqual(kinds[-1], button_input.release)
+        self.assertGreaterEqual(kinds.count(button_input.long_press), 2)
+
+    #A button held while the buttons are removed (pins remapped) is forgotten, late callbacks send nothing
+    def test_remove_while_held(self):
+        self.gpio.set_input(pin, self.gpio.HIGH)
+        self.assertEqual(self.collect(0.01), [button_input.press])
+        self.buttons.remove_all()
+        self.assertFalse(self.buttons.is_pressed("up"))
+        self.buttons._edge(pin)
+        self.buttons._send(pin, button_input.release, time.monotonic())
+        self.assertEqual(self.collect(long_press_time + 2 * repeat_interval), [])
+        self.gpio.set_input(pin, self.gpio.LOW)
+
+    #Only button events are dropped, other events in a shared queue stay in order
+    def test_clear_events_keeps_other_events(self):
+        self.buttons.events.put("status_update")
+        self.gpio.press(pin, 0.02)
+        time.sleep(long_press_time)
+        self.buttons.events.put("config")
+        self.buttons.clear_events()
+        self.assertEqual([self.buttons.get_event(0), self.buttons.get_event(0)], ["status_update", "config"])
+        self.assertIsNone(self.buttons.get_event(0))
+
+if __name__ == "__main__":
+    unittest.main()
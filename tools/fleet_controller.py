@@ -0,0 +1,355 @@
+import io
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import http.client
+import urllib.parse
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+default_port = 8080 #api_server_port in alarm_clock.conf
+default_timeout = 3 #Seconds one attempt of a request may take per device
+default_retries = 2 #Extra attempts after a failed attempt (see FleetController.request())
+default_concurrency = 64 #Requests in flight at the same time over the whole fleet
+default_pool_size = 2 #Open keep-alive connections per device
+retry_backoff = 0.2 #Seconds before the first retry, doubled for every further retry (plus random jitter)
+max_response_bytes = 16 * 1024 * 1024 #Longer responses are treated as broken
+
+#Endpoints of the alarm API (see main 1.6.py)
+settings_post_endpoint = "/send_data"
+stop_alarm_endpoint = "/stop_alarm"
+remove_alarm_endpoint = "/remove_alarm"
+list_alarms_endpoint = "/alarms"
+status_endpoint = "/status"
+stop_alarm_command = "stop_alarm"
+
+#-------------------------------------------------Devices-------------------------------------------------#
+
+#Returns the devices as list of (host, port)
+#An entry is "host", "host:port" or "host:first-last" for a range of ports (e.g. the clocks of tools/fleet_stub.py),
+#lines of a devices file can have comments after #
+def parse_devices(entries):
+    devices = []
+    for entry in entries:
+        entry = entry.split("#", 1)[0].strip()
+        if not entry:
+            continue
+        host, _, ports = entry.rpartition(":") if ":" in entry else (entry, "", str(default_port))
+        if ("-" in ports):
+            first, last = (int(port) for port in ports.split("-", 1))
+            devices.extend((host, port) for port in range(first, last + 1))
+        else:
+            devices.append((host, int(ports)))
+    return devices
+
+#--------------------------------------------------Client-------------------------------------------------#
+
+#Raised for a failed attempt, sent tells whether the request may have reached the clock
+class DeviceError(Exception):
+
+    def __init__(self, message, sent):
+        super().__init__(message)
+        self.sent = sent
+
+#Keep-alive HTTP/1.1 connection to one clock
+class DeviceConnection:
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    #A connection the clock closed while it was idle (keep_alive_timeout in async_http.py) can't be reused
+    @property
+    def usable(self):
+        return not (self.reader.at_eof() or self.writer.is_closing())
+
+    def close(self):
+        self.writer.close()
+
+    #Sends one request and returns (status, headers, body, keep_alive), keep_alive is False when the clock closes the connection
+    async def request(self, method, path, body=b"", content_type=None):
+        lines = [f"{method} {path} HTTP/1.1", "Host: alarm-clock", f"Content-Length: {len(body)}"]
+        if content_type:
+            lines.append(f"Content-Type: {content_type}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        status_line, _, header_block = head.partition(b"\r\n")
+        parts = status_line.decode("latin-1").split(" ", 2)
+        if (len(parts) < 2 or not parts[0].startswith("HTTP/")):
+            raise ValueError(f"Malformed status line {status_line!r}")
+        headers = http.client.parse_headers(io.BytesIO(header_block))
+
+        length = int(headers.get("Content-Length", 0) or 0)
+        if (length < 0 or length > max_response_bytes):
+            raise ValueError(f"Content-Length {length} out of range")
+        response_body = await self.reader.readexactly(length)
+        keep_alive = headers.get("Connection", "").lower() != "close"
+        return int(parts[1]), headers, response_body, keep_alive
+
+#Idle connections to one clock, at most pool_size are kept open
+class ConnectionPool:
+
+    def __init__(self, host, port, pool_size):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.idle = []
+        self.opened = 0 #Connections opened so far (the report shows how well they were reused)
+
+    async def acquire(self):
+        while self.idle:
+            connection = self.idle.pop()
+            if connection.usable:
+                return connection
+            connection.close()
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        self.opened += 1
+        return DeviceConnection(reader, writer)
+
+    def release(self, connection, keep_alive):
+        if (keep_alive and connection.usable and len(self.idle) < self.pool_size):
+            self.idle.append(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        for connection in self.idle:
+            connection.close()
+        self.idle = []
+
+#Result of one request to one clock
+class DeviceResult:
+
+    def __init__(self, device):
+        self.device = device
+        self.status = None
+        self.data = None
+        self.error = None
+        self.attempts = 0
+        self.latency = None #Seconds of the successful attempt
+
+    @property
+    def ok(self):
+        return self.error is None and self.status is not None and self.status < 400
+
+    @property
+    def name(self):
+        return f"{self.device[0]}:{self.device[1]}"
+
+    def to_dict(self):
+        return {"device": self.name, "ok": self.ok, "status": self.status, "data": self.data, "error": self.error, "attempts": self.attempts, "latency": self.latency}
+
+#Sends the same request to many clocks at the same time and collects the results
+#Connections are kept alive and reused (pool_size per clock), at most concurrency requests are in flight, every
+#attempt has its own timeout. Failed attempts are retried with exponential backoff, but a request that changes
+#something (POST) is only retried if the clock can't have handled it (the connection could not be opened or the
+#clock answered 503), otherwise an alarm could be set twice or a stop could also skip the next alarm
+#pool_size=0 opens a new connection for every request
+#Runs on the asyncio event loop of the caller, e.g. asyncio.run(controller.status())
+class FleetController:
+
+    def __init__(self, devices, timeout=default_timeout, retries=default_retries, concurrency=default_concurrency, pool_size=default_pool_size):
+        self.devices = list(devices)
+        self.timeout = timeout
+        self.retries = retries
+        self.pools = {device: ConnectionPool(device[0], device[1], pool_size) for device in self.devices}
+        self.limit = asyncio.Semaphore(concurrency)
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+
+    @property
+    def connections_opened(self):
+        return sum(pool.opened for pool in self.pools.values())
+
+    #GET /status of every clock
+    async def status(self):
+        return await self.request_all("GET", status_endpoint)
+
+    #GET /alarms of every clock
+    async def list_alarms(self):
+        return await self.request_all("GET", list_alarms_endpoint)
+
+    #POST /send_data on every clock with the fields of the web form (ring_time, ring_tone, snooze_time, recurrence, ...)
+    async def set_alarm(self, form):
+        return await self.request_all("POST", settings_post_endpoint, form)
+
+    #POST /stop_alarm on every clock: stops the ringing alarm or skips the next one
+    async def stop_alarm(self):
+        return await self.request_all("POST", stop_alarm_endpoint, {"action": stop_alarm_command})
+
+    #POST /remove_alarm on every clock
+    async def remove_alarm(self, alarm_id):
+        return await self.request_all("POST", remove_alarm_endpoint, {"id": alarm_id})
+
+    async def request_all(self, method, path, form=None):
+        return await asyncio.gather(*(self.request(device, method, path, form) for device in self.devices))
+
+    #Sends one request to one clock with timeout and retries, never raises
+    async def request(self, device, method, path, form=None):
+        result = DeviceResult(device)
+        body = urllib.parse.urlencode(form).encode("utf-8") if form is not None else b""
+        content_type = "application/x-www-form-urlencoded" if form is not None else None
+
+        while True:
+            result.attempts += 1
+            try:
+                async with self.limit:
+                    start_time = time.perf_counter()
+                    status, headers, response_body = await self._attempt(self.pools[device], method, path, body, content_type)
+                    result.latency = time.perf_counter() - start_time
+                result.status = status
+                result.error = None
+                result.data = decode_body(headers, response_body)
+                #Clocks that are overloaded or restarting answer with 5xx, a GET can simply be repeated,
+                #a POST only after 503 (the clock did not handle it)
+                if (status < 500 or (method != "GET" and status != 503) or result.attempts > self.retries):
+                    return result
+                result.error = f"HTTP {status}"
+            except DeviceError as error:
+                result.error = str(error)
+                if ((error.sent and method != "GET") or result.attempts > self.retries):
+                    return result
+
+            await asyncio.sleep(retry_backoff * 2 ** (result.attempts - 1) * random.uniform(1, 1.5))
+
+    async def _attempt(self, pool, method, path, body, content_type):
+        try:
+            connection = await asyncio.wait_for(pool.acquire(), self.timeout)
+        except (OSError, asyncio.TimeoutError) as error:
+            raise DeviceError(f"connect failed: {error!r}", False)
+
+        keep_alive = False
+        try:
+            status, headers, response_body, keep_alive = await asyncio.wait_for(connection.request(method, path, body, content_type), self.timeout)
+            return status, headers, response_body
+        except asyncio.TimeoutError:
+            raise DeviceError(f"no answer within {self.timeout} s", True)
+        except asyncio.IncompleteReadError:
+            raise DeviceError("connection closed without an answer", True)
+        except (OSError, asyncio.LimitOverrunError, ValueError) as error:
+            raise DeviceError(f"request failed: {error!r}", True)
+        finally:
+            pool.release(connection, keep_alive)
+
+#JSON responses are decoded, the HTML confirmation pages are left out of the report
+def decode_body(headers, body):
+    if headers.get("Content-Type", "").startswith("application/json") and body:
+        try:
+            return json.loads(body)
+        except ValueError:
+            return None
+    return None
+
+#--------------------------------------------------Report-------------------------------------------------#
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+#Returns the report lines for the results of one command
+#repeat is the number of times the command was sent (--repeat), results are the ones of the last time
+def build_report(command, results, elapsed, connections_opened, repeat=1, verbose=False):
+    ok = [result for result in results if result.ok]
+    failed = [result for result in results if not result.ok]
+    retried = sum(result.attempts - 1 for result in results)
+    latencies = [result.latency for result in ok if result.latency is not None]
+
+    lines = [f"{command}: {len(ok)}/{len(results)} clocks ok, {len(failed)} failed, {retried} retries, {connections_opened} connections opened, {elapsed:.2f} s ({len(results) * repeat / max(elapsed, 1e-9):.0f} requests/s)"]
+    if latencies:
+        lines.append(f"latency p50 {statistics.median(latencies) * 1000:.1f} ms   p95 {percentile(latencies, 95) * 1000:.1f} ms   max {max(latencies) * 1000:.1f} ms")
+
+    if (command == "status" and ok):
+        ringing = [result for result in ok if result.data and result.data.get("ringing")]
+        active = [result for result in ok if result.data and result.data.get("active")]
+        lines.append(f"{len(active)} armed, {len(ringing)} ringing, {len(ok) - len(active)} without alarm")
+        for result in ringing:
+            lines.append(f"  ringing: {result.name} ({result.data.get('ring_time')})")
+    elif (command == "list" and ok):
+        alarm_counts = [len(result.data or []) for result in ok]
+        next_rings = sorted(alarm["next_ring"] for result in ok for alarm in (result.data or []) if "next_ring" in alarm)
+        lines.append(f"{sum(alarm_counts)} alarms in total, {min(alarm_counts)} to {max(alarm_counts)} per clock" + (f", next ring {next_rings[0]}" if next_rings else ""))
+
+    for result in failed:
+        lines.append(f"  \033[91mfailed: {result.name} after {result.attempts} attempt(s): {result.error or f'HTTP {result.status}'}\033[0m")
+    if verbose:
+        for result in ok:
+            lines.append(f"  {result.name}: HTTP {result.status} {json.dumps(result.data) if result.data is not None else ''}")
+    return lines
+
+#---------------------------------------------------Main--------------------------------------------------#
+
+async def run_command(arguments, devices):
+    controller = FleetController(devices, arguments.timeout, arguments.retries, arguments.concurrency, arguments.pool_size)
+    start_time = time.perf_counter()
+    try:
+        for _ in range(arguments.repeat):
+            if (arguments.command == "status"):
+                results = await controller.status()
+            elif (arguments.command == "list"):
+                results = await controller.list_alarms()
+            elif (arguments.command == "set"):
+                form = {"ring_time": arguments.ring_time, "ring_tone": arguments.ring_tone, "snooze_time": arguments.snooze_time, "recurrence": arguments.recurrence, "interval_days": arguments.interval_days, "fade_in": arguments.fade_in}
+                results = await controller.set_alarm(form)
+            elif (arguments.command == "stop"):
+                results = await controller.stop_alarm()
+            else:
+                results = await controller.remove_alarm(arguments.id)
+    finally:
+        controller.close()
+    return results, time.perf_counter() - start_time, controller.connections_opened
+
+def main():
+    parser = argparse.ArgumentParser(description="Sets, lists and stops alarms and reads the status of many alarm clocks at once")
+    parser.add_argument("--devices", action="append", default=[], help="Comma separated clocks as host, host:port or host:first-last (port range)")
+    parser.add_argument("--devices-file", help="File with one clock per line (same format as --devices)")
+    parser.add_argument("--timeout", type=float, default=default_timeout, help="Seconds per attempt")
+    parser.add_argument("--retries", type=int, default=default_retries)
+    parser.add_argument("--concurrency", type=int, default=default_concurrency, help="Requests in flight at the same time")
+    parser.add_argument("--pool-size", type=int, default=default_pool_size, help="Keep-alive connections per clock")
+    parser.add_argument("--repeat", type=int, default=1, help="Send the command this often over the same connections (load tests)")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON instead of the report")
+    parser.add_argument("--verbose", action="store_true", help="Also list the clocks that answered")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="GET /status")
+    commands.add_parser("list", help="GET /alarms")
+    commands.add_parser("stop", help="Stop the ringing alarm or skip the next one")
+    remove_parser = commands.add_parser("remove", help="Remove an alarm by id")
+    remove_parser.add_argument("id", type=int)
+    set_parser = commands.add_parser("set", help="Set an alarm")
+    set_parser.add_argument("ring_time", help="HH:MM")
+    set_parser.add_argument("--ring-tone", default="main_audio.wav")
+    set_parser.add_argument("--snooze-time", default="300", help="Seconds")
+    set_parser.add_argument("--recurrence", default="once", help="once, daily, weekdays or every_n_days")
+    set_parser.add_argument("--interval-days", default="1")
+    set_parser.add_argument("--fade-in", default="0", help="Seconds")
+    arguments = parser.parse_args()
+
+    entries = [entry for devices in arguments.devices for entry in devices.split(",")]
+    if arguments.devices_file:
+        with open(arguments.devices_file, "r") as devices_file:
+            entries.extend(devices_file.read().splitlines())
+    devices = parse_devices(entries)
+    if not devices:
+        parser.error("No clocks given (--devices or --devices-file)")
+
+    results, elapsed, connections_opened = asyncio.run(run_command(arguments, devices))
+
+    if arguments.json:
+        print(json.dumps([result.to_dict() for result in results], indent=2))
+    else:
+        for line in build_report(arguments.command, results, elapsed, connections_opened, arguments.repeat, arguments.verbose):
+            print(line)
+    if not all(result.ok for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import random
+import asyncio
+import argparse
+import resource
+import urllib.parse
+
+#Allow running the tool from any directory
+repository = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repository)
+import async_http
+import alarm_scheduler as alarm_scheduler_module
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+default_clocks = 200 #Simulated clocks, every clock listens on its own port
+default_base_port = 9000 #Port of the first clock, the others follow
+default_host = "127.0.0.1"
+
+#Same endpoints and ringtones as main 1.6.py
+settings_post_endpoint = "/send_data"
+stop_alarm_endpoint = "/stop_alarm"
+remove_alarm_endpoint = "/remove_alarm"
+list_alarms_endpoint = "/alarms"
+status_endpoint = "/status"
+stop_alarm_command = "stop_alarm"
+allowed_ringtones = ["main_audio.wav", "audio1.wav", "audio2.wav", "audio3.wav", "audio4.wav", "custom_audio.wav"]
+
+#---------------------------------------------------Stub--------------------------------------------------#
+
+#One simulated alarm clock: the HTTP API of main 1.6.py for setting, listing, removing and stopping alarms
+#and reading the status, without hardware, ringing or the main display. The alarms are kept in a real
+#AlarmScheduler, so invalid alarms are rejected like on a real clock
+#Faults can be injected to test retries: latency (up to max_latency seconds per request), error_rate (share of
+#requests answered with 503) and drop_rate (share of connections closed without an answer)
+class StubClock:
+
+    def __init__(self, port, host=default_host, max_latency=0, error_rate=0, drop_rate=0, random_source=None):
+        self.port = port
+        self.max_latency = max_latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.random = random_source or random.Random()
+        self.scheduler = alarm_scheduler_module.AlarmScheduler()
+        self.status = {"ring_time": "06:00", "active": False, "ringing": False, "event": "inactive", "version": 0, "brightness": None}
+        self.requests = 0
+        self.routes = {
+            ("GET", status_endpoint): self.handle_status,
+            ("GET", list_alarms_endpoint): self.handle_list_alarms,
+            ("POST", settings_post_endpoint): self.handle_set_alarm,
+            ("POST", stop_alarm_endpoint): self.handle_stop_alarm,
+            ("POST", remove_alarm_endpoint): self.handle_remove_alarm,
+        }
+        self.server = async_http.AsyncHTTPServer(self.handle_request, port, host)
+
+    async def start(self):
+        await self.server.start()
+
+    def close(self):
+        self.server.close()
+
+    async def handle_request(self, handler):
+        self.requests += 1
+        if self.max_latency:
+            await asyncio.sleep(self.random.uniform(0, self.max_latency))
+
+        if (self.random.random() < self.drop_rate):
+            #Like a clock that crashed or lost its network while handling the request
+            handler.detached = True
+            handler.writer.close()
+            return None
+        if (self.random.random() < self.error_rate):
+            return 503, [("Content-type", "text/plain")], b"Simulated failure"
+
+        route = self.routes.get((handler.command, urllib.parse.urlsplit(handler.path).path))
+        if route is None:
+            return 404, [("Content-type", "text/plain")], b"Not found"
+        return route(handler)
+
+    def form(self, handler):
+        return urllib.parse.parse_qs(handler.rfile.read().decode("utf-8"))
+
+    def json_response(self, data, status=200):
+        return status, [("Content-type", "application/json")], json.dumps(data).encode("utf-8")
+
+    def html_response(self, text):
+        return 200, [("Content-type", "text/html")], f"<html><body>{text}</body></html>".encode("utf-8")
+
+    def publish(self, event):
+        next_alarm = self.scheduler.peek()
+        self.status["active"] = next_alarm is not None
+        self.status["ring_time"] = next_alarm[1].ring_time if next_alarm else "06:00"
+        self.status["event"] = event
+        self.status["version"] += 1
+
+    def handle_status(self, handler):
+        status, headers, body = self.json_response(self.status)
+        headers.append(("ETag", f'"{self.status["version"]}"'))
+        return status, headers, body
+
+    def handle_list_alarms(self, handler):
+        alarms = []
+        for due, alarm in self.scheduler.list_alarms():
+            alarm_data = alarm.to_dict()
+            alarm_data["next_ring"] = due.isoformat(timespec="seconds")
+            alarms.append(alarm_data)
+        return self.json_response(alarms)
+
+    def handle_set_alarm(self, handler):
+        form = self.form(handler)
+        ringtone = form.get("ring_tone", [""])[0]
+        if (ringtone not in allowed_ringtones):
+            return 400, [("Content-type", "text/plain")], b"ERROR: specified ringtone is not in allowed_ringtones!"
+        try:
+            alarm = alarm_scheduler_module.Alarm(form.get("ring_time", [""])[0], ringtone, form.get("snooze_time", ["10"])[0], form.get("recurrence", [alarm_scheduler_module.recurrence_once])[0], form.get("interval_days", ["1"])[0], fade_in_seconds=form.get("fade_in", ["0"])[0] or "0")
+        except ValueError as error:
+            return 400, [("Content-type", "text/plain")], f"Invalid alarm settings: {error}".encode("utf-8")
+        self.scheduler.add(alarm)
+        self.publish("alarm_set")
+        return self.html_response(f"Alarm set for {alarm.ring_time}")
+
+    def handle_stop_alarm(self, handler):
+        form = self.form(handler)
+        if (form.get("action", [""])[0] == stop_alarm_command):
+            if not self.scheduler.stop_snoozed():
+                self.scheduler.skip_next()
+            self.publish("stopped")
+        return self.html_response("Alarm stopped")
+
+    def handle_remove_alarm(self, handler):
+        form = self.form(handler)
+        try:
+            alarm_id = int(form.get("id", [""])[0])
+        except ValueError:
+            return self.json_response({"error": "id has to be a number"}, 400)
+        if not self.scheduler.remove(alarm_id):
+            return self.json_response({"error": f"Unknown alarm {alarm_id}"}, 404)
+        self.publish("removed")
+        return self.json_response({"removed": alarm_id})
+
+#Every clock needs a listening socket and every pooled connection two file descriptors on this machine
+def raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if (soft != hard):
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+#Starts count clocks on consecutive ports on the running event loop, returns the StubClocks
+async def start_stub_fleet(count, base_port=default_base_port, host=default_host, max_latency=0, error_rate=0, drop_rate=0, seed=None):
+    random_source = random.Random(seed)
+    clocks = [StubClock(base_port + index, host, max_latency, error_rate, drop_rate, random_source) for index in range(count)]
+    for clock in clocks:
+        await clock.start()
+    return clocks
+
+async def serve(arguments):
+    clocks = await start_stub_fleet(arguments.clocks, arguments.base_port, arguments.host, arguments.latency_ms / 1000, arguments.error_rate, arguments.drop_rate, arguments.seed)
+    print(f"Serving {len(clocks)} simulated clocks on {arguments.host}:{arguments.base_port}-{arguments.base_port + len(clocks) - 1}", flush=True)
+    try:
+        await asyncio.get_running_loop().create_future()
+    finally:
+        for clock in clocks:
+            clock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs many simulated alarm clocks (the HTTP API of the main program) for testing tools/fleet_controller.py")
+    parser.add_argument("--clocks", type=int, default=default_clocks)
+    parser.add_argument("--base-port", type=int, default=default_base_port)
+    parser.add_argument("--host", default=default_host)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Every request is delayed by up to this many milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of requests answered with 503")
+    parser.add_argument("--drop-rate", type=float, default=0, help="Share of requests whose connection is closed without an answer")
+    parser.add_argument("--seed", type=int, help="Seed for the injected faults")
+    arguments = parser.parse_args()
+
+    raise_file_limit()
+    try:
+        asyncio.run(serve(arguments))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import os
+import io
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import urllib.parse
+import importlib.util
+from datetime import datetime, timedelta
+
+#Run without the real hardware, must be set before the scripts are loaded
+os.environ.setdefault("ALARM_CLOCK_FAKE_GPIO", "1")
+os.environ.setdefault("ALARM_CLOCK_FAKE_LCD", "1")
+os.environ.setdefault("ALARM_CLOCK_AUDIO_SINK", "null")
+
+#Allow running the tool from any directory, the scripts load their pages relative to the repository
+repository = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repository)
+os.chdir(repository)
+import clock_source
+import audio_engine
+import alarm_history
+import alarm_logging
+import status_stream
+import alarm_scheduler as alarm_scheduler_module
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+default_days = 28 #Simulated days
+default_start = "2026-03-23" #A monday, the week daylight saving time starts in Europe
+default_timezone = "Europe/Berlin"
+default_clock_steps = 20 #Wall clock steps (like NTP corrections) at random moments
+max_clock_step = 900 #Seconds a step moves the wall clock at most (forward or back)
+reaction_time = 45 #Seconds the simulated user needs to press snooze or stop
+snoozes_per_ring = 2 #Every alarm is snoozed this often and then stopped
+drift_tolerance = 0.00001 #Seconds a ring may be off, the simulated event loop moves in steps of at least a microsecond
+
+#Alarms set over POST /send_data at the start of the simulation
+replay_alarms = [
+    {"ring_time": "06:30", "ring_tone": "main_audio.wav", "snooze_time": "300", "recurrence": alarm_scheduler_module.recurrence_daily},
+    {"ring_time": "07:15", "ring_tone": "audio1.wav", "snooze_time": "600", "recurrence": alarm_scheduler_module.recurrence_weekdays},
+    {"ring_time": "23:59", "ring_tone": "audio2.wav", "snooze_time": "120", "recurrence": alarm_scheduler_module.recurrence_every_n_days, "interval_days": "3"}, #Snoozes over midnight
+    {"ring_time": "12:00", "ring_tone": "audio3.wav", "snooze_time": "60", "recurrence": alarm_scheduler_module.recurrence_once},
+    {"ring_time": "02:30", "ring_tone": "audio4.wav", "snooze_time": "60", "recurrence": alarm_scheduler_module.recurrence_daily}, #Does not exist the night summer time starts
+]
+
+#---------------------------------------------------Replay------------------------------------------------#
+
+#Loads a script by file name (the names contain spaces and dots, so import does not work)
+def load_script(module_name, file_name):
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(repository, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+#Stand-in for BaseHTTPRequestHandler with what the route functions of the main program use
+class ReplayRequest:
+
+    def __init__(self, path, form=None):
+        body = urllib.parse.urlencode(form or {}).encode("utf-8")
+        self.path = path
+        self.headers = {"Content-Length": str(len(body))}
+        self.rfile = io.BytesIO(body)
+        self.close_connection = False
+
+#Sends a request through the API route table of the main program, returns the status code
+def api_request(main, method, path, form=None):
+    route = main.api_routes[(method, urllib.parse.urlsplit(path).path)]
+    return route(ReplayRequest(path, form))[0]
+
+#Regular ring times every alarm should have in [start, end), computed without the scheduler
+def expected_rings(start, end):
+    expected = set()
+    for alarm in replay_alarms:
+        hour, minute = (int(part) for part in alarm["ring_time"].split(":"))
+        day = start
+        while day < end:
+            ring = day.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            recurrence = alarm["recurrence"]
+            if (ring > start and ring < end and not (recurrence == alarm_scheduler_module.recurrence_weekdays and ring.weekday() >= 5)):
+                expected.add(ring)
+                if (recurrence == alarm_scheduler_module.recurrence_once):
+                    break
+                if (recurrence == alarm_scheduler_module.recurrence_every_n_days):
+                    day += timedelta(days=int(alarm["interval_days"]))
+                    continue
+            day += timedelta(days=1)
+    return expected
+
+#Drives the main program and the main display through a simulated timeline and checks what they do
+class AlarmReplay:
+
+    def __init__(self, main, display, clock):
+        self.main = main
+        self.display = display
+        self.clock = clock
+        self.regular_rings = [] #Due times of the alarms that rang
+        self.snoozed_rings = 0
+        self.snoozes_in_a_row = 0
+        self.snoozes_sent = 0
+        self.stops_sent = 0
+        self.expected_snooze_ring = None #Monotonic time, snoozes are durations
+        self.skipped_windows = [] #(before, after) of every forward wall clock step
+        self.latest_wall_time = clock.now()
+        self.max_drift = 0
+        self.errors = []
+
+    def error(self, message):
+        self.errors.append(f"{self.clock.now():%Y-%m-%d %H:%M:%S} {message}")
+
+    def set_alarms(self):
+        for alarm in replay_alarms:
+            status = api_request(self.main, "POST", self.main.settings_post_endpoint, alarm)
+            if (status != 200):
+                self.error(f"POST {self.main.settings_post_endpoint} {alarm} -> {status}")
+
+    #Listener of the status broadcaster: every status change of the main program ends up here
+    def on_status(self, event, state):
+        now = self.clock.now()
+
+        #The main display renders from the same status
+        self.display.alarm_active = state["active"]
+        self.display.ringing = state["ringing"]
+        self.display.ring_time = state["ring_time"]
+        self.display.write_to_display(*self.display.render_clock_screen())
+
+        if (event == status_stream.event_ringing):
+            self.check_ring(now)
+        elif (event == status_stream.event_stopped):
+            self.snoozes_in_a_row = 0
+            self.expected_snooze_ring = None
+
+    def check_ring(self, now):
+        line1, line2 = self.display.main_display.lines()
+        if (not line1.rstrip().endswith(f"{now:%H:%M}") or line2.strip() != "(*) Wecker (*)"):
+            self.error(f"Display shows {line1!r} / {line2!r} while ringing")
+
+        if self.expected_snooze_ring is not None:
+            self.snoozed_rings += 1
+            if (abs(self.clock.monotonic() - self.expected_snooze_ring) > drift_tolerance):
+                self.error(f"Snoozed alarm rang {self.clock.monotonic() - self.expected_snooze_ring:.3f} s off")
+        else:
+            #Alarms ring exactly at their due time, unless a wall clock step jumped over it: then right after the step
+            due = self.main.alarm_scheduler.last_due
+            self.regular_rings.append(due)
+            drift = self.clock.time() - due.timestamp()
+            jumped_over = any(before < due <= after and now >= after for before, after in self.skipped_windows)
+            if not jumped_over:
+                self.max_drift = max(self.max_drift, abs(drift))
+                if (abs(drift) > drift_tolerance):
+                    self.error(f"Alarm due at {due} rang {drift:.3f} s late")
+
+        #The user reacts after reaction_time: snooze a few times, then stop
+        if (self.snoozes_in_a_row < snoozes_per_ring):
+            self.snoozes_in_a_row += 1
+            self.clock.call_later(reaction_time, self.snooze)
+        else:
+            self.clock.call_later(reaction_time, self.stop)
+
+    def stop(self):
+        api_request(self.main, "POST", self.main.stop_alarm_endpoint, {"action": self.main.stop_alarm_command})
+        self.stops_sent += 1
+
+    def snooze(self):
+        api_request(self.main, "POST", self.main.snooze_alarm_endpoint)
+        self.snoozes_sent += 1
+        snooze_duration = next(int(alarm["snooze_time"]) for alarm in replay_alarms if alarm["ring_time"] == self.main.main_display_status["ring_time"])
+        self.expected_snooze_ring = self.clock.monotonic() + snooze_duration
+
+    def step_clock(self, seconds):
+        before = self.clock.now()
+        self.latest_wall_time = max(self.latest_wall_time, before)
+        self.clock.step(seconds)
+        if (seconds > 0):
+            self.skipped_windows.append((before, self.clock.now()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays days of alarms against a simulated clock as fast as possible")
+    parser.add_argument("--days", type=int, default=default_days)
+    parser.add_argument("--start", default=default_start, help="First simulated day (YYYY-MM-DD)")
+    parser.add_argument("--timezone", default=default_timezone, help="Local timezone of the simulated alarm clock")
+    parser.add_argument("--clock-steps", type=int, default=default_clock_steps, help="Number of random wall clock steps")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the wall clock steps")
+    parser.add_argument("--verbose", action="store_true", help="Show the log of the alarm clock scripts")
+    arguments = parser.parse_args()
+
+    #Local time conversions (and daylight saving time) follow TZ
+    os.environ["TZ"] = arguments.timezone
+    time.tzset()
+
+    start = datetime.strptime(arguments.start, "%Y-%m-%d")
+    end = start + timedelta(days=arguments.days)
+    clock = clock_source.SimulatedClock(start, end)
+    alarm_logging.setup_logging("DEBUG" if arguments.verbose else "CRITICAL")
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        main_program = load_script("alarm_clock_main", "main 1.6.py")
+        display = load_script("alarm_clock_display", "main_display1.2.py")
+
+        #Everything runs on the simulated clock, the status files go to a temporary directory
+        main_program.clock = clock
+        main_program.alarm_scheduler = alarm_scheduler_module.AlarmScheduler(clock)
+        main_program.webserver_status_file = os.path.join(temp_directory, "alarm_webserver_status.status")
+        #Only ringtones in the ringtone directory can be picked, empty files are enough: they can't be decoded,
+        #so the built-in ringtone rings on an audio output that discards it
+        main_program.config = main_program.config._replace(ringtone_directory=temp_directory)
+        for alarm in replay_alarms:
+            open(os.path.join(temp_directory, alarm["ring_tone"]), "w").close()
+        main_program.audio = audio_engine.AudioEngine(audio_engine.NullSink(realtime=False))
+        main_program.event_history = alarm_history.EventHistory(os.path.join(temp_directory, "alarm_history.bin"), capacity=100 * (arguments.days + 1))
+        display.clock = clock
+        display.init_display()
+
+        replay = AlarmReplay(main_program, display, clock)
+        main_program.status_broadcaster.add_listener(replay.on_status)
+        clock.call_at(start, replay.set_alarms)
+
+        #The steps are scheduled on the monotonic clock, so they happen at the same moments in every run
+        random_steps = random.Random(arguments.seed)
+        for _ in range(arguments.clock_steps):
+            step = random_steps.choice([-1, 1]) * random_steps.randint(1, max_clock_step)
+            clock.call_later(random_steps.uniform(0, arguments.days * 24 * 3600), lambda step=step: replay.step_clock(step))
+
+        #The alarm loop runs on an event loop whose timers use the simulated clock
+        loop = clock.new_event_loop()
+        asyncio.set_event_loop(loop)
+        main_program.bind_event_loop(loop)
+
+        start_time = time.perf_counter()
+        try:
+            loop.run_until_complete(main_program.run_alarm_loop())
+        except clock_source.SimulationFinished:
+            pass
+        elapsed = time.perf_counter() - start_time
+
+        #Let the tasks that were still waiting end cleanly, the time does not move anymore
+        clock.end = None
+        pending_tasks = asyncio.all_tasks(loop)
+        for task in pending_tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending_tasks, return_exceptions=True))
+        loop.close()
+
+        #The history has every ring, snooze and stop of the simulated user
+        history = main_program.event_history
+        history_counts = {kind: len(history.query(kind=kind, limit=history.capacity)) for kind in (alarm_history.event_rang, alarm_history.event_snoozed, alarm_history.event_stopped)}
+        stop_snoozes = {event["snoozes"] for event in history.query(kind=alarm_history.event_stopped, limit=history.capacity)}
+        stats = history.stats(arguments.days, clock.time())
+        history.close()
+
+    expected = expected_rings(start, max(replay.latest_wall_time, clock.now()))
+    rang = set(replay.regular_rings)
+    for missing in sorted(expected - rang):
+        replay.errors.append(f"Missing ring at {missing}")
+    for unexpected in sorted(rang - expected):
+        replay.errors.append(f"Unexpected ring at {unexpected}")
+    if (len(rang) != len(replay.regular_rings)):
+        replay.errors.append("An alarm rang twice at the same time")
+    expected_counts = {alarm_history.event_rang: len(replay.regular_rings) + replay.snoozed_rings, alarm_history.event_snoozed: replay.snoozes_sent, alarm_history.event_stopped: replay.stops_sent}
+    if (history_counts != expected_counts):
+        replay.errors.append(f"Event history has {history_counts}, expected {expected_counts}")
+    if (stop_snoozes - {snoozes_per_ring}):
+        replay.errors.append(f"Event history has stops after {sorted(stop_snoozes)} snoozes, expected {snoozes_per_ring}")
+
+    print(f"Replayed {arguments.days} days ({start:%Y-%m-%d} to {end:%Y-%m-%d}) in {elapsed:.2f} s ({arguments.days / elapsed:.0f} simulated days per second)")
+    print(f"{len(replay.regular_rings)} alarms rang, {replay.snoozed_rings} rang again after snoozing, {arguments.clock_steps} wall clock steps ({arguments.timezone})")
+    print(f"Max ring drift: {replay.max_drift * 1000:.3f} ms (alarms a clock step jumped over not counted)")
+    print(f"Event history: {stats['wakes']} wakes, {stats['snoozes_per_day']} snoozes per day, median time to stop {stats['time_to_stop']['median']} s")
+    for error in replay.errors:
+        print(f"\033[91m {error}\033[0m")
+    if replay.errors:
+        sys.exit(1)
+    print("\033[92mNo deviations\033[0m")
+
+if __name__ == "__main__":
+    main()
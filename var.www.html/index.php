@@ -1,9 +1,18 @@
 <?php
 $alarm_status_file = "/home/alarm_clock/status_files/alarm_webserver_status.status";
+$config_file = "/home/alarm_clock/alarm_clock.conf";
 $settings_page = "settings_page.html";
 $stop_page = "stop_page.html";
+$stats_page = "stats_page.html";
 
-if (file_exists($alarm_status_file)) {
+//Port of the alarm API, the pages send their requests there (same file as the alarm clock uses, see alarm_config.py)
+$config = file_exists($config_file) ? parse_ini_file($config_file, true, INI_SCANNER_RAW) : false;
+$api_port = isset($config["api"]["api_server_port"]) ? intval($config["api"]["api_server_port"]) : 8080;
+
+//index.php?page=stats shows the wake statistics (GET /history/stats of the alarm API)
+if (isset($_GET["page"]) && $_GET["page"] == "stats") {
+    include $stats_page;
+} elseif (file_exists($alarm_status_file)) {
 
     $file_content = file_get_contents($alarm_status_file);
 
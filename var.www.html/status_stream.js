@@ -0,0 +1,36 @@
+//Shared by the settings and the stop page, uses the api constant the page defines before calling watch_status()
+
+//Reload when the alarm is set or stopped somewhere else (main display, buttons, other browser)
+//The alarm clock pushes every status change, EventSource reconnects on its own
+//Browsers without EventSource fall back to long polling /status
+function watch_status(page_active, on_status) {
+    const check = (status) => {
+        if (status.active !== page_active) {
+            window.location.reload();
+        } else if (on_status) {
+            on_status(status);
+        }
+    };
+
+    if (window.EventSource) {
+        const stream = new EventSource(`${api}/status_stream`);
+        stream.addEventListener('status', (event) => check(JSON.parse(event.data)));
+        return;
+    }
+
+    let version = "";
+    const poll = async () => {
+        try {
+            const response = await fetch(`${api}/status?version=${version}`);
+            if (response.status === 200) {
+                const status = await response.json();
+                version = status.version;
+                check(status);
+            }
+        } catch (error) {
+            await new Promise((resolve) => setTimeout(resolve, 2000));
+        }
+        poll();
+    };
+    poll();
+}
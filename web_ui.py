@@ -0,0 +1,194 @@
+import os
+import re
+import gzip
+import hashlib
+import threading
+import logging
+from collections import namedtuple
+import alarm_metrics
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------Settings------------------------------------------------#
+
+#Edit if needed
+compression_level = 9 #Assets are compressed once when they are loaded, so the slowest level costs nothing per request
+min_compression_gain = 0.9 #The compressed copy is only kept if it is smaller than this share of the file
+api_port_placeholder = "<?php echo $api_port; ?>" #Filled in by index.php when nginx serves the pages, by page() here
+
+#Files the web pages load, served with their content type (every other file in the web directory stays private)
+content_types = {
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".ico": "image/x-icon",
+    ".gif": "image/gif",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".svg": "image/svg+xml",
+}
+compressed_types = {"image/gif", "image/png", "image/jpeg"} #Already compressed, gzip would only cost time
+page_content_type = "text/html; charset=utf-8"
+
+#Cache-Control of the responses
+page_cache_control = "no-cache" #Pages depend on the alarm state, the browser revalidates them (304 while nothing changed)
+fingerprinted_cache_control = "public, max-age=31536000, immutable" #Asset URLs with ?v=<fingerprint> change with the file
+
+#Metrics (see alarm_metrics.py)
+web_responses = alarm_metrics.registry.counter("alarm_web_responses_total", "Pages and assets of the web interface by how they were sent (gzip, identity, not_modified)", ["kind", "encoding"])
+
+#-------------------------------------------------Assets--------------------------------------------------#
+
+#A file ready to be sent: gzip_body is None if compressing did not pay off
+#etag is the fingerprint of the content, the compressed copy is sent with etag + "-gzip" (it is another representation)
+Asset = namedtuple("Asset", ["body", "gzip_body", "content_type", "etag"])
+
+def make_asset(body, content_type):
+    gzip_body = None
+    if content_type not in compressed_types:
+        #mtime=0 keeps the compressed bytes the same for the same file
+        compressed = gzip.compress(body, compression_level, mtime=0)
+        if (len(compressed) < len(body) * min_compression_gain):
+            gzip_body = compressed
+    return Asset(body, gzip_body, content_type, hashlib.sha1(body).hexdigest()[:16])
+
+#Returns True if the client accepts gzip (Accept-Encoding: gzip, without q=0)
+def accepts_gzip(accept_encoding):
+    for coding in accept_encoding.lower().split(","):
+        name, _, parameters = coding.strip().partition(";")
+        if (name.strip() in ("gzip", "*")):
+            return parameters.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+#Returns (status, content_type, body, headers) for an asset, 304 if the client has it already
+#(If-None-Match), the compressed copy if the client accepts gzip
+def respond(asset, headers, cache_control, kind="asset"):
+    use_gzip = asset.gzip_body is not None and accepts_gzip(headers.get("Accept-Encoding", ""))
+    etag = f'"{asset.etag}-gzip"' if use_gzip else f'"{asset.etag}"'
+    response_headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+    known = [tag.strip().replace("W/", "", 1) for tag in headers.get("If-None-Match", "").split(",")]
+    if (etag in known or "*" in known):
+        web_responses.inc(kind=kind, encoding="not_modified")
+        return 304, asset.content_type, b"", response_headers
+
+    if use_gzip:
+        response_headers["Content-Encoding"] = "gzip"
+        web_responses.inc(kind=kind, encoding="gzip")
+        return 200, asset.content_type, asset.gzip_body, response_headers
+    web_responses.inc(kind=kind, encoding="identity")
+    return 200, asset.content_type, asset.body, response_headers
+
+#---------------------------------------------------Web UI------------------------------------------------#
+
+#Serves the web pages (var.www.html) from memory, like nginx and index.php did
+#Every file is read and compressed once and kept until it changes on disk (one stat() per request tells), so a
+#request only costs a dict lookup. Pages get the API port filled in and the URLs of their assets a fingerprint
+#(?v=<hash of the file>), so the browser keeps the assets forever and only revalidates the page itself
+#get_cached() and page_cached() never read files and can be used on the event loop, get() and page() read
+#and compress what is missing (slow for big files) and belong in a worker thread
+#All methods can be called from any thread
+class WebUI:
+
+    def __init__(self):
+        self.assets = {} #path -> (file state, Asset)
+        self.pages = {} #(path, replacements) -> (file state, fingerprints, Asset)
+        self.lock = threading.Lock()
+
+    #Returns the file path of a URL path in directory, None if it is not a file the pages may load
+    def asset_path(self, directory, url_path):
+        relative = url_path.lstrip("/")
+        if (os.path.splitext(relative)[1].lower() not in content_types):
+            return None
+        parts = relative.split("/")
+        if any(part in ("", ".", "..") or part.startswith(".") for part in parts):
+            return None
+        return os.path.join(directory, *parts)
+
+    def _file_state(self, path):
+        try:
+            status = os.stat(path)
+        except OSError:
+            return None
+        return status.st_mtime_ns, status.st_size
+
+    #Returns the Asset of a URL path if it is loaded and up to date, otherwise None
+    def get_cached(self, directory, url_path):
+        path = self.asset_path(directory, url_path)
+        if path is None:
+            return None
+        with self.lock:
+            cached = self.assets.get(path)
+        if (cached is not None and cached[0] == self._file_state(path)):
+            return cached[1]
+        return None
+
+    #Returns the Asset of a URL path, loads and compresses it if needed, None if there is no such file
+    def get(self, directory, url_path):
+        asset = self.get_cached(directory, url_path)
+        if asset is not None:
+            return asset
+        path = self.asset_path(directory, url_path)
+        if path is None:
+            return None
+
+        state = self._file_state(path)
+        try:
+            with open(path, "rb") as asset_file:
+                body = asset_file.read()
+        except OSError:
+            return None
+        asset = make_asset(body, content_types[os.path.splitext(path)[1].lower()])
+        with self.lock:
+            self.assets[path] = (state, asset)
+        log.debug("Loaded '%s' (%s bytes, %s compressed)", path, len(body), len(asset.gzip_body) if asset.gzip_body else "not")
+        return asset
+
+    #Loads every asset in directory, so the first visitor does not wait for the compression
+    def preload(self, directory):
+        for root, directories, files in os.walk(directory):
+            directories[:] = [name for name in directories if not name.startswith(".")]
+            for name in files:
+                url_path = os.path.relpath(os.path.join(root, name), directory).replace(os.sep, "/")
+                if self.asset_path(directory, url_path) is not None:
+                    self.get(directory, url_path)
+
+    #Returns the rendered page if it is up to date (page file and the assets it links unchanged), otherwise None
+    def page_cached(self, directory, page, replacements):
+        path = os.path.join(directory, page)
+        with self.lock:
+            cached = self.pages.get((path, tuple(sorted(replacements.items()))))
+        if (cached is None or cached[0] != self._file_state(path)):
+            return None
+        for url_path, fingerprint in cached[1]:
+            asset = self.get_cached(directory, url_path)
+            if (asset is None or asset.etag != fingerprint):
+                return None
+        return cached[2]
+
+    #Returns the page (file name in directory) as Asset with the placeholders replaced and its asset URLs fingerprinted
+    #Raises OSError if the page can't be read
+    def page(self, directory, page, replacements):
+        cached = self.page_cached(directory, page, replacements)
+        if cached is not None:
+            return cached
+
+        path = os.path.join(directory, page)
+        state = self._file_state(path)
+        with open(path, "r", encoding="utf-8") as page_file:
+            content = page_file.read()
+        for placeholder, value in replacements.items():
+            content = content.replace(placeholder, str(value))
+
+        fingerprints = []
+        def add_fingerprint(match):
+            asset = self.get(directory, match.group(2))
+            if asset is None:
+                return match.group(0)
+            fingerprints.append((match.group(2), asset.etag))
+            return f'{match.group(1)}="{match.group(2)}?v={asset.etag}"'
+        content = re.sub(r'(href|src)="([^":?#]+)"', add_fingerprint, content)
+
+        asset = make_asset(content.encode("utf-8"), page_content_type)
+        with self.lock:
+            self.pages[(path, tuple(sorted(replacements.items())))] = (state, fingerprints, asset)
+        return asset